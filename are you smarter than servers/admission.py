@@ -0,0 +1,113 @@
+import logging
+import os
+import time
+import unittest
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_ROOMS = int(os.environ.get('MAX_ROOMS', 100))
+HOST_ROOM_BURST = int(os.environ.get('HOST_ROOM_BURST', 5))            # rooms a client may create back to back
+HOST_ROOM_RATE = float(os.environ.get('HOST_ROOM_RATE', 10)) / 60.0   # rooms per minute, refilled continuously
+MAX_TRACKED_HOSTS = 10000  # least recently seen clients are forgotten beyond this
+
+class RoomAdmission:
+    """Decides in constant time whether a new room may be created.
+
+    Keeps a running count of rooms, reconciled from the database at startup,
+    and a token bucket per client so one client can't use up every slot.
+    admit() reserves a slot up front; release() gives it back when creation
+    fails or a room is deleted.
+    """
+
+    def __init__(self, max_rooms: int = MAX_ROOMS, burst: int = HOST_ROOM_BURST, rate: float = HOST_ROOM_RATE):
+        self.max_rooms = max_rooms
+        self.burst = burst
+        self.rate = rate
+        self.active = 0
+        # client -> (tokens, last refill time), oldest first
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+
+    def reset(self, active: int):
+        """Set the room count, e.g. from count_rooms() at startup."""
+        self.active = active
+        logger.debug("Room admission reset to %s/%s rooms", active, self.max_rooms)
+
+    @property
+    def full(self) -> bool:
+        return self.active >= self.max_rooms
+
+    def _take_token(self, client: str, now: float) -> bool:
+        tokens, updated = self._buckets.pop(client, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > MAX_TRACKED_HOSTS:
+            self._buckets.popitem(last=False)
+        return allowed
+
+    def admit(self, client: Optional[str], now: Optional[float] = None) -> Tuple[bool, str]:
+        """Reserve a slot for a new room. Returns (admitted, reason)."""
+        if self.full:
+            return False, 'Maximum number of rooms reached. Please try again later.'
+        if client is not None and not self._take_token(client, time.time() if now is None else now):
+            return False, 'Too many rooms created. Please wait before creating another.'
+        self.active += 1
+        return True, 'Admitted'
+
+    def release(self, count: int = 1):
+        """Give back slots for rooms that were deleted or never created."""
+        self.active = max(0, self.active - count)
+
+    def prune(self, now: Optional[float] = None):
+        """Forget clients whose buckets have refilled, they behave like new ones."""
+        now = time.time() if now is None else now
+        idle = (self.burst / self.rate) if self.rate > 0 else float('inf')
+        for client in [c for c, (_, updated) in self._buckets.items() if now - updated >= idle]:
+            del self._buckets[client]
+
+# Unit tests
+
+class TestRoomAdmission(unittest.TestCase):
+
+    def test_capacity(self):
+        admission = RoomAdmission(max_rooms=2, burst=10, rate=1.0)
+        self.assertTrue(admission.admit('a')[0])
+        self.assertTrue(admission.admit('b')[0])
+        admitted, message = admission.admit('c')
+        self.assertFalse(admitted)
+        self.assertIn('Maximum', message)
+        admission.release()
+        self.assertTrue(admission.admit('c')[0])
+        self.assertEqual(admission.active, 2)
+
+    def test_rate_limit_per_client(self):
+        admission = RoomAdmission(max_rooms=100, burst=2, rate=1.0)
+        self.assertTrue(admission.admit('a', now=0.0)[0])
+        self.assertTrue(admission.admit('a', now=0.0)[0])
+        admitted, message = admission.admit('a', now=0.5)
+        self.assertFalse(admitted)
+        self.assertIn('Too many', message)
+        # Other clients are unaffected, and the bucket refills over time
+        self.assertTrue(admission.admit('b', now=0.5)[0])
+        self.assertTrue(admission.admit('a', now=1.5)[0])
+        # Rejected requests don't hold a slot
+        self.assertEqual(admission.active, 4)
+
+    def test_reset_and_prune(self):
+        admission = RoomAdmission(max_rooms=10, burst=1, rate=1.0)
+        admission.reset(10)
+        self.assertTrue(admission.full)
+        admission.release(3)
+        self.assertEqual(admission.active, 7)
+        admission.admit('a', now=0.0)
+        admission.prune(now=0.5)
+        self.assertIn('a', admission._buckets)
+        admission.prune(now=1.0)
+        self.assertNotIn('a', admission._buckets)
+
+if __name__ == '__main__':
+    unittest.main()
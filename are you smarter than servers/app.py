@@ -1,5 +1,7 @@
 import asyncio
+import functools
 import logging
+import os
 import random
 import string
 import time
@@ -7,42 +9,92 @@ from typing import List, Optional, Tuple
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response
+from fastapi.responses import JSONResponse as BaseJSONResponse
 from fastapi_socketio import SocketManager
 from pydantic import BaseModel, Field, validator
 
 import uvicorn
 from room_db import (
-    add_or_update_player,
-    add_player_to_room,
-    add_room,
-    delete_room,
-    end_game,
+    close_pool,
+    delete_expired_rooms,
+    delete_old_events,
     get_all_rooms,
     get_game_history,
-    get_player_scores,
-    get_player_statistics,
-    get_room,
-    increment_player_win,
-    init_db,
-    remove_player_from_room,
-    start_game,
-    update_player_score,
-    update_room,
+    get_player_history,
+    get_player_summary,
+    get_room_codes,
+    load_leaderboard,
+    migrate_db,
 )
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.StreamHandler()
-    ]
+from admission import RoomAdmission
+from broadcast import BroadcastScheduler
+from cache import TTLCache
+from db_executor import db
+import json_codec
+from log_config import configure_logging, stop_logging
+from event_log import GameEventLog, replay
+from leaderboard import Leaderboard
+from metrics import MetricsMiddleware, SamplingProfiler, registry
+from cluster import (
+    WORKER_ID,
+    WORKERS,
+    MisdirectedRoom,
+    check_owner,
+    make_backend,
+    make_client_manager,
+    owns,
+    worker_for,
 )
+from question_bank import FixtureSource, QuestionBank
+from reconnect import DisconnectGrace
+from room_codes import RoomCodeAllocator
+from room_state import RoomStateStore
+from sessions import SessionRegistry
+
+# Configure logging: LOG_LEVEL, LOG_LEVELS, LOG_FORMAT and LOG_RATE_LIMIT, see log_config
+configure_logging()
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-sio = SocketManager(app=app)
+class JSONResponse(BaseJSONResponse):
+    """JSONResponse encoded by json_codec, which uses orjson when it is installed."""
+
+    def render(self, content) -> bytes:
+        return json_codec.dumps(content)
+
+app = FastAPI(default_response_class=JSONResponse)
+# With SOCKETIO_MESSAGE_QUEUE set, room emits fan out to clients on every worker.
+# Packets are encoded with json_codec too, once per emit whatever the room size.
+sio = SocketManager(app=app, client_manager=make_client_manager(), json=json_codec.SocketIOJSON)
+
+class SocketIOStats:
+    """Client counts and send queues for this worker's Socket.IO clients.
+
+    python-socketio has no public API for connection counts or send queues,
+    so these read its Engine.IO internals. Every such read is in this class,
+    so an upgrade that changes them breaks only here.
+    """
+
+    def __init__(self, server):
+        self.server = server  # the socketio.AsyncServer
+
+    def connections(self) -> int:
+        return len(self.server.eio.sockets)
+
+    def recipients(self, target: str) -> int:
+        """Clients on this worker in a room, or 1 for a connected sid."""
+        return sum(1 for _ in self.server.manager.get_participants('/', target))
+
+    def backlog(self, room_code: str) -> List[Tuple[str, int]]:
+        """(sid, packets waiting to be sent to it) for the clients in a room on this worker."""
+        sockets = self.server.eio.sockets
+        backlog = []
+        for sid, eio_sid in self.server.manager.get_participants('/', room_code):
+            socket = sockets.get(eio_sid)
+            backlog.append((sid, socket.queue.qsize() if socket is not None else 0))
+        return backlog
+
+sio_stats = SocketIOStats(app.sio)
 
 # CORS Middleware Configuration
 app.add_middleware(
@@ -52,20 +104,85 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so the latency includes every other middleware
+app.add_middleware(MetricsMiddleware)
+
+# Create or upgrade the database in place; rooms, the leaderboard, player
+# stats and the event log all survive a restart
+migrate_db()
+
+# Live room state, written behind to the database
+room_store = RoomStateStore()
+room_store.owner_check = check_owner
+
+# Player rankings, loaded at startup. A single worker sees every score change
+# and keeps it up to date through room_store. With several workers each one
+# only sees its own rooms' changes, so instead every worker reloads it from the
+# shared leaderboard table every LEADERBOARD_REFRESH seconds.
+LEADERBOARD_REFRESH = float(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 5))
+leaderboard = Leaderboard()
+if WORKERS == 1:
+    room_store.leaderboard = leaderboard
+
+# Per-player totals for /get_player_statistics, dropped when the player finishes a game.
+# Only a single worker sees every game end, so with several the totals are read from player_stats each time.
+player_summaries = TTLCache(max_size=4096, ttl=30.0) if WORKERS == 1 else None
+
+def invalidate_player_summaries(room):
+    if player_summaries is None:
+        return
+    for player_name in room.players:
+        player_summaries.invalidate(player_name)
+
+room_store.on_game_over = invalidate_player_summaries
+
+# Append-only history of every room, written in the background
+event_log = GameEventLog()
+room_store.event_log = event_log
+background_tasks = set()
+
+# Room count and per-client rate limits for create_room; MAX_ROOMS comes from the environment
+room_admission = RoomAdmission()
+cleanup_task: Optional[asyncio.Task] = None
 
-# Initialize the database
-init_db()
+# Collision-free room codes; existing rooms are reserved at startup
+room_codes = RoomCodeAllocator()
 
-# Thread-safe shared data structures
-session_to_player = {}
-used_room_codes = set()
-used_room_codes_lock = asyncio.Lock()
-session_to_player_lock = asyncio.Lock()
+# Socket.IO session -> player, and claimed room codes, shared across workers
+cluster_backend = make_backend()
+
+# This worker's Socket.IO sessions, indexed by sid and by room and player
+sessions = SessionRegistry()
 
 # Constants
-MAX_ROOMS = 100
 INACTIVITY_THRESHOLD = 600  # 10 minutes in seconds
 CLEANUP_INTERVAL = 300      # 5 minutes in seconds
+EVENT_RETENTION = int(os.environ.get('EVENT_RETENTION_DAYS', 30)) * 86400  # seconds game events are kept
+DIFFICULTIES = ['easy', 'medium', 'hard']
+QUESTION_FIXTURE = os.environ.get('QUESTION_FIXTURE')  # JSON file of questions, serves offline
+# Accept is_correct from clients that grade themselves; lets any client score points, so off by default
+ALLOW_CLIENT_GRADING = os.environ.get('ALLOW_CLIENT_GRADING', '0') == '1'
+
+# Question bank, preloaded in the background and shared by all rooms
+question_bank = QuestionBank(FixtureSource(path=QUESTION_FIXTURE) if QUESTION_FIXTURE else None)
+
+# Metrics, served at /metrics. HTTP latency comes from MetricsMiddleware and
+# database timings from db_executor; these cover Socket.IO and live state.
+SIO_HANDLER_SECONDS = registry.histogram(
+    'socketio_handler_duration_seconds', 'Socket.IO event handler latency.', ('event',))
+SIO_EMITS = registry.counter('socketio_emits_total', 'Socket.IO emits by event.', ('event',))
+SIO_RECIPIENTS = registry.counter(
+    'socketio_emit_recipients_total', 'Messages sent to clients on this worker by Socket.IO emits.', ('event',))
+registry.gauge('active_rooms', 'Rooms resident in memory.').set_function(lambda: len(room_store))
+registry.gauge('socketio_connections', 'Connected Socket.IO clients.').set_function(lambda: sio_stats.connections())
+registry.gauge('socketio_sessions', 'Socket.IO clients joined to a room.').set_function(lambda: len(sessions))
+registry.gauge('reconnect_holds', 'Disconnected players still holding their place.').set_function(lambda: len(departures))
+registry.gauge('event_log_pending', 'Game events waiting to be written.').set_function(lambda: len(event_log))
+
+# Sampling profiler, started and stopped at runtime through /debug/profiler
+# by callers that send PROFILER_TOKEN; disabled when it isn't set
+PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN')
+profiler = SamplingProfiler()
 
 # Pydantic Models
 
@@ -78,7 +195,7 @@ class CreateRoomRequest(BaseModel):
 
     @validator('difficulty')
     def validate_difficulty(cls, v):
-        if v not in ['easy', 'medium', 'hard']:
+        if v not in DIFFICULTIES:
             raise ValueError('Invalid difficulty. Must be one of: easy, medium, hard.')
         return v
 
@@ -106,7 +223,11 @@ class EndGameRequest(BaseModel):
 class SubmitAnswerRequest(BaseModel):
     room_code: str
     player_name: str
-    is_correct: bool
+    # Send the chosen answer for a deck question and let the server grade it.
+    # Older clients report is_correct directly, accepted only with ALLOW_CLIENT_GRADING
+    question_index: Optional[int] = None
+    answer: Optional[str] = None
+    is_correct: Optional[bool] = None
 
 class PostLobbyWinsRequest(BaseModel):
     player_name: str
@@ -114,46 +235,134 @@ class PostLobbyWinsRequest(BaseModel):
 
 # Helper Functions
 
-def generate_room_code() -> str:
-    """Generate a unique 6-character room code."""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+async def allocate_room_code() -> str:
+    """Allocate a code for a room owned by this worker and claim it cluster-wide."""
+    while True:
+        room_code = room_codes.allocate()
+        if not owns(room_code):
+            room_codes.release(room_code)
+            continue
+        if await cluster_backend.claim_code(room_code):
+            return room_code
+        # Claimed by another worker (e.g. after WORKERS changed); keep it reserved here
+        logger.debug("Room code %s is claimed by another worker, skipping", room_code)
+
+async def emit(event: str, data, room: Optional[str] = None, to: Optional[str] = None,
+               skip_sid: Optional[List[str]] = None):
+    """sio.emit, counting the emit and the clients on this worker it reaches."""
+    target = to or room
+    SIO_EMITS.labels(event).inc()
+    recipients = sio_stats.recipients(target)
+    SIO_RECIPIENTS.labels(event).inc(max(recipients - len(skip_sid or ()), 0))
+    await sio.emit(event, data, room=target, skip_sid=skip_sid)
+
+def instrumented(event: str):
+    """Record a Socket.IO handler's latency under socketio_handler_duration_seconds."""
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def timed(*args):
+            start = time.perf_counter()
+            try:
+                return await handler(*args)
+            finally:
+                SIO_HANDLER_SECONDS.labels(event).observe(time.perf_counter() - start)
+        return timed
+    return decorate
+
+async def room_full_state(room_code: str) -> Optional[dict]:
+    room = await room_store.get(room_code)
+    return room.full_state() if room else None
+
+async def send_broadcast(event: str, data: dict, target: str, skip_sids: List[str]):
+    await emit(event, data, room=target, skip_sid=skip_sids)
 
-async def update_last_active(room_code: str):
-    """Update the last active timestamp for a room."""
-    logger.debug(f"Updating last active time for room {room_code}")
-    await asyncio.to_thread(update_room, room_code, last_active=time.time())
-    logger.debug(f"Updated last active time for room {room_code}")
+# Room updates are merged per room and sent at most once per BROADCAST_TICK_MS
+broadcaster = BroadcastScheduler(send_broadcast, room_full_state, sio_stats.backlog)
+
+def broadcast_room_delta(room, delta: dict):
+    """Push a versioned room delta to every client in the room."""
+    broadcaster.changed(room.room_code, delta)
+
+room_store.on_change = broadcast_room_delta
 
 async def cleanup_room(room_code: str):
-    """Delete a room and remove its code from used_room_codes."""
+    """Delete a room and release its code."""
+    await cleanup_rooms([room_code])
+
+async def cleanup_rooms(codes: List[str]):
+    """Delete rooms and release their codes, with one database call for all of them."""
     try:
-        logger.debug(f"Attempting to delete room {room_code}")
-        await asyncio.to_thread(delete_room, room_code)
-        async with used_room_codes_lock:
-            used_room_codes.discard(room_code)
-        logger.debug(f"Room {room_code} deleted successfully")
+        logger.debug("Attempting to delete rooms %s", codes)
+        room_admission.release(len(await room_store.delete_many(codes)))
+        for room_code in codes:
+            question_bank.forget_room(room_code)
+            room_codes.release(room_code)
+            departures.forget_room(room_code)
+            sessions.forget_room(room_code)
+        await cluster_backend.release_codes(codes)
+        logger.debug("Rooms %s deleted successfully", codes)
     except Exception as e:
-        logger.error(f"Failed to delete room {room_code}: {e}")
+        logger.error("Failed to delete rooms %s: %s", codes, e)
 
-async def cleanup_dead_rooms():
-    """Periodically clean up inactive or empty rooms."""
-    logger.debug("Starting cleanup of dead rooms.")
-    all_rooms = await asyncio.to_thread(get_all_rooms)
-    current_time = time.time()
-    rooms_deleted = 0
+async def remove_departed_players(departed: List[Tuple[str, str]]):
+    """Remove players whose reconnect grace ran out, then delete the rooms they left empty.
 
-    for room in all_rooms:
-        room_code = room['room_code']
-        last_active = room.get('last_active', 0)
-        players = room.get('players', [])
-        time_since_last_active = current_time - last_active
+    Removals are written behind with the next room flush, and emptied rooms
+    are deleted together, so a tick's worth of departures costs one batch.
+    """
+    emptied = []
+    for room_code, player_name in departed:
+        try:
+            async with sessions.lock(room_code):
+                room = await room_store.get(room_code)
+                # Skip players who came back on a new session in the meantime
+                if not room or sessions.sid_for(room_code, player_name) is not None:
+                    continue
+                if room_store.remove_player(room, player_name):
+                    broadcaster.presence(room_code)
+                    logger.debug("Player %s removed from room %s", player_name, room_code)
+                    if not room.players and room_code not in emptied:
+                        emptied.append(room_code)
+        except Exception as e:
+            logger.error("Failed to remove player %s from room %s: %s", player_name, room_code, e)
+    if emptied:
+        logger.debug("No players left in rooms %s. Cleaning up.", emptied)
+        await cleanup_rooms(emptied)
 
-        if time_since_last_active > INACTIVITY_THRESHOLD or not players:
-            logger.debug(f"Room {room_code} is inactive or empty. Deleting...")
-            await cleanup_room(room_code)
-            rooms_deleted += 1
+# Disconnected players keep their place for RECONNECT_GRACE_SECONDS
+departures = DisconnectGrace(remove_departed_players)
 
-    logger.debug(f"Cleanup complete. {rooms_deleted} rooms deleted.")
+async def cleanup_dead_rooms():
+    """Delete every room that has been idle longer than INACTIVITY_THRESHOLD.
+
+    Empty rooms are deleted as soon as their last player leaves, so only idle
+    rooms are left for this sweep, which is a single indexed bulk delete.
+    """
+    logger.debug("Starting cleanup of dead rooms.")
+    # Write pending activity first so recently used rooms aren't treated as idle
+    await room_store.flush()
+    # Other workers' rooms are left to them, their live state isn't visible here
+    candidates = list(room_codes) if WORKERS > 1 else None
+    expired = await db.run(delete_expired_rooms, time.time() - INACTIVITY_THRESHOLD, candidates)
+    for room_code in expired:
+        room_store.discard(room_code)
+        question_bank.forget_room(room_code)
+        room_codes.release(room_code)
+        departures.forget_room(room_code)
+        sessions.forget_room(room_code)
+    await cluster_backend.release_codes(expired)
+    room_admission.release(len(expired))
+    room_admission.prune()
+    if WORKERS == 1 or WORKER_ID == 0:
+        pruned = await db.run(delete_old_events, time.time() - EVENT_RETENTION)
+        logger.debug("Dropped %s game events past retention.", pruned)
+    logger.debug("Cleanup complete. %s rooms deleted.", len(expired))
+
+def schedule_cleanup():
+    """Start a cleanup sweep in the background unless one is already running."""
+    global cleanup_task
+    if cleanup_task is None or cleanup_task.done():
+        cleanup_task = asyncio.create_task(cleanup_dead_rooms())
 
 async def periodic_cleanup_task():
     """Background task to periodically clean up dead rooms."""
@@ -161,28 +370,28 @@ async def periodic_cleanup_task():
         await cleanup_dead_rooms()
         await asyncio.sleep(CLEANUP_INTERVAL)
 
-def end_game_logic(room_code: str, winners: List[str]) -> Tuple[bool, str]:
+async def refresh_leaderboard_task():
+    """Background task that reloads the leaderboard every other worker also writes."""
+    while True:
+        await asyncio.sleep(LEADERBOARD_REFRESH)
+        try:
+            leaderboard.load(await db.run(load_leaderboard))
+        except Exception as e:
+            logger.error("Failed to refresh the leaderboard: %s", e)
+
+async def end_game_logic(room_code: str, winners: List[str]) -> Tuple[bool, str]:
     """Logic to end the game and update winners."""
-    room = get_room(room_code)
+    room = await room_store.get(room_code)
     if room:
-        if not room['game_started']:
-            logger.debug(f"Game has not started yet for room {room_code}")
+        if not room.game_started:
+            logger.debug("Game has not started yet for room %s", room_code)
             return False, 'Game has not started yet'
 
-        end_game(room_code, winners)
-
-        for winner in winners:
-            try:
-                increment_player_win(room_code, winner)
-                logger.debug(f"Incremented win for player {winner} in room {room_code}")
-            except Exception as e:
-                logger.error(f"Failed to increment win for player {winner} in room {room_code}: {e}")
-                return False, f'Failed to increment win for player {winner}: {e}'
-
-        logger.debug(f"Game ended successfully for room {room_code}")
+        await room_store.end_game(room, winners)
+        logger.debug("Game ended successfully for room %s", room_code)
         return True, 'Game ended successfully'
     else:
-        logger.debug(f"Room {room_code} not found")
+        logger.debug("Room %s not found", room_code)
         return False, f'Room with code {room_code} not found'
 
 # API Endpoints
@@ -190,8 +399,44 @@ def end_game_logic(room_code: str, winners: List[str]) -> Tuple[bool, str]:
 @app.on_event("startup")
 async def startup_event():
     """Startup event to initiate background tasks."""
-    logger.debug("Starting background tasks.")
+    existing_codes = [code for code in await db.run(get_room_codes) if owns(code)]
+    room_codes.reserve(existing_codes)
+    room_admission.reset(len(existing_codes))
+    leaderboard.load(await db.run(load_leaderboard))
+    logger.debug("Starting background tasks for worker %s of %s.", WORKER_ID, WORKERS)
     asyncio.create_task(periodic_cleanup_task())
+    if WORKERS > 1:
+        asyncio.create_task(refresh_leaderboard_task())
+    asyncio.create_task(room_store.run())
+    asyncio.create_task(event_log.run())
+    asyncio.create_task(departures.run())
+    for difficulty in DIFFICULTIES:
+        question_bank.want([], difficulty)
+    asyncio.create_task(question_bank.run())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush live room state and close pooled database connections on shutdown."""
+    logger.debug("Flushing room state.")
+    await room_store.flush()
+    await event_log.flush()
+    await broadcaster.flush()
+    logger.debug("Closing database connections.")
+    await db.run(close_pool)
+    db.shutdown()
+    profiler.stop()
+    stop_logging()
+
+@app.exception_handler(MisdirectedRoom)
+async def misdirected_room_handler(request: Request, exc: MisdirectedRoom):
+    """Tell a misrouted client which worker serves the room."""
+    logger.debug("%s, rejecting request on worker %s", exc, WORKER_ID)
+    return JSONResponse(status_code=421, content={'detail': str(exc), 'worker': exc.worker})
+
+@app.get("/route/{room_code}")
+async def route(room_code: str):
+    """Return the worker that serves a room, for sticky routing."""
+    return {'room_code': room_code, 'worker': worker_for(room_code)}
 
 @app.get("/", response_class=HTMLResponse)
 async def index():
@@ -211,31 +456,44 @@ async def index():
     """
     return HTMLResponse(content=smiley_html)
 
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+def room_view_response(request: Request, room, view: str, build) -> Response:
+    """A room view from its pre-encoded snapshot, or 304 if the client's copy is current."""
+    etag, body = room.encoded_view(view, build)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
+
+def room_info(room) -> dict:
+    return {
+        'room_code': room.room_code,
+        'host': room.host,
+        'players': room.players,
+        'player_wins': room.player_wins(),
+        'question_goal': room.question_goal,
+        'max_players': room.max_players,
+        'game_started': room.game_started,
+        'winners': room.winners,
+        'difficulty': room.difficulty,
+        'categories': room.categories,
+        'last_active': room.last_active,
+        'version': room.version
+    }
+
 @app.get("/game_room/{room_code}")
-async def get_room_info(room_code: str):
+async def get_room_info(room_code: str, request: Request):
     """Retrieve information about a specific game room."""
-    logger.debug(f"Fetching room info for room code: {room_code}")
-    room = await asyncio.to_thread(get_room, room_code)
+    logger.debug("Fetching room info for room code: %s", room_code)
+    room = await room_store.get(room_code)
     if room:
-        players = room.get('players', [])
-        logger.debug(f"Room found: {room}")
-        player_scores = await asyncio.to_thread(get_player_scores, room_code)
-        player_wins = {score['player_name']: score['wins'] for score in player_scores}
-
-        return JSONResponse(content={
-            'room_code': room_code,
-            'host': room.get('host'),
-            'players': players,
-            'player_wins': player_wins,
-            'question_goal': room.get('question_goal', 10),
-            'max_players': room.get('max_players', 8),
-            'game_started': room.get('game_started', False),
-            'winners': room.get('winners', []),
-            'difficulty': room.get('difficulty', 'easy'),
-            'categories': room.get('categories', []),
-            'last_active': room.get('last_active', time.time())
-        }, status_code=200)
-    logger.debug(f"Room not found for room code: {room_code}")
+        return room_view_response(request, room, 'room', room_info)
+    logger.debug("Room not found for room code: %s", room_code)
     raise HTTPException(status_code=404, detail=f'Room with code {room_code} not found')
 
 @app.post("/leave_room")
@@ -243,21 +501,22 @@ async def leave_room_route(data: LeaveRoomRequest):
     """Endpoint for a player to leave a room."""
     room_code = data.room_code
     player_name = data.player_name
-    logger.debug(f"Player {player_name} attempting to leave room {room_code}")
+    logger.debug("Player %s attempting to leave room %s", player_name, room_code)
 
     try:
-        success = await asyncio.to_thread(remove_player_from_room, room_code, player_name)
-        if success:
-            await update_last_active(room_code)
-            room = await asyncio.to_thread(get_room, room_code)
-            if room and not room['players']:
-                logger.debug(f"No players left in room {room_code}. Cleaning up room.")
+        room = await room_store.get(room_code)
+        departures.cancel(room_code, player_name)
+        if room and room_store.remove_player(room, player_name):
+            if not room.players:
+                logger.debug("No players left in room %s. Cleaning up room.", room_code)
                 await cleanup_room(room_code)
             return JSONResponse(content={'success': True, 'message': 'Player left the room'})
-        logger.debug(f"Room or player not found for room code: {room_code}, player name: {player_name}")
+        logger.debug("Room or player not found for room code: %s, player name: %s", room_code, player_name)
         raise HTTPException(status_code=404, detail=f'Room with code {room_code} or player {player_name} not found')
+    except (HTTPException, MisdirectedRoom):
+        raise
     except Exception as e:
-        logger.error(f"Failed to remove player {player_name} from room {room_code}: {e}")
+        logger.error("Failed to remove player %s from room %s: %s", player_name, room_code, e)
         raise HTTPException(status_code=500, detail=f'Failed to leave room: {str(e)}')
 
 @app.post("/join_room")
@@ -265,70 +524,68 @@ async def join_room_route(data: JoinRoomRequest):
     """Endpoint for a player to join a room."""
     room_code = data.room_code
     player_name = data.player_name
-    logger.debug(f"Player {player_name} attempting to join room {room_code}")
+    logger.debug("Player %s attempting to join room %s", player_name, room_code)
 
-    room = await asyncio.to_thread(get_room, room_code)
+    room = await room_store.get(room_code)
     if not room:
-        logger.debug(f"Room not found for room code: {room_code}")
+        logger.debug("Room not found for room code: %s", room_code)
         raise HTTPException(status_code=404, detail=f'Room with code {room_code} not found')
     try:
+        # A player who dropped and is still within the reconnect grace gets their place back
+        if player_name in room.players and departures.cancel(room_code, player_name):
+            logger.debug("Player %s rejoined room %s within the grace period", player_name, room_code)
+            player_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+            return JSONResponse(content={'success': True, 'player_id': player_id})
+
         # Check if the player name is already taken by another player
-        if player_name in room['players']:
-            logger.debug(f"Player name {player_name} is already taken in room {room_code}")
+        if player_name in room.players:
+            logger.debug("Player name %s is already taken in room %s", player_name, room_code)
             raise HTTPException(status_code=400, detail=f'Player name {player_name} is already taken in room {room_code}')
 
         # Allow joining if the game has ended
-        if not room['game_started'] and room['winners']:
-            await asyncio.to_thread(add_player_to_room, room_code, player_name)
-            await update_last_active(room_code)
+        if not room.game_started and room.winners:
+            room_store.add_player(room, player_name)
             player_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-            await sio.emit('player_joined', player_name, room=room_code)
+            broadcaster.presence(room_code)
             return JSONResponse(content={'success': True, 'player_id': player_id})
 
-        if await asyncio.to_thread(add_player_to_room, room_code, player_name):
-            await update_last_active(room_code)
+        if room_store.add_player(room, player_name):
             player_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-            logger.debug(f"Player {player_name} joined room {room_code}")
+            logger.debug("Player %s joined room %s", player_name, room_code)
             return JSONResponse(content={'success': True, 'player_id': player_id})
+    except (HTTPException, MisdirectedRoom):
+        raise
     except Exception as e:
-        logger.error(f"Failed to add player {player_name} to room {room_code}: {e}")
+        logger.error("Failed to add player %s to room %s: %s", player_name, room_code, e)
         raise HTTPException(status_code=500, detail=f'Failed to add player {player_name} to room {room_code}')
 
 @app.post("/create_room")
-async def create_room(data: CreateRoomRequest):
+async def create_room(data: CreateRoomRequest, request: Request):
     """Endpoint to create a new game room."""
     logger.debug("Attempting to create a new room.")
 
-    # Check if maximum number of rooms has been reached
-    all_rooms = await asyncio.to_thread(get_all_rooms)
-    if len(all_rooms) >= MAX_ROOMS:
-        logger.debug("Maximum number of rooms reached. Triggering cleanup.")
-        await cleanup_dead_rooms()
-        all_rooms = await asyncio.to_thread(get_all_rooms)
-        if len(all_rooms) >= MAX_ROOMS:
-            logger.error("Maximum number of rooms still reached after cleanup.")
-            raise HTTPException(status_code=503, detail='Maximum number of rooms reached. Please try again later.')
-
-    max_attempts = 10
-    attempts = 0
-    room_code = generate_room_code()
-
-    # Check for room code collisions
-    async with used_room_codes_lock:
-        while room_code in used_room_codes or await asyncio.to_thread(get_room, room_code):
-            if attempts >= max_attempts:
-                logger.error("Unable to generate a unique room code after multiple attempts.")
-                raise HTTPException(status_code=500, detail='Unable to generate a unique room code after multiple attempts, please try again later.')
-            logger.debug(f"Collision detected for room code {room_code}, regenerating.")
-            room_code = generate_room_code()
-            attempts += 1
-        used_room_codes.add(room_code)
+    # Reserve a room slot. When the server is full the sweep runs in the
+    # background so room creation never waits on it; the client retries.
+    admitted, message = room_admission.admit(request.client.host if request.client else None)
+    if not admitted:
+        if room_admission.full:
+            logger.error("Maximum number of rooms reached. Triggering cleanup.")
+            schedule_cleanup()
+            raise HTTPException(status_code=503, detail=message)
+        logger.debug("Rate limited room creation from %s", request.client.host)
+        raise HTTPException(status_code=429, detail=message)
+
+    try:
+        room_code = await allocate_room_code()
+    except RuntimeError as e:
+        room_admission.release()
+        logger.error("Unable to allocate a room code: %s", e)
+        raise HTTPException(status_code=503, detail='Unable to allocate a room code, please try again later.')
 
     first_player_name = data.player_name
     categories = data.categories
     try:
-        await asyncio.to_thread(
-            add_room,
+        await room_store.create(
             room_code,
             first_player_name,
             data.question_goal,
@@ -336,33 +593,37 @@ async def create_room(data: CreateRoomRequest):
             data.difficulty,
             categories
         )
-        logger.debug(f"Room created successfully with room code: {room_code}, host: {first_player_name}")
-        return JSONResponse(content={'room_code': room_code, 'success': True})
+        question_bank.want(categories, data.difficulty)
+        logger.debug("Room created successfully with room code: %s, host: %s", room_code, first_player_name)
+        return JSONResponse(content={'room_code': room_code, 'worker': WORKER_ID, 'success': True})
     except Exception as e:
-        async with used_room_codes_lock:
-            used_room_codes.discard(room_code)
-        logger.error(f"Failed to create room {room_code}: {e}")
+        room_admission.release()
+        room_codes.release(room_code)
+        await cluster_backend.release_codes([room_code])
+        logger.error("Failed to create room %s: %s", room_code, e)
         raise HTTPException(status_code=500, detail=f'Failed to create room: {str(e)}')
 
 @app.post("/start_game")
 async def start_game_route(data: StartGameRequest):
     """Endpoint to start a game in a room."""
     room_code = data.room_code
-    logger.debug(f"Attempting to start game for room {room_code}")
-    room = await asyncio.to_thread(get_room, room_code)
+    logger.debug("Attempting to start game for room %s", room_code)
+    room = await room_store.get(room_code)
     if room:
-        if room['game_started']:
-            logger.debug(f"Game already started for room {room_code}")
+        if room.game_started:
+            logger.debug("Game already started for room %s", room_code)
             raise HTTPException(status_code=400, detail='Game has already started')
         try:
-            await asyncio.to_thread(start_game, room_code)
-            await asyncio.to_thread(update_room, room_code, game_started=True)
-            logger.debug(f"Game started for room {room_code}")
+            await room_store.start_game(room)
+            # Every game gets a fresh deck, enough for every player to reach the goal
+            deck_size = room.question_goal * max(len(room.players), 1)
+            question_bank.build_deck(room_code, room.categories, room.difficulty, deck_size)
+            logger.debug("Game started for room %s", room_code)
             return JSONResponse(content={'success': True, 'message': 'Game started'})
         except Exception as e:
-            logger.error(f"Failed to start game for room {room_code}: {e}")
+            logger.error("Failed to start game for room %s: %s", room_code, e)
             raise HTTPException(status_code=500, detail=f'Failed to start game: {str(e)}')
-    logger.debug(f"Room not found for room code: {room_code}")
+    logger.debug("Room not found for room code: %s", room_code)
     raise HTTPException(status_code=404, detail=f'Room with code {room_code} not found')
 
 @app.post("/end_game")
@@ -373,8 +634,8 @@ async def end_game_route(data: EndGameRequest):
     if not room_code:
         raise HTTPException(status_code=400, detail='Missing room_code')
 
-    logger.debug(f"Attempting to end game for room {room_code}")
-    success, message = end_game_logic(room_code, winners)
+    logger.debug("Attempting to end game for room %s", room_code)
+    success, message = await end_game_logic(room_code, winners)
     if success:
         return JSONResponse(content={'success': True, 'message': 'Game ended', 'winners': winners})
     else:
@@ -387,29 +648,45 @@ async def submit_answer(data: SubmitAnswerRequest):
     player_name = data.player_name
     is_correct = data.is_correct
 
-    logger.debug(f"Player {player_name} submitted answer in room {room_code}: {'correct' if is_correct else 'incorrect'}")
-
+    # Owner and membership checks come before grading, so a rejected request doesn't use up the answer
+    room = await room_store.get(room_code)
+    if room is None:
+        logger.debug("Room not found for room code: %s", room_code)
+        raise HTTPException(status_code=404, detail='Room not found')
+    if player_name not in room.players:
+        raise HTTPException(status_code=403, detail=f'{player_name} is not in room {room_code}')
+
+    graded = data.answer is not None
+    if graded:
+        if data.question_index is None:
+            raise HTTPException(status_code=400, detail='Missing question_index for answer')
+        is_correct, message = question_bank.grade_answer(room_code, player_name, data.question_index, data.answer)
+        if is_correct is None:
+            logger.debug("Could not grade answer from %s in room %s: %s", player_name, room_code, message)
+            raise HTTPException(status_code=400, detail=message)
+    elif is_correct is None:
+        raise HTTPException(status_code=400, detail='Missing answer or is_correct')
+    elif not ALLOW_CLIENT_GRADING:
+        raise HTTPException(status_code=400, detail='Submit the answer and question_index to be graded')
+
+    logger.debug("Player %s submitted answer in room %s: %s", player_name, room_code, 'correct' if is_correct else 'incorrect')
+
+    recorded = False
     try:
-        room = await asyncio.to_thread(get_room, room_code)
-        if not room:
-            logger.debug(f"Room not found for room code: {room_code}")
+        # Score, goal check, win and last_active all happen in one transaction
+        result = await room_store.record_answer(room_code, player_name, is_correct)
+        recorded = result is not None
+        if result is None:
+            logger.debug("Room not found for room code: %s", room_code)
             raise HTTPException(status_code=404, detail='Room not found')
 
-        if is_correct:
-            await asyncio.to_thread(update_player_score, room_code, player_name, 1, 0)
-            logger.debug(f"Updated score for player {player_name} in room {room_code}")
-
-        scores = await asyncio.to_thread(get_player_scores, room_code)
-        await update_last_active(room_code)
-
-        player_score = next((score for score in scores if score['player_name'] == player_name), None)
-        if player_score and player_score['score'] >= room['question_goal']:
-            logger.debug(f"Player {player_name} reached the question goal in room {room_code}")
-            success, message = end_game_logic(room_code, [player_name])
-            if success:
-                logger.debug(f"Game ended successfully for room {room_code}")
-            else:
-                logger.error(f"Failed to end game for room {room_code}: {message}")
+        scores = [{'player_name': entry['player_name'], 'score': entry['score'], 'wins': entry['wins']}
+                  for entry in result['scores']]
+
+        if result['reached_goal']:
+            logger.debug("Player %s reached the question goal in room %s", player_name, room_code)
+            if result['game_ended']:
+                logger.debug("Game ended successfully for room %s", room_code)
             return JSONResponse(content={
                 'success': True,
                 'scores': scores,
@@ -424,45 +701,128 @@ async def submit_answer(data: SubmitAnswerRequest):
             'message': 'Answer submitted successfully',
             'game_ended': False
         }, status_code=200)
+    except (HTTPException, MisdirectedRoom):
+        raise
     except Exception as e:
-        logger.error(f"Exception occurred while submitting answer: {e}")
+        logger.error("Exception occurred while submitting answer: %s", e)
         raise HTTPException(status_code=500, detail=f'Failed to submit answer: {str(e)}')
+    finally:
+        if graded and not recorded:
+            question_bank.release_answer(room_code, player_name, data.question_index)
+
+@app.get("/next_question/{room_code}")
+async def next_question(room_code: str, index: int = 0):
+    """Serve the room's question at index from the question bank.
+
+    Every player in a room gets the same question for the same index.
+    """
+    if index < 0:
+        raise HTTPException(status_code=400, detail='Question index must be non-negative')
+    room = await room_store.get(room_code)
+    if not room:
+        logger.debug("Room not found for room code: %s", room_code)
+        raise HTTPException(status_code=404, detail=f'Room with code {room_code} not found')
+    question = question_bank.question_for(room_code, index, room.categories, room.difficulty)
+    if question is None:
+        question_bank.want(room.categories, room.difficulty)
+        raise HTTPException(status_code=503, detail='Questions are still loading, please try again shortly.')
+    return JSONResponse(content={'room_code': room_code, 'index': index, 'question': question})
 
 @app.get("/get_player_statistics/{player_name}")
-async def get_player_statistics_route(player_name: str):
-    """Retrieve statistics for a specific player."""
-    logger.debug(f"Fetching statistics for player: {player_name}")
-    stats = await asyncio.to_thread(get_player_statistics, player_name)
-    logger.debug(f"Statistics fetched for player {player_name}: {stats}")
-    return JSONResponse(content={'player_name': player_name, 'statistics': stats})
+async def get_player_statistics_route(player_name: str, cursor: Optional[str] = None, limit: int = 20):
+    """Retrieve a player's totals and one page of their per-room scores, most recent first.
+
+    Pass next_cursor back as cursor to fetch the following page.
+    """
+    logger.debug("Fetching statistics for player: %s", player_name)
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail='limit must be between 1 and 100')
+    summary = player_summaries.get(player_name) if player_summaries is not None else None
+    try:
+        if summary is None:
+            summary, (stats, next_cursor) = await db.pipeline(
+                (get_player_summary, player_name),
+                (get_player_history, player_name, cursor, limit),
+            )
+            if player_summaries is not None:
+                player_summaries.set(player_name, summary)
+        else:
+            stats, next_cursor = await db.run(get_player_history, player_name, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f'Invalid cursor {cursor}')
+    logger.debug("Statistics fetched for player %s: %s", player_name, summary)
+    return JSONResponse(content={
+        'player_name': player_name,
+        'summary': summary,
+        'statistics': stats,
+        'next_cursor': next_cursor,
+    })
+
+@app.get("/leaderboard")
+async def get_leaderboard(board: str = 'all', limit: int = 10, offset: int = 0):
+    """Top players of a ranking: 'all', 'daily', 'difficulty:<level>' or 'category:<id>'.
+
+    With several workers the ranking is as of the last reload, at most LEADERBOARD_REFRESH seconds old.
+    """
+    if not 1 <= limit <= 100 or offset < 0:
+        raise HTTPException(status_code=400, detail='limit must be between 1 and 100 and offset non-negative')
+    entries, total = leaderboard.top(board, limit, offset)
+    return JSONResponse(content={'board': leaderboard.resolve(board), 'total': total, 'entries': entries})
+
+@app.get("/rank/{player_name}")
+async def get_rank(player_name: str, board: str = 'all'):
+    """A player's position in a ranking."""
+    entry = leaderboard.rank(player_name, board)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f'Player {player_name} is not ranked on {board}')
+    return JSONResponse(content={'board': leaderboard.resolve(board), **entry})
 
 @app.get("/get_game_history/{room_code}")
 async def get_game_history_route(room_code: str):
     """Retrieve the game history for a specific room."""
-    logger.debug(f"Fetching game history for room code: {room_code}")
-    history = await asyncio.to_thread(get_game_history, room_code)
-    logger.debug(f"Game history fetched for room {room_code}: {history}")
-    return JSONResponse(content={'room_code': room_code, 'history': history})
+    logger.debug("Fetching game history for room code: %s", room_code)
+    await room_store.flush()
+    history = await db.run(get_game_history, room_code)
+    logger.debug("Game history fetched for room %s: %s", room_code, history)
+    room = replay(await event_log.read(room_code))
+    games = room['games'] if room else []
+    return JSONResponse(content={'room_code': room_code, 'history': history, 'games': games})
+
+@app.get("/get_room_events/{room_code}")
+async def get_room_events_route(room_code: str, since: Optional[float] = None, until: Optional[float] = None,
+                                limit: int = 500):
+    """A room's logged events between since and until (unix seconds), oldest first."""
+    if not 1 <= limit <= 5000:
+        raise HTTPException(status_code=400, detail='limit must be between 1 and 5000')
+    events = await event_log.read(room_code, since, until, limit)
+    return JSONResponse(content={'room_code': room_code, 'events': events})
 
 @app.get("/get_player_scores/{room_code}")
-async def get_player_scores_route(room_code: str):
+async def get_player_scores_route(room_code: str, request: Request):
     """Retrieve the scores of all players in a specific room."""
-    logger.debug(f"Fetching player scores for room code: {room_code}")
-    scores = await asyncio.to_thread(get_player_scores, room_code)
-    logger.debug(f"Player scores fetched for room {room_code}: {scores}")
-    return JSONResponse(content={'room_code': room_code, 'scores': scores})
+    logger.debug("Fetching player scores for room code: %s", room_code)
+    room = await room_store.get(room_code)
+    if room is None:
+        return JSONResponse(content={'room_code': room_code, 'scores': []})
+    return room_view_response(request, room, 'scores',
+                              lambda room: {'room_code': room.room_code, 'scores': room.score_list()})
 
 @app.get("/lobby_wins/{room_code}")
-async def get_lobby_wins(room_code: str):
+async def get_lobby_wins(room_code: str, request: Request):
     """Retrieve player wins for the given room code."""
-    logger.debug(f"Fetching player wins for room code: {room_code}")
-    scores = await asyncio.to_thread(get_player_scores, room_code)
-    player_wins = {score['player_name']: score['wins'] for score in scores}
-    return JSONResponse(content={'room_code': room_code, 'player_wins': player_wins})
+    logger.debug("Fetching player wins for room code: %s", room_code)
+    room = await room_store.get(room_code)
+    if room is None:
+        return JSONResponse(content={'room_code': room_code, 'player_wins': {}})
+    return room_view_response(request, room, 'wins',
+                              lambda room: {'room_code': room.room_code, 'player_wins': room.player_wins()})
 
 @app.post("/lobby_wins/{room_code}")
 async def post_lobby_wins(room_code: str, data: PostLobbyWinsRequest):
-    """Update player wins for a specific room."""
+    """Update player wins for a specific room.
+
+    The wins are client-reported, so they only count in the room and never on the leaderboard.
+    """
     player_name = data.player_name
     wins = data.wins
 
@@ -470,98 +830,166 @@ async def post_lobby_wins(room_code: str, data: PostLobbyWinsRequest):
         raise HTTPException(status_code=400, detail='Missing player_name or wins')
 
     try:
-        await asyncio.to_thread(update_player_score, room_code, player_name, 0, wins)
-        logger.debug(f"Updated wins for player {player_name} in room {room_code} to {wins}")
+        room = await room_store.get(room_code)
+        if room:
+            await room_store.update_player_score(room, player_name, 0, wins, ranked=False)
+        logger.debug("Updated wins for player %s in room %s to %s", player_name, room_code, wins)
         return JSONResponse(content={'success': True, 'message': 'Player wins updated'})
+    except (HTTPException, MisdirectedRoom):
+        raise
     except Exception as e:
-        logger.error(f"Failed to update wins for player {player_name} in room {room_code}: {e}")
+        logger.error("Failed to update wins for player %s in room %s: %s", player_name, room_code, e)
         raise HTTPException(status_code=500, detail=f'Failed to update wins for player {player_name}')
 
+@app.get("/metrics")
+async def metrics_route():
+    """Every metric in the Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4')
+
+class ProfilerRequest(BaseModel):
+    enabled: bool
+    interval_ms: float = Field(5.0, gt=0)
+    reset: bool = False
+
+def check_profiler_token(request: Request):
+    if not PROFILER_TOKEN:
+        raise HTTPException(status_code=404, detail='Profiler is disabled')
+    if request.headers.get('x-profiler-token') != PROFILER_TOKEN:
+        raise HTTPException(status_code=403, detail='Invalid profiler token')
+
+@app.post("/debug/profiler")
+async def toggle_profiler(data: ProfilerRequest, request: Request):
+    """Start or stop the sampling profiler."""
+    check_profiler_token(request)
+    if data.reset:
+        profiler.reset()
+    if data.enabled:
+        profiler.start(data.interval_ms / 1000.0)
+    else:
+        await asyncio.to_thread(profiler.stop)
+    return JSONResponse(content={'running': profiler.running, 'samples': profiler.samples})
+
+@app.get("/debug/profiler")
+async def profiler_stacks(request: Request, limit: int = 500):
+    """Sampled stacks so far, in the collapsed format flame graph tools read."""
+    check_profiler_token(request)
+    return PlainTextResponse(profiler.collapsed(limit))
+
 @app.get("/get_all_rooms")
 async def get_all_rooms_route():
     """Retrieve information about all active rooms."""
-    all_rooms = await asyncio.to_thread(get_all_rooms)
-    logger.debug(f"Fetching information for all rooms: {all_rooms}")
+    await room_store.flush()
+    all_rooms = await db.run(get_all_rooms)
+    logger.debug("Fetching information for all rooms: %s", all_rooms)
     return JSONResponse(content={'rooms': all_rooms})
 
 # Socket.IO Event Handlers
 
 @sio.on('host_view_change')
+@instrumented('host_view_change')
 async def handle_host_view_change(sid, data: dict):
     """Handle host view changes and propagate updates to all clients in the room."""
     room_code = data.get('room_code')
     new_view = data.get('new_view')
-    logger.debug(f"Received data for host_view_change: {data}")
+    logger.debug("Received data for host_view_change: %s", data)
 
     if not room_code or not new_view:
         logger.error("Invalid data received for host_view_change.")
-        await sio.emit('error', {'message': 'Invalid data for host_view_change'}, to=sid)
+        await emit('error', {'message': 'Invalid data for host_view_change'}, to=sid)
         return
 
-    logger.debug(f"Host changed view to {new_view} in room {room_code}")
-    await sio.emit('update_view', {'new_view': new_view}, room=room_code)
-    logger.debug(f"Emitted 'update_view' event to room {room_code}")
+    logger.debug("Host changed view to %s in room %s", new_view, room_code)
+    await emit('update_view', {'new_view': new_view}, room=room_code)
+    logger.debug("Emitted 'update_view' event to room %s", room_code)
 
 @sio.on('join_game')
+@instrumented('join_game')
 async def handle_join_game(sid, data: dict):
     """Handle players joining a game via Socket.IO."""
     room_code = data.get('room_code')
     player_name = data.get('player_name')
 
-    logger.debug(f"Received data for join_game: {data}")
-    logger.debug(f"Player {player_name} attempting to join room {room_code} via SocketIO")
+    logger.debug("Received data for join_game: %s", data)
+    logger.debug("Player %s attempting to join room %s via SocketIO", player_name, room_code)
 
     if not room_code or not player_name:
         logger.error("Missing room_code or player_name in join_game.")
-        await sio.emit('error', {'message': 'Missing room_code or player_name'}, to=sid)
+        await emit('error', {'message': 'Missing room_code or player_name'}, to=sid)
         return
 
-    room = await asyncio.to_thread(get_room, room_code)
-    if room and player_name in room['players']:
+    async with sessions.lock(room_code):
+        room = await room_store.get(room_code)
+        joined = room is not None and player_name in room.players
+        if joined:
+            replaced = sessions.bind(sid, room_code, player_name)
+            if departures.cancel(room_code, player_name):
+                logger.debug("Player %s reconnected to room %s within the grace period", player_name, room_code)
+    if joined:
         try:
+            if replaced:
+                logger.debug("Session %s of player %s replaced by %s", replaced, player_name, sid)
             await sio.enter_room(sid, room_code)
-            async with session_to_player_lock:
-                session_to_player[sid] = {'room_code': room_code, 'player_name': player_name}
-            await update_last_active(room_code)
-            logger.debug(f"Player {player_name} successfully joined room {room_code} via SocketIO")
-            await sio.emit('player_joined', player_name, room=room_code)
-
-            # Emit updated room data to all clients in the room
-            updated_room_data = await asyncio.to_thread(get_room, room_code)
-            await sio.emit('room_data_updated', updated_room_data, room=room_code)
-            logger.debug(f"Emitted 'room_data_updated' event with data: {updated_room_data}")
+            room_store.touch(room)
+            logger.debug("Player %s successfully joined room %s via SocketIO", player_name, room_code)
+
+            # The new client gets the room now; everyone else gets one update
+            # for all the joins in this tick
+            await emit('room_data_updated', room.full_state(), to=sid)
+            broadcaster.presence(room_code)
         except Exception as e:
-            logger.error(f"Failed to join room {room_code}: {e}")
-            await sio.emit('error', {'message': f'Failed to join room {room_code}'}, to=sid)
+            logger.error("Failed to join room %s: %s", room_code, e)
+            await emit('error', {'message': f'Failed to join room {room_code}'}, to=sid)
     else:
-        logger.debug(f"Player {player_name} not found in room {room_code}")
-        await sio.emit('error', {'message': f'Player {player_name} not found in room {room_code}'}, to=sid)
+        logger.debug("Player %s not found in room %s", player_name, room_code)
+        await emit('error', {'message': f'Player {player_name} not found in room {room_code}'}, to=sid)
+
+@sio.on('sync_room')
+@instrumented('sync_room')
+async def handle_sync_room(sid, data: dict):
+    """Send a client the room deltas it missed since the version it last saw.
+
+    Falls back to the full room state when the change log no longer reaches back
+    to that version. The payload is emitted as 'room_sync' and returned as the ack.
+    """
+    room_code = data.get('room_code')
+    since_version = data.get('version', 0)
+    if not room_code or not isinstance(since_version, int):
+        logger.error("Invalid data received for sync_room.")
+        await emit('error', {'message': 'Invalid data for sync_room'}, to=sid)
+        return None
+
+    room = await room_store.get(room_code)
+    if not room:
+        await emit('error', {'message': f'Room {room_code} not found'}, to=sid)
+        return None
+
+    changes = room.changes_since(since_version)
+    if changes is None:
+        payload = {'room_code': room_code, 'version': room.version, 'full': room.full_state()}
+    else:
+        payload = {'room_code': room_code, 'version': room.version, 'changes': changes}
+    await emit('room_sync', payload, to=sid)
+    return payload
 
 @sio.on('disconnect')
-async def handle_disconnect(sid):
-    """Handle player disconnections."""
-    async with session_to_player_lock:
-        player_info = session_to_player.get(sid)
-        if player_info:
-            room_code = player_info['room_code']
-            player_name = player_info['player_name']
-            logger.debug(f"Player {player_name} disconnected from room {room_code}")
-
-            room = await asyncio.to_thread(get_room, room_code)
-            if room:
-                success = await asyncio.to_thread(remove_player_from_room, room_code, player_name)
-                if success:
-                    del session_to_player[sid]
-                    await sio.emit('player_left', player_name, room=room_code)
-                    await sio.emit('player_count_changed', {'count': len(room['players']) - 1}, room=room_code)
-                    logger.debug(f"Player {player_name} removed from room {room_code}")
-
-                    # If no players left, clean up the room
-                    if not room['players']:
-                        logger.debug(f"No players left in room {room_code}. Cleaning up room.")
-                        await cleanup_room(room_code)
+@instrumented('disconnect')
+async def handle_disconnect(sid, reason=None):
+    """Handle player disconnections.
+
+    The player keeps their place for RECONNECT_GRACE_SECONDS; if they join_game
+    again in that time nothing is removed or broadcast. A player whose session
+    was already replaced by a newer connection isn't held at all.
+    """
+    broadcaster.forget_sid(sid)
+    session = sessions.unbind(sid)
+    if session is None:
+        return
+    room_code, player_name = session
+    logger.debug("Player %s disconnected from room %s", player_name, room_code)
+    if sessions.sid_for(room_code, player_name) is None:
+        await departures.hold(room_code, player_name)
 
 # Run the application
 if __name__ == "__main__":
     logger.debug("API is fully booted and ready to use.")
-    uvicorn.run(app, host="0.0.0.0", port=3000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get('PORT', 3000)))
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""Micro-benchmark for json_codec against the stdlib encoder.
+
+Encodes and decodes realistic payloads (a /game_room body, a full room_sync
+state, a large lobby's scores and a rooms.players column) with both
+backends and prints the time per call. Usage:
+
+    python bench_json.py [--number 20000]
+"""
+import argparse
+import json
+import timeit
+
+import json_codec
+
+def room_payload(players: int) -> dict:
+    names = [f'player{i:03d}' for i in range(players)]
+    return {
+        'room_code': 'K7Q2ZD',
+        'host': names[0],
+        'players': names,
+        'player_wins': {name: i % 4 for i, name in enumerate(names)},
+        'question_goal': 10,
+        'max_players': max(8, players),
+        'game_started': True,
+        'winners': [],
+        'difficulty': 'medium',
+        'categories': [9, 17, 23],
+        'last_active': 1792194753.3257933,
+        'version': 42,
+    }
+
+def sync_payload(players: int) -> dict:
+    state = room_payload(players)
+    state['player_scores'] = [{'player_name': name, 'score': i % 11, 'wins': i % 4}
+                              for i, name in enumerate(state['players'])]
+    return state
+
+def stdlib_dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+PAYLOADS = {
+    'game_room (8 players)': room_payload(8),
+    'room_sync (8 players)': sync_payload(8),
+    'room_sync (100 players)': sync_payload(100),
+    'players column (8)': room_payload(8)['players'],
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000, help='calls per measurement')
+    args = parser.parse_args()
+
+    print(f"json_codec backend: {json_codec.JSON_BACKEND}")
+    print(f"{'payload':<26}{'op':<8}{'stdlib us':>11}{'codec us':>11}{'speedup':>9}")
+    for name, payload in PAYLOADS.items():
+        encoded = stdlib_dumps(payload)
+        for op, baseline, candidate in (
+            ('dumps', lambda: stdlib_dumps(payload), lambda: json_codec.dumps(payload)),
+            ('loads', lambda: json.loads(encoded), lambda: json_codec.loads(encoded)),
+        ):
+            base = min(timeit.repeat(baseline, number=args.number, repeat=3)) / args.number * 1e6
+            fast = min(timeit.repeat(candidate, number=args.number, repeat=3)) / args.number * 1e6
+            print(f"{name:<26}{op:<8}{base:>11.2f}{fast:>11.2f}{base / fast:>8.1f}x")
+
+if __name__ == '__main__':
+    main()
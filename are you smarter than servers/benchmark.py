@@ -0,0 +1,503 @@
+"""Offline load test and benchmark suite for the room server.
+
+Everything runs against a temporary directory with its own database and
+question fixture, so the working trivia_game.db is never touched and no
+network access is needed.
+
+    python benchmark.py swarm --rooms 20 --players 4 --concurrency 10
+    python benchmark.py db --iterations 500
+    python benchmark.py all --save baseline.json
+    python benchmark.py all --compare baseline.json --tolerance 0.25
+
+swarm starts the app with uvicorn in a subprocess and plays whole games
+against it over HTTP and Socket.IO: create, join, poll /game_room, start,
+answer until the goal ends the game, end a game by hand and leave. db times
+each room_db function in-process. Both report p50/p95/p99 latency and
+throughput per operation. --save writes the results as a baseline, and
+--compare exits with status 1 if any operation's p95 got slower than the
+baseline by more than the tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+# Where app.py mounts Socket.IO, then the library default
+SOCKETIO_PATHS = ('/ws/socket.io/', '/socket.io/')
+MIN_REGRESSION_MS = 0.05  # p95 changes smaller than this are noise, whatever the ratio
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+class LatencyRecorder:
+    """Collects per-operation latencies and summarizes them in milliseconds."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def record(self, op: str, seconds: float):
+        self.samples[op].append(seconds)
+
+    def error(self, op: str):
+        self.errors[op] += 1
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def summary(self) -> dict:
+        wall = (self.finished or time.perf_counter()) - self.started
+        ops = {}
+        for op in sorted(set(self.samples) | set(self.errors)):
+            values = sorted(self.samples.get(op, []))
+            busy = sum(values)
+            ops[op] = {
+                'count': len(values),
+                'errors': self.errors.get(op, 0),
+                'p50_ms': percentile(values, 0.50) * 1000,
+                'p95_ms': percentile(values, 0.95) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+                'max_ms': (values[-1] if values else 0.0) * 1000,
+                # Calls per second of time spent in this operation
+                'ops_per_s': len(values) / busy if busy else 0.0,
+            }
+        total = sum(len(values) for values in self.samples.values())
+        return {'wall_s': wall, 'operations': total, 'throughput_per_s': total / wall if wall else 0.0, 'ops': ops}
+
+def print_summary(title: str, summary: dict):
+    print(f"\n{title}: {summary['operations']} operations in {summary['wall_s']:.2f}s "
+          f"({summary['throughput_per_s']:.0f}/s)")
+    print(f"{'operation':<28}{'count':>7}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for op, stats in summary['ops'].items():
+        print(f"{op:<28}{stats['count']:>7}{stats['errors']:>5}{stats['p50_ms']:>9.2f}"
+              f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}{stats['max_ms']:>9.2f}")
+    for name, value in summary.get('counters', {}).items():
+        print(f"{name}: {value}")
+
+def make_fixture(path: str, per_difficulty: int = 300):
+    """OpenTDB-shaped questions so the question bank never goes online."""
+    questions = []
+    for difficulty in ('easy', 'medium', 'hard'):
+        for i in range(per_difficulty):
+            questions.append({
+                'category': 'General Knowledge', 'category_id': 9, 'type': 'multiple',
+                'difficulty': difficulty, 'question': f'{difficulty} question {i}?',
+                'correct_answer': 'yes', 'incorrect_answers': ['no', 'maybe', 'never'],
+            })
+    with open(path, 'w') as f:
+        json.dump(questions, f)
+
+def prepare_workdir() -> str:
+    workdir = tempfile.mkdtemp(prefix='trivia-bench-')
+    shutil.copy(os.path.join(SERVER_DIR, 'schema.sql'), workdir)
+    make_fixture(os.path.join(workdir, 'questions.json'))
+    return workdir
+
+# Client swarm
+
+class SocketIOClient:
+    """Minimal Engine.IO v4 long-polling Socket.IO client on httpx.
+
+    Only what the swarm needs: connect to the default namespace, emit events,
+    and wait for an event by name. Keeps the harness free of extra client
+    dependencies.
+    """
+
+    def __init__(self, http, url: str):
+        self.http = http
+        self.url = url
+        self.sid = None
+        self.received = 0
+        self._waiters: Dict[str, List[asyncio.Future]] = defaultdict(list)
+        self._reader = None
+        self._closed = False
+
+    async def connect(self):
+        response = await self.http.get(self.url, params={'EIO': '4', 'transport': 'polling'})
+        handshake = json.loads(response.text[1:])
+        self.sid = handshake['sid']
+        await self._post('40')
+        connected = self.wait_for('__connect__')
+        self._reader = asyncio.create_task(self._read())
+        await asyncio.wait_for(connected, 10)
+
+    async def _post(self, payload: str):
+        await self.http.post(self.url, params={'EIO': '4', 'transport': 'polling', 'sid': self.sid},
+                             content=payload.encode('utf-8'), headers={'Content-Type': 'text/plain;charset=UTF-8'})
+
+    def wait_for(self, event: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[event].append(future)
+        return future
+
+    def _dispatch(self, event: str, data):
+        for future in self._waiters.pop(event, []):
+            if not future.done():
+                future.set_result(data)
+
+    async def _read(self):
+        while not self._closed:
+            try:
+                response = await self.http.get(self.url, params={'EIO': '4', 'transport': 'polling', 'sid': self.sid})
+            except Exception:
+                if self._closed:
+                    return
+                raise
+            if response.status_code != 200:
+                return
+            for packet in response.text.split('\x1e'):
+                if packet == '2':
+                    await self._post('3')
+                elif packet.startswith('40'):
+                    self._dispatch('__connect__', None)
+                elif packet.startswith('42'):
+                    self.received += 1
+                    message = json.loads(packet[2:])
+                    self._dispatch(message[0], message[1] if len(message) > 1 else None)
+                elif packet == '1':
+                    return
+
+    async def emit(self, event: str, data):
+        await self._post('42' + json.dumps([event, data]))
+
+    async def close(self):
+        self._closed = True
+        try:
+            await self._post('1')
+        except Exception:
+            pass
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except (asyncio.CancelledError, Exception):
+                pass
+
+class Swarm:
+    """Plays full games in many rooms at once against a running server."""
+
+    def __init__(self, base_url: str, recorder: LatencyRecorder, players: int, polls: int,
+                 games: int, question_goal: int, socketio_url: Optional[str], seed: int):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.players = players
+        self.polls = polls
+        self.games = games
+        self.question_goal = question_goal
+        self.socketio_url = socketio_url
+        self.rng = random.Random(seed)
+        self.counters = defaultdict(int)
+
+    async def call(self, http, op: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await http.request(method, self.base_url + path, **kwargs)
+        except Exception:
+            self.recorder.error(op)
+            return None
+        self.recorder.record(op, time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.recorder.error(op)
+        return response
+
+    async def poll(self, http, room_code: str, etag: Optional[str]) -> Optional[str]:
+        headers = {'If-None-Match': etag} if etag else {}
+        response = await self.call(http, 'GET /game_room', 'GET', f'/game_room/{room_code}', headers=headers)
+        if response is None:
+            return etag
+        if response.status_code == 304:
+            self.counters['game_room 304'] += 1
+        return response.headers.get('etag', etag)
+
+    async def play_room(self, http, index: int):
+        host = f'host{index}'
+        names = [host] + [f'p{index}_{i}' for i in range(1, self.players)]
+        response = await self.call(http, 'POST /create_room', 'POST', '/create_room', json={
+            'player_name': host, 'question_goal': self.question_goal,
+            'max_players': self.players, 'difficulty': 'easy', 'categories': [9]})
+        if response is None or response.status_code != 200:
+            return
+        room_code = response.json()['room_code']
+        for name in names[1:]:
+            await self.call(http, 'POST /join_room', 'POST', '/join_room', json={'room_code': room_code, 'player_name': name})
+
+        sockets = []
+        if self.socketio_url:
+            sockets = await asyncio.gather(*(self.join_socket(http, room_code, name) for name in names))
+            sockets = [client for client in sockets if client is not None]
+
+        etags = [None] * len(names)
+        for _ in range(self.polls):
+            etags = await asyncio.gather(*(self.poll(http, room_code, etag) for etag in etags))
+
+        for game in range(self.games + 1):
+            await self.call(http, 'POST /start_game', 'POST', '/start_game', json={'room_code': room_code})
+            if game == self.games:
+                # One last game ended by hand
+                await self.call(http, 'POST /end_game', 'POST', '/end_game',
+                                json={'room_code': room_code, 'winners': [self.rng.choice(names)]})
+                break
+            ended = asyncio.Event()
+            await asyncio.gather(*(self.answer_until_end(http, room_code, name, ended) for name in names))
+            await self.call(http, 'GET /get_player_scores', 'GET', f'/get_player_scores/{room_code}')
+            await self.call(http, 'GET /lobby_wins', 'GET', f'/lobby_wins/{room_code}')
+
+        # Leave before disconnecting, a disconnect removes the player too
+        for name in names:
+            await self.call(http, 'POST /leave_room', 'POST', '/leave_room', json={'room_code': room_code, 'player_name': name})
+        for client in sockets:
+            self.counters['socketio messages received'] += client.received
+            await client.close()
+
+    async def join_socket(self, http, room_code: str, player_name: str) -> Optional[SocketIOClient]:
+        client = SocketIOClient(http, self.socketio_url)
+        start = time.perf_counter()
+        try:
+            await client.connect()
+            self.recorder.record('sio connect', time.perf_counter() - start)
+            start = time.perf_counter()
+            updated = client.wait_for('room_data_updated')
+            await client.emit('join_game', {'room_code': room_code, 'player_name': player_name})
+            await asyncio.wait_for(updated, 10)
+            self.recorder.record('sio join_game', time.perf_counter() - start)
+            return client
+        except Exception:
+            self.recorder.error('sio join_game')
+            await client.close()
+            return None
+
+    async def answer_until_end(self, http, room_code: str, player_name: str, ended: asyncio.Event):
+        while not ended.is_set():
+            response = await self.call(http, 'POST /submit_answer', 'POST', '/submit_answer', json={
+                'room_code': room_code, 'player_name': player_name, 'is_correct': self.rng.random() < 0.7})
+            if response is None or response.status_code != 200:
+                return
+            if response.json().get('game_ended'):
+                ended.set()
+
+async def find_socketio(http, base_url: str) -> Optional[str]:
+    for path in SOCKETIO_PATHS:
+        response = await http.get(base_url + path, params={'EIO': '4', 'transport': 'polling'})
+        if response.status_code == 200 and response.text.startswith('0'):
+            return base_url + path
+    return None
+
+async def run_swarm_async(base_url: str, args) -> dict:
+    import httpx
+
+    recorder = LatencyRecorder()
+    limits = httpx.Limits(max_connections=args.concurrency * (args.players * 2 + 1))
+    async with httpx.AsyncClient(timeout=30.0, limits=limits) as http:
+        socketio_url = None
+        if not args.no_socketio:
+            socketio_url = await find_socketio(http, base_url)
+            if socketio_url is None:
+                print(f"Socket.IO is not reachable at {', '.join(SOCKETIO_PATHS)}, running HTTP only")
+        swarm = Swarm(base_url, recorder, args.players, args.polls, args.games, args.question_goal,
+                      socketio_url, args.seed)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def bounded(index):
+            async with semaphore:
+                await swarm.play_room(http, index)
+
+        await asyncio.gather(*(bounded(index) for index in range(args.rooms)))
+    recorder.stop()
+    summary = recorder.summary()
+    summary['counters'] = dict(swarm.counters)
+    return summary
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def run_swarm(workdir: str, args) -> dict:
+    import httpx
+
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'QUESTION_FIXTURE': os.path.join(workdir, 'questions.json'),
+        'MAX_ROOMS': str(args.rooms * 2 + 100),
+        'HOST_ROOM_BURST': str(args.rooms + 100),
+        'HOST_ROOM_RATE': '1000000',
+        'PYTHONPATH': SERVER_DIR + os.pathsep + env.get('PYTHONPATH', ''),
+    })
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                if httpx.get(base_url + '/', timeout=1.0).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if server.poll() is not None or time.time() > deadline:
+                raise RuntimeError(f"Server did not start, see {os.path.join(workdir, 'server.log')}")
+            time.sleep(0.1)
+        return asyncio.run(run_swarm_async(base_url, args))
+    finally:
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        log.close()
+
+# room_db micro-benchmarks
+
+def run_db(workdir: str, args) -> dict:
+    # room_db reads schema.sql from the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, SERVER_DIR)
+    import room_db
+
+    room_db.configure_pool(database=os.path.join(workdir, 'bench.db'))
+    room_db.init_db()
+    rng = random.Random(args.seed)
+    recorder = LatencyRecorder()
+    players = [f'player{i}' for i in range(args.players)]
+
+    def timed(op, fn, *fn_args):
+        start = time.perf_counter()
+        result = fn(*fn_args)
+        recorder.record(op, time.perf_counter() - start)
+        return result
+
+    codes = [f'B{i:05d}' for i in range(args.iterations)]
+    for code in codes:
+        timed('add_room', room_db.add_room, code, players[0], 1000, args.players, 'easy', [9])
+        for name in players[1:]:
+            timed('add_player_to_room', room_db.add_player_to_room, code, name)
+    for code in codes:
+        timed('get_room', room_db.get_room, code)
+        timed('load_room_state', room_db.load_room_state, code)
+        timed('get_player_scores', room_db.get_player_scores, code)
+        timed('start_game', room_db.start_game, code)
+    for _ in range(args.iterations):
+        code = rng.choice(codes)
+        timed('record_answer', room_db.record_answer, code, rng.choice(players), rng.random() < 0.7)
+        timed('update_player_score', room_db.update_player_score, code, rng.choice(players), 1)
+    for _ in range(max(1, args.iterations // 50)):
+        batch = [(rng.choice(codes), rng.choice(players), True) for _ in range(50)]
+        timed('record_answers (50)', room_db.record_answers, batch)
+        snapshots = [{'room_code': code, 'joined': [(name, time.time()) for name in players], 'left': [],
+                      'last_active': time.time(),
+                      'scores': [(name, 1, 0, time.time()) for name in players]}
+                     for code in rng.sample(codes, min(50, len(codes)))]
+        timed('save_room_states (50)', room_db.save_room_states, snapshots)
+        events = [(rng.choice(codes), time.time_ns() // 1000 + i, 'answer', '{"player":"p","correct":true}')
+                  for i in range(50)]
+        timed('append_events (50)', room_db.append_events, events)
+    for code in codes:
+        timed('end_game', room_db.end_game, code, [rng.choice(players)])
+        timed('read_events', room_db.read_events, code)
+    for name in players:
+        timed('get_player_summary', room_db.get_player_summary, name)
+        timed('get_player_history', room_db.get_player_history, name)
+    for _ in range(max(1, args.iterations // 100)):
+        timed('get_all_rooms', room_db.get_all_rooms)
+        timed('count_rooms', room_db.count_rooms)
+        timed('load_leaderboard', room_db.load_leaderboard)
+    for code in codes:
+        timed('delete_room', room_db.delete_room, code)
+    recorder.stop()
+    room_db.close_pool()
+    return recorder.summary()
+
+# Baselines
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Operations whose p95 is slower than the baseline's by more than tolerance."""
+    regressions = []
+    for suite, summary in results.items():
+        old_ops = baseline.get('results', {}).get(suite, {}).get('ops', {})
+        print(f"\n{suite} vs baseline ({baseline.get('meta', {}).get('saved', 'unknown date')}):")
+        print(f"{'operation':<28}{'old p95':>9}{'new p95':>9}{'change':>9}")
+        for op, stats in summary['ops'].items():
+            old = old_ops.get(op)
+            if old is None or not old['count']:
+                continue
+            change = (stats['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0.0
+            flag = ''
+            if change > tolerance and stats['p95_ms'] - old['p95_ms'] > MIN_REGRESSION_MS:
+                flag = '  REGRESSION'
+                regressions.append(f'{suite}: {op}')
+            print(f"{op:<28}{old['p95_ms']:>9.2f}{stats['p95_ms']:>9.2f}{change:>+8.0%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test and benchmark suite for the room server.')
+    parser.add_argument('suite', nargs='?', choices=('swarm', 'db', 'all'), default='all')
+    parser.add_argument('--rooms', type=int, default=20, help='rooms played by the swarm')
+    parser.add_argument('--players', type=int, default=4, help='players per room')
+    parser.add_argument('--concurrency', type=int, default=10, help='rooms played at the same time')
+    parser.add_argument('--polls', type=int, default=5, help='/game_room polls per player before the first game')
+    parser.add_argument('--games', type=int, default=2, help='games per room that end by reaching the goal')
+    parser.add_argument('--question-goal', type=int, default=3)
+    parser.add_argument('--no-socketio', action='store_true', help='HTTP only')
+    parser.add_argument('--iterations', type=int, default=500, help='rooms and calls per room_db benchmark')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', metavar='PATH', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare against a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown, as a fraction')
+    parser.add_argument('--keep', action='store_true', help="keep the temporary directory and the server's log")
+    args = parser.parse_args()
+
+    workdir = prepare_workdir()
+    cwd = os.getcwd()
+    results = {}
+    try:
+        if args.suite in ('swarm', 'all'):
+            results['swarm'] = run_swarm(workdir, args)
+            print_summary('swarm', results['swarm'])
+        if args.suite in ('db', 'all'):
+            results['db'] = run_db(workdir, args)
+            print_summary('room_db', results['db'])
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"\nKept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            status = 1
+    if args.save:
+        meta = {'saved': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                'platform': platform.platform(), 'args': vars(args)}
+        with open(args.save, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+        print(f"\nSaved baseline to {args.save}")
+    sys.exit(status)
+
+if __name__ == '__main__':
+    main()
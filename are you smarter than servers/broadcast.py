@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+import unittest
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# How long a room's first update waits for others to be merged into it
+BROADCAST_TICK = float(os.environ.get('BROADCAST_TICK_MS', 50)) / 1000.0
+# Clients with more packets than this waiting to be sent are skipped until they catch up
+SLOW_CLIENT_QUEUE = int(os.environ.get('SLOW_CLIENT_QUEUE', 32))
+
+def merge_changes(merged: dict, changes: dict):
+    """Fold a later delta's changes into merged. Scores merge per player, other fields are replaced."""
+    for key, value in changes.items():
+        if key == 'scores' and 'scores' in merged:
+            merged['scores'] = {**merged['scores'], **value}
+        else:
+            merged[key] = value
+
+class _PendingRoom:
+    __slots__ = ('since', 'version', 'changes', 'full')
+
+    def __init__(self):
+        self.since: Optional[int] = None
+        self.version = 0
+        self.changes: dict = {}
+        self.full = False
+
+class BroadcastScheduler:
+    """Sends each room at most one update per tick.
+
+    Deltas passed to changed() within a tick are merged into one 'room_delta'
+    carrying the changes from version 'since' to 'version'. presence() (a
+    client joined or left) adds one 'room_data_updated' with the full room
+    state for the whole tick, however many players came and went.
+
+    send(event, data, target, skip_sids) emits to a room or a single client.
+    Each message is one emit to the room, so it is encoded once for every
+    recipient. full_state(room_code) returns the room's full_state() or None.
+    backlog(room_code) lists (sid, packets queued for it) for the clients in
+    the room. A client whose queue is longer than slow_queue is left out of
+    broadcasts; once it has caught up it is sent a single 'room_sync' with the
+    full state instead of everything it missed.
+    """
+
+    def __init__(self, send: Callable[[str, dict, str, List[str]], Awaitable[None]],
+                 full_state: Callable[[str], Awaitable[Optional[dict]]],
+                 backlog: Callable[[str], Iterable[Tuple[str, int]]],
+                 tick: float = BROADCAST_TICK, slow_queue: int = SLOW_CLIENT_QUEUE):
+        self.send = send
+        self.full_state = full_state
+        self.backlog = backlog
+        self.tick = tick
+        self.slow_queue = slow_queue
+        self._pending: Dict[str, _PendingRoom] = {}
+        self._behind: Set[str] = set()
+        self._timer = None
+        self._tasks = set()
+
+    def _room(self, room_code: str) -> _PendingRoom:
+        pending = self._pending.get(room_code)
+        if pending is None:
+            pending = self._pending[room_code] = _PendingRoom()
+            if self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.tick, self._start_flush)
+        return pending
+
+    def changed(self, room_code: str, delta: dict):
+        """Queue a RoomStateStore delta for the room."""
+        pending = self._room(room_code)
+        if pending.since is None:
+            pending.since = delta['version'] - 1
+        pending.version = delta['version']
+        merge_changes(pending.changes, delta['changes'])
+
+    def presence(self, room_code: str):
+        """Send the room's full state at the end of the tick."""
+        self._room(room_code).full = True
+
+    def forget_sid(self, sid: str):
+        self._behind.discard(sid)
+
+    def _start_flush(self):
+        self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.create_task(self._send_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, batch: Dict[str, _PendingRoom]):
+        for room_code, pending in batch.items():
+            try:
+                await self._send_room(room_code, pending)
+            except Exception as e:
+                logger.error("Failed to broadcast to room %s: %s", room_code, e)
+
+    async def _send_room(self, room_code: str, pending: _PendingRoom):
+        skip, caught_up = [], []
+        for sid, queued in self.backlog(room_code):
+            if queued > self.slow_queue:
+                skip.append(sid)
+                self._behind.add(sid)
+            elif sid in self._behind:
+                skip.append(sid)
+                caught_up.append(sid)
+        if skip:
+            logger.debug("Skipping %s slow clients in room %s", len(skip) - len(caught_up), room_code)
+
+        state = await self.full_state(room_code) if pending.full or caught_up else None
+        if pending.changes:
+            await self.send('room_delta', {'room_code': room_code, 'since': pending.since,
+                                           'version': pending.version, 'changes': pending.changes},
+                            room_code, skip)
+        if pending.full and state is not None:
+            await self.send('room_data_updated', state, room_code, skip)
+        if state is not None:
+            for sid in caught_up:
+                self._behind.discard(sid)
+                await self.send('room_sync', {'room_code': room_code, 'version': state['version'], 'full': state},
+                                sid, [])
+
+    async def flush(self):
+        """Send everything queued so far and wait for it."""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._start_flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+# Unit tests
+
+class TestBroadcastScheduler(unittest.TestCase):
+
+    def test_coalesces_a_tick_into_one_message_per_room(self):
+        sent = []
+        queued = {'ABC123': [('fast', 0), ('slow', 100)]}
+
+        async def send(event, data, target, skip):
+            sent.append((event, data, target, skip))
+
+        async def full_state(room_code):
+            return {'room_code': room_code, 'players': ['alice', 'bob', 'carol'], 'version': 4}
+
+        async def scenario():
+            scheduler = BroadcastScheduler(send, full_state, lambda code: queued.get(code, []), tick=0.01)
+            scheduler.changed('ABC123', {'room_code': 'ABC123', 'version': 2,
+                                         'changes': {'players': ['alice', 'bob'], 'scores': {'bob': {'score': 0}}}})
+            scheduler.changed('ABC123', {'room_code': 'ABC123', 'version': 3, 'changes': {'players': ['alice', 'bob', 'carol']}})
+            scheduler.changed('ABC123', {'room_code': 'ABC123', 'version': 4, 'changes': {'scores': {'carol': {'score': 0}}}})
+            for _ in range(3):
+                scheduler.presence('ABC123')
+            scheduler.changed('XYZ789', {'room_code': 'XYZ789', 'version': 8, 'changes': {'game_started': True}})
+            await asyncio.sleep(0.05)
+            first = list(sent)
+            sent.clear()
+
+            # The slow client has caught up: it gets the full state once
+            queued['ABC123'] = [('fast', 0), ('slow', 0)]
+            scheduler.changed('ABC123', {'room_code': 'ABC123', 'version': 5, 'changes': {'game_started': True}})
+            await scheduler.flush()
+            return first
+
+        first = asyncio.run(scenario())
+        self.assertEqual([(event, target) for event, _, target, _ in first],
+                         [('room_delta', 'ABC123'), ('room_data_updated', 'ABC123'), ('room_delta', 'XYZ789')])
+        delta = first[0][1]
+        self.assertEqual((delta['since'], delta['version']), (1, 4))
+        self.assertEqual(delta['changes'], {'players': ['alice', 'bob', 'carol'],
+                                            'scores': {'bob': {'score': 0}, 'carol': {'score': 0}}})
+        self.assertEqual(first[0][3], ['slow'])
+        self.assertEqual([(event, target, skip) for event, _, target, skip in sent],
+                         [('room_delta', 'ABC123', ['slow']), ('room_sync', 'slow', [])])
+        self.assertEqual(sent[1][1]['full']['players'], ['alice', 'bob', 'carol'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+"""Running the server as several worker processes.
+
+Live room state is held in memory by the worker that owns the room, so every
+request for a room has to reach that worker. Ownership is fixed by the room
+code: worker_for(code) == WORKER_ID, and create_room only hands out codes
+that hash to the worker creating them.
+
+Start one process per core, each with its own WORKER_ID and PORT:
+
+    WORKERS=4 WORKER_ID=0 PORT=3000 CLUSTER_DB=cluster.db \\
+        SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0 python app.py
+    ...
+    WORKERS=4 WORKER_ID=3 PORT=3003 ...
+
+Sticky routing: create_room returns the owning 'worker' and GET /route/{code}
+looks it up for a known room. Clients send it as an X-Worker header on HTTP
+requests and as a ?worker= query parameter on the Socket.IO handshake, and
+the proxy maps that value to the worker's port, e.g. with nginx:
+
+    map $http_x_worker$arg_worker $trivia_worker {
+        default 127.0.0.1:3000;
+        1 127.0.0.1:3001;
+        2 127.0.0.1:3002;
+        3 127.0.0.1:3003;
+    }
+
+Requests without a worker (create_room, get_all_rooms) can go anywhere. A
+worker that receives a request for a room it doesn't own answers 421 with the
+right worker, so a misrouted client can retry instead of forking the state.
+
+Socket.IO emits to a room reach clients on every worker through the message
+queue in SOCKETIO_MESSAGE_QUEUE (needs the redis package). Claimed room codes
+live in a SharedBackend: SQLiteBackend on CLUSTER_DB for workers on one host,
+or LocalBackend in-process for a single worker and tests. Socket.IO sessions
+aren't shared: a room's clients all connect to the worker that owns it, whose
+SessionRegistry (sessions.py) tracks them.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+import zlib
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.environ.get('WORKERS', 1))
+WORKER_ID = int(os.environ.get('WORKER_ID', 0))
+CLUSTER_DB = os.environ.get('CLUSTER_DB')                          # shared SQLite file for SQLiteBackend
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')  # e.g. redis://localhost:6379/0
+
+class MisdirectedRoom(Exception):
+    """A request for a room reached a worker that doesn't own it."""
+
+    def __init__(self, room_code: str, worker: int):
+        super().__init__(f'Room {room_code} is served by worker {worker}')
+        self.room_code = room_code
+        self.worker = worker
+
+def worker_for(room_code: str, workers: int = WORKERS) -> int:
+    """The worker that owns a room. Stable across processes and restarts."""
+    return zlib.crc32(room_code.encode()) % workers
+
+def owns(room_code: str) -> bool:
+    return WORKERS == 1 or worker_for(room_code) == WORKER_ID
+
+def check_owner(room_code: str):
+    """Raise MisdirectedRoom unless this worker owns the room."""
+    if not owns(room_code):
+        raise MisdirectedRoom(room_code, worker_for(room_code))
+
+def make_client_manager():
+    """The Socket.IO client manager for SOCKETIO_MESSAGE_QUEUE, or None for in-process."""
+    if not SOCKETIO_MESSAGE_QUEUE:
+        return None
+    import socketio
+    logger.debug("Using Socket.IO message queue %s", SOCKETIO_MESSAGE_QUEUE)
+    return socketio.AsyncRedisManager(SOCKETIO_MESSAGE_QUEUE)
+
+class LocalBackend:
+    """In-process SharedBackend for a single worker and for tests."""
+
+    def __init__(self):
+        self._codes = {}
+
+    async def claim_code(self, code: str, worker: int = WORKER_ID) -> bool:
+        """Record that a worker allocated a code. False if it is already taken."""
+        return self._codes.setdefault(code, worker) == worker
+
+    async def release_codes(self, codes: Iterable[str]):
+        for code in codes:
+            self._codes.pop(code, None)
+
+class SQLiteBackend:
+    """SharedBackend on a SQLite file that all workers on the host open."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS room_codes (
+                    code TEXT PRIMARY KEY,
+                    worker INTEGER NOT NULL
+                ) WITHOUT ROWID
+            ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    async def claim_code(self, code: str, worker: int = WORKER_ID) -> bool:
+        def claim():
+            with self._connect() as conn:
+                conn.execute('INSERT OR IGNORE INTO room_codes (code, worker) VALUES (?, ?)', (code, worker))
+                return conn.execute('SELECT worker FROM room_codes WHERE code = ?', (code,)).fetchone()[0] == worker
+        return await asyncio.to_thread(claim)
+
+    async def release_codes(self, codes: Iterable[str]):
+        def release(codes):
+            with self._connect() as conn:
+                conn.executemany('DELETE FROM room_codes WHERE code = ?', [(code,) for code in codes])
+        await asyncio.to_thread(release, list(codes))
+
+def make_backend():
+    if CLUSTER_DB:
+        logger.debug("Using shared cluster state in %s", CLUSTER_DB)
+        return SQLiteBackend(CLUSTER_DB)
+    return LocalBackend()
+
+# Unit tests
+
+class TestCluster(unittest.TestCase):
+
+    def test_worker_for_is_stable_and_spread(self):
+        codes = [f'ROOM{i:02d}' for i in range(100)]
+        self.assertEqual([worker_for(code, 4) for code in codes], [worker_for(code, 4) for code in codes])
+        self.assertEqual(set(worker_for(code, 4) for code in codes), {0, 1, 2, 3})
+        self.assertTrue(all(worker_for(code, 1) == 0 for code in codes))
+
+    def check_backend(self, backend):
+        async def scenario():
+            self.assertTrue(await backend.claim_code('ROOM01', worker=0))
+            self.assertTrue(await backend.claim_code('ROOM01', worker=0))
+            self.assertFalse(await backend.claim_code('ROOM01', worker=1))
+            await backend.release_codes(['ROOM01'])
+            self.assertTrue(await backend.claim_code('ROOM01', worker=1))
+        asyncio.run(scenario())
+
+    def test_local_backend(self):
+        self.check_backend(LocalBackend())
+
+    def test_sqlite_backend_is_shared(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cluster.db')
+            self.check_backend(SQLiteBackend(path))
+            other = SQLiteBackend(path)
+            self.assertFalse(asyncio.run(other.claim_code('ROOM01', worker=0)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from metrics import registry
+from room_db import POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+DB_CALL_SECONDS = registry.histogram('db_call_duration_seconds', 'Time spent in each room_db function.', ('function',))
+DB_QUEUE_SECONDS = registry.histogram('db_executor_queue_wait_seconds', 'Time a call waited for a database thread.')
+DB_QUEUE_DEPTH = registry.gauge('db_executor_queue_depth', 'Calls waiting for a database thread.')
+DB_IN_FLIGHT = registry.gauge('db_executor_busy_threads', 'Database threads running a call.')
+
+# Threads that run room_db calls. At most POOL_SIZE so a thread never waits
+# for a pooled connection, and separate from the default executor so slow
+# queries can't starve other to_thread work (and the reverse).
+DB_WORKERS = int(os.environ.get('ROOM_DB_WORKERS', POOL_SIZE))
+
+class DatabaseExecutor:
+    """Runs blocking room_db functions on a dedicated, bounded thread pool.
+
+    run() is one call, one hop. pipeline() runs several related calls back to
+    back on the same thread, so a request that needs more than one query pays
+    for a single hop, and the calls see each other's writes in order. Every
+    call's duration, its wait for a thread and the queue depth are recorded
+    in the metrics registry.
+    """
+
+    def __init__(self, workers: int = DB_WORKERS):
+        self.workers = max(1, workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='room-db')
+        return self._executor
+
+    async def _submit(self, calls) -> List[Any]:
+        submitted = time.perf_counter()
+        DB_QUEUE_DEPTH.inc()
+        # Whoever takes this first leaves the queue: the thread when it starts
+        # the call, or the caller if the call was cancelled before it started
+        dequeued = threading.Lock()
+
+        def run_all():
+            started = time.perf_counter()
+            if dequeued.acquire(blocking=False):
+                DB_QUEUE_DEPTH.dec()
+            DB_QUEUE_SECONDS.observe(started - submitted)
+            DB_IN_FLIGHT.inc()
+            try:
+                results = []
+                for fn, *args in calls:
+                    try:
+                        results.append(fn(*args))
+                    finally:
+                        finished = time.perf_counter()
+                        DB_CALL_SECONDS.labels(getattr(fn, '__name__', 'call')).observe(finished - started)
+                        started = finished
+                return results
+            finally:
+                DB_IN_FLIGHT.dec()
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), run_all)
+        finally:
+            if dequeued.acquire(blocking=False):
+                DB_QUEUE_DEPTH.dec()
+
+    async def run(self, fn: Callable, *args) -> Any:
+        return (await self._submit([(fn, *args)]))[0]
+
+    async def pipeline(self, *calls) -> List[Any]:
+        """Run (fn, *args) tuples in order in one hop and return their results."""
+        return await self._submit(calls)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+# Shared by app.py, room_state.py and write_coalescer.py
+db = DatabaseExecutor()
+
+# Unit tests
+
+class TestDatabaseExecutor(unittest.TestCase):
+
+    def test_run_and_pipeline(self):
+        executor = DatabaseExecutor(workers=2)
+        threads = []
+
+        def record(value):
+            threads.append(threading.current_thread().name)
+            return value
+
+        async def scenario():
+            self.assertEqual(await executor.run(record, 1), 1)
+            self.assertEqual(await executor.pipeline((record, 2), (record, 3)), [2, 3])
+
+        asyncio.run(scenario())
+        executor.shutdown()
+        self.assertTrue(all(name.startswith('room-db') for name in threads))
+        # Pipelined calls share a hop
+        self.assertEqual(threads[1], threads[2])
+
+    def test_worker_count_is_bounded(self):
+        executor = DatabaseExecutor(workers=2)
+        active = []
+        peak = []
+        lock = threading.Lock()
+        release = threading.Event()
+
+        def hold():
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            release.wait(1)
+            with lock:
+                active.pop()
+
+        async def scenario():
+            tasks = [asyncio.create_task(executor.run(hold)) for _ in range(6)]
+            await asyncio.sleep(0.05)
+            release.set()
+            await asyncio.gather(*tasks)
+
+        asyncio.run(scenario())
+        executor.shutdown()
+        self.assertEqual(max(peak), 2)
+
+if __name__ == '__main__':
+    unittest.main()
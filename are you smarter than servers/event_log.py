@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+import unittest
+from typing import Iterable, List, Optional
+
+import json_codec
+from db_executor import db
+from room_db import append_events, close_pool, migrate_db, read_events, temporary_database
+
+logger = logging.getLogger(__name__)
+
+EVENT_FLUSH_INTERVAL = 1.0  # seconds between background appends
+EVENT_BATCH_SIZE = 1000     # events written per executemany
+
+class GameEventLog:
+    """Append-only record of what happened in each room.
+
+    append() only queues the event in memory, so logging never adds a
+    synchronous write to a request; run() appends the queue to the
+    game_events table in batches. Events are (room_code, seq, kind, data),
+    where seq is a per-process increasing microsecond timestamp, so it orders
+    a room's events and doubles as their time. Kinds: create, join, leave,
+    start, answer, score, end and delete.
+    """
+
+    def __init__(self, flush_interval: float = EVENT_FLUSH_INTERVAL, batch_size: int = EVENT_BATCH_SIZE):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = []
+        self._last_seq = 0
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self):
+        """Events queued and not yet written."""
+        return len(self._pending)
+
+    def _next_seq(self) -> int:
+        seq = max(int(time.time() * 1_000_000), self._last_seq + 1)
+        self._last_seq = seq
+        return seq
+
+    def append(self, room_code: str, kind: str, **data):
+        self._pending.append((room_code, self._next_seq(), kind, json_codec.dumps_str(data)))
+
+    async def flush(self) -> int:
+        """Write every queued event. Returns the number written."""
+        written = 0
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.batch_size]
+                try:
+                    await db.run(append_events, batch)
+                except Exception as e:
+                    logger.error("Failed to append %s game events, will retry: %s", len(batch), e)
+                    break
+                del self._pending[:len(batch)]
+                written += len(batch)
+        return written
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def read(self, room_code: str, since: Optional[float] = None, until: Optional[float] = None,
+                   limit: Optional[int] = None) -> List[dict]:
+        """A room's events with since <= time < until, oldest first, including queued ones."""
+        await self.flush()
+        return await db.run(read_events, room_code, since, until, limit)
+
+def replay(events: Iterable[dict]) -> Optional[dict]:
+    """Rebuild a room from its events, oldest first.
+
+    Returns the room's fields as of the last event (with 'scores' as
+    {player_name: {'score', 'wins'}} and 'deleted'), plus 'games': one entry
+    per game with its start and end time, winners and the points each player
+    scored in that game alone. Returns None if the events don't include the
+    room's creation.
+    """
+    room = None
+    game = None
+    for event in events:
+        kind, data, at = event['kind'], event['data'], event['time']
+        if kind == 'create':
+            room = {
+                'room_code': event['room_code'], 'host': data['host'], 'players': [data['host']],
+                'game_started': False, 'question_goal': data['question_goal'],
+                'max_players': data['max_players'], 'winners': [], 'difficulty': data['difficulty'],
+                'categories': data['categories'], 'creation_time': at, 'last_active': at,
+                'scores': {data['host']: {'score': 0, 'wins': 0}}, 'games': [], 'deleted': False,
+            }
+            continue
+        if room is None:
+            continue
+        room['last_active'] = at
+        player = data.get('player')
+        if player is not None:
+            room['scores'].setdefault(player, {'score': 0, 'wins': 0})
+        if kind == 'join':
+            if player not in room['players']:
+                room['players'].append(player)
+        elif kind == 'leave':
+            if player in room['players']:
+                room['players'].remove(player)
+        elif kind == 'start':
+            room['game_started'] = True
+            room['winners'] = []
+            game = {'started': at, 'ended': None, 'winners': [], 'points': {name: 0 for name in room['players']}}
+            room['games'].append(game)
+        elif kind == 'answer':
+            if data['correct']:
+                room['scores'][player]['score'] += 1
+                if game is not None and game['ended'] is None:
+                    game['points'][player] = game['points'].get(player, 0) + 1
+        elif kind == 'score':
+            room['scores'][player]['score'] += data['points']
+            room['scores'][player]['wins'] += data['wins']
+        elif kind == 'end':
+            room['game_started'] = False
+            room['winners'] = list(data['winners'])
+            for winner in data['winners']:
+                room['scores'].setdefault(winner, {'score': 0, 'wins': 0})['wins'] += 1
+            if game is not None and game['ended'] is None:
+                game['ended'] = at
+                game['winners'] = list(data['winners'])
+        elif kind == 'delete':
+            room['deleted'] = True
+    return room
+
+# Unit tests
+
+class TestGameEventLog(unittest.TestCase):
+    def setUp(self):
+        database = temporary_database()
+        database.__enter__()
+        self.addCleanup(database.__exit__, None, None, None)
+
+    def test_append_read_and_replay(self):
+        async def scenario():
+            log = GameEventLog()
+            log.append('room1', 'create', host='alice', question_goal=2, max_players=4, difficulty='easy', categories=[9])
+            log.append('room1', 'join', player='bob')
+            for _ in range(2):
+                log.append('room1', 'start')
+                log.append('room1', 'answer', player='bob', correct=True)
+                log.append('room1', 'answer', player='alice', correct=False)
+                log.append('room1', 'answer', player='bob', correct=True)
+                log.append('room1', 'end', winners=['bob'])
+            log.append('room1', 'leave', player='alice')
+            log.append('room2', 'create', host='carol', question_goal=1, max_players=2, difficulty='hard', categories=[])
+            self.assertEqual(await log.flush(), 14)
+            events = await log.read('room1')
+            self.assertEqual(len(events), 13)
+            self.assertEqual(len(await log.read('room1', limit=3)), 3)
+            self.assertEqual([event['kind'] for event in await log.read('room1', since=events[11]['time'])],
+                             ['end', 'leave'])
+            self.assertEqual(await log.read('room1', until=events[0]['time']), [])
+            return events
+
+        room = replay(asyncio.run(scenario()))
+        self.assertEqual(room['players'], ['bob'])
+        self.assertEqual(room['scores']['bob'], {'score': 4, 'wins': 2})
+        self.assertEqual(len(room['games']), 2)
+        # Points are per game, not accumulated across the lobby
+        self.assertEqual(room['games'][1]['points'], {'alice': 0, 'bob': 2})
+        self.assertEqual(room['games'][1]['winners'], ['bob'])
+        self.assertFalse(room['game_started'])
+        self.assertIsNone(replay([]))
+
+    def test_events_survive_a_restart(self):
+        async def before_restart():
+            log = GameEventLog()
+            log.append('room3', 'create', host='dana', question_goal=1, max_players=2, difficulty='easy', categories=[])
+            log.append('room3', 'join', player='eve')
+            log.append('room3', 'start')
+            self.assertEqual(len(log), 3)
+            await log.flush()
+            self.assertEqual(len(log), 0)
+
+        asyncio.run(before_restart())
+        # Shutdown closes the pool, startup migrates the database
+        close_pool()
+        migrate_db()
+        room = replay(asyncio.run(GameEventLog().read('room3')))
+        self.assertEqual(room['players'], ['dana', 'eve'])
+        self.assertTrue(room['game_started'])
+
+if __name__ == '__main__':
+    unittest.main()
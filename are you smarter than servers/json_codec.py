@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import unittest
+from typing import Any, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used instead
+    orjson = None
+
+# 'orjson' or 'json'. Defaults to orjson when it is installed.
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'orjson' if orjson is not None else 'json')
+if JSON_BACKEND == 'orjson' and orjson is None:
+    logger.warning("JSON_BACKEND=orjson but orjson is not installed, using the stdlib json module")
+    JSON_BACKEND = 'json'
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+def dumps(obj: Any) -> bytes:
+    """Compact UTF-8 JSON, the same bytes JSONResponse would send."""
+    if JSON_BACKEND == 'orjson':
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+def dumps_str(obj: Any) -> str:
+    """Compact JSON as text, for TEXT columns and Socket.IO packets."""
+    if JSON_BACKEND == 'orjson':
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+def loads(data: Union[str, bytes]) -> Any:
+    if JSON_BACKEND == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
+
+class SocketIOJSON:
+    """The json module interface python-socketio expects, backed by this codec.
+
+    socketio encodes an emit to a room once and sends the same packet to every
+    participant, so each broadcast goes through dumps() a single time.
+    """
+
+    @staticmethod
+    def dumps(obj: Any, *args, **kwargs) -> str:
+        return dumps_str(obj)
+
+    @staticmethod
+    def loads(data: Union[str, bytes], *args, **kwargs) -> Any:
+        return loads(data)
+
+# Unit tests
+
+class TestJSONCodec(unittest.TestCase):
+
+    def test_round_trip(self):
+        room = {'room_code': 'ABC123', 'players': ['alice', 'zoë'], 'winners': [], 'scores': {1: 2},
+                'last_active': 1700000000.25, 'game_started': False, 'categories': None}
+        encoded = dumps(room)
+        self.assertIsInstance(encoded, bytes)
+        self.assertNotIn(b' ', encoded)
+        self.assertIn('zoë'.encode('utf-8'), encoded)
+        self.assertEqual(loads(encoded), {**room, 'scores': {'1': 2}})
+        self.assertEqual(loads(dumps_str(room)), loads(encoded))
+        self.assertEqual(SocketIOJSON.loads(SocketIOJSON.dumps(['event', room], separators=(',', ':'))),
+                         ['event', loads(encoded)])
+
+    def test_matches_stdlib_decoding(self):
+        text = json.dumps({'players': ['a', 'b'], 'n': [1, 2.5, None, True]})
+        self.assertEqual(loads(text), json.loads(text))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,238 @@
+import logging
+import random
+import unittest
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from room_db import leaderboard_day
+
+logger = logging.getLogger(__name__)
+
+MAX_LEVEL = 24  # enough for ~16M players per board at p = 1/2
+
+# Rank order: most wins first, then most points, then name
+RankKey = Tuple[int, int, str]
+
+def rank_key(player_name: str, wins: int, points: int) -> RankKey:
+    return (-wins, -points, player_name)
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next: List[Optional['_Node']] = [None] * level
+        self.width = [1] * level
+
+class RankedSkipList:
+    """A sorted set with O(log n) insert, remove, rank and access by rank.
+
+    Each forward link stores how many entries it skips, so positions can be
+    counted on the way down instead of by walking the bottom level.
+    """
+
+    def __init__(self):
+        self._head = _Node(None, MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    def _path(self, key) -> Tuple[List[_Node], List[int]]:
+        """Last node before key on every level, and its position (head is 0)."""
+        update = [self._head] * MAX_LEVEL
+        positions = [0] * MAX_LEVEL
+        node, position = self._head, 0
+        for level in range(self._level - 1, -1, -1):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            update[level] = node
+            positions[level] = position
+        return update, positions
+
+    def insert(self, key):
+        update, positions = self._path(key)
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                update[i] = self._head
+                positions[i] = 0
+                self._head.width[i] = self._size + 1
+            self._level = level
+        node = _Node(key, level)
+        position = positions[0] + 1
+        for i in range(level):
+            node.next[i] = update[i].next[i]
+            update[i].next[i] = node
+            skipped = position - positions[i]
+            node.width[i] = update[i].width[i] - skipped + 1
+            update[i].width[i] = skipped
+        for i in range(level, self._level):
+            update[i].width[i] += 1
+        self._size += 1
+
+    def remove(self, key) -> bool:
+        update, _ = self._path(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            return False
+        for i in range(self._level):
+            if update[i].next[i] is node:
+                update[i].width[i] += node.width[i] - 1
+                update[i].next[i] = node.next[i]
+            else:
+                update[i].width[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+        return True
+
+    def rank(self, key) -> Optional[int]:
+        """0-based position of key, or None if it isn't present."""
+        update, positions = self._path(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            return None
+        return positions[0]
+
+    def iter_from(self, index: int) -> Iterable:
+        """Keys from 0-based position index onwards."""
+        if index < 0 or index >= self._size:
+            return
+        node, position = self._head, -1
+        for level in range(self._level - 1, -1, -1):
+            while node.next[level] is not None and position + node.width[level] <= index:
+                position += node.width[level]
+                node = node.next[level]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+class Board:
+    """One ranking: a player -> (wins, points) map plus its rank order."""
+
+    def __init__(self):
+        self.players: Dict[str, Tuple[int, int]] = {}
+        self.order = RankedSkipList()
+
+    def add(self, player_name: str, wins: int, points: int):
+        old = self.players.get(player_name)
+        if old is not None:
+            self.order.remove(rank_key(player_name, *old))
+            wins += old[0]
+            points += old[1]
+        self.players[player_name] = (wins, points)
+        self.order.insert(rank_key(player_name, wins, points))
+
+class Leaderboard:
+    """All-time, daily, per-difficulty and per-category player rankings.
+
+    Mirrors the leaderboard table that room_db writes in the same transaction
+    as each score change: load() reads it once at startup and apply() adds
+    every later change, so top() and rank() never query the database. Board
+    names are 'all', 'daily:<day>', 'difficulty:<level>' and
+    'category:<id>'; 'daily' means today's board.
+
+    apply() only sees this process's score changes, so with several workers
+    app.py calls load() again periodically instead.
+    """
+
+    def __init__(self):
+        self._boards: Dict[str, Board] = {}
+
+    def resolve(self, board: str, now: Optional[float] = None) -> str:
+        return f'daily:{leaderboard_day(now)}' if board == 'daily' else board
+
+    def load(self, rows: Iterable[Tuple[str, str, int, int]]):
+        self._boards.clear()
+        self.apply(rows)
+        logger.debug("Loaded %s leaderboards", len(self._boards))
+
+    def apply(self, deltas: Iterable[Tuple[str, str, int, int]]):
+        """Add (board, player_name, wins, points) deltas."""
+        today = f'daily:{leaderboard_day()}'
+        for board, player_name, wins, points in deltas:
+            if board.startswith('daily:') and board != today:
+                continue
+            if board not in self._boards:
+                self._boards[board] = Board()
+                # Only today's daily board is kept in memory
+                for name in [name for name in self._boards if name.startswith('daily:') and name != today]:
+                    del self._boards[name]
+            self._boards[board].add(player_name, wins, points)
+
+    def top(self, board: str = 'all', limit: int = 10, offset: int = 0) -> Tuple[List[dict], int]:
+        """Entries ranked offset+1 .. offset+limit, and the board's size."""
+        ranking = self._boards.get(self.resolve(board))
+        if ranking is None:
+            return [], 0
+        entries = []
+        for index, key in enumerate(ranking.order.iter_from(offset)):
+            if index >= limit:
+                break
+            entries.append({'rank': offset + index + 1, 'player_name': key[2], 'wins': -key[0], 'points': -key[1]})
+        return entries, len(ranking.order)
+
+    def rank(self, player_name: str, board: str = 'all') -> Optional[dict]:
+        ranking = self._boards.get(self.resolve(board))
+        if ranking is None or player_name not in ranking.players:
+            return None
+        wins, points = ranking.players[player_name]
+        position = ranking.order.rank(rank_key(player_name, wins, points))
+        return {'rank': position + 1, 'player_name': player_name, 'wins': wins, 'points': points,
+                'total': len(ranking.order)}
+
+# Unit tests
+
+class TestLeaderboard(unittest.TestCase):
+
+    def test_skip_list_matches_sorted_list(self):
+        skip_list = RankedSkipList()
+        reference = []
+        rng = random.Random(7)
+        for _ in range(2000):
+            key = rng.randrange(500)
+            if key in reference:
+                self.assertTrue(skip_list.remove(key))
+                reference.remove(key)
+            else:
+                skip_list.insert(key)
+                reference.append(key)
+                reference.sort()
+        self.assertEqual(len(skip_list), len(reference))
+        self.assertEqual(list(skip_list.iter_from(0)), reference)
+        for index in range(0, len(reference), 17):
+            self.assertEqual(skip_list.rank(reference[index]), index)
+            self.assertEqual(next(iter(skip_list.iter_from(index))), reference[index])
+        self.assertIsNone(skip_list.rank(-1))
+        self.assertFalse(skip_list.remove(-1))
+
+    def test_rankings(self):
+        leaderboard = Leaderboard()
+        day = leaderboard_day()
+        leaderboard.load([
+            ('all', 'alice', 3, 20),
+            ('all', 'bob', 3, 25),
+            ('all', 'carol', 1, 40),
+            ('daily:2000-01-01', 'alice', 9, 9),
+            (f'daily:{day}', 'carol', 1, 5),
+        ])
+        entries, total = leaderboard.top('all')
+        self.assertEqual(total, 3)
+        self.assertEqual([entry['player_name'] for entry in entries], ['bob', 'alice', 'carol'])
+        leaderboard.apply([('all', 'alice', 1, 2), ('difficulty:easy', 'alice', 1, 2)])
+        self.assertEqual(leaderboard.rank('alice'), {'rank': 1, 'player_name': 'alice', 'wins': 4, 'points': 22, 'total': 3})
+        self.assertEqual(leaderboard.top('all', limit=1, offset=1)[0][0]['player_name'], 'bob')
+        self.assertEqual(leaderboard.rank('carol', 'daily')['points'], 5)
+        self.assertEqual(leaderboard.top('daily:2000-01-01'), ([], 0))
+        self.assertIsNone(leaderboard.rank('nobody'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import unittest
+from typing import Dict, Optional, Tuple
+
+import json_codec
+
+# Root level, and per-logger overrides as "room_db=DEBUG,question_bank=WARNING"
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+# 'json' for one JSON object per line, 'text' for the old human-readable lines
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+# Records per second let through for each message template; 0 disables sampling
+LOG_RATE_LIMIT = float(os.environ.get('LOG_RATE_LIMIT', 20))
+LOG_QUEUE_SIZE = 10000  # records buffered for the writer thread before new ones are dropped
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """'room_db=DEBUG, app=warning' -> {'room_db': 10, 'app': 30}. Bad entries are skipped."""
+    levels = {}
+    for entry in spec.split(','):
+        name, _, level = entry.partition('=')
+        value = logging.getLevelName(level.strip().upper())
+        if name.strip() and isinstance(value, int):
+            levels[name.strip()] = value
+    return levels
+
+class JSONFormatter(logging.Formatter):
+    """One compact JSON object per record.
+
+    Always has ts, level, logger and msg; adds exc for exceptions,
+    suppressed when the sampler dropped similar records before this one, and
+    any fields passed through extra={'fields': {...}}.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        try:
+            return json_codec.dumps_str(entry)
+        except (TypeError, ValueError):
+            entry['fields'] = repr(fields)
+            for key in fields or ():
+                entry.pop(key, None)
+            return json_codec.dumps_str(entry)
+
+class TemplateSampler(logging.Filter):
+    """Lets at most rate records per second through for each message template.
+
+    Records are keyed by logger and unformatted message, so every
+    "Player %s joined room %s" shares one budget however many rooms there are.
+    Warnings and above always pass. The next record let through reports how
+    many were dropped in between.
+    """
+
+    def __init__(self, rate: float = LOG_RATE_LIMIT, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.clock = clock
+        self._buckets: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, str(record.msg))
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) > 10000:
+                    self._buckets.clear()
+                # [tokens, last refill, records dropped since the last one let through]
+                bucket = self._buckets[key] = [self.rate, now, 0]
+            bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            record.suppressed, bucket[2] = bucket[2], 0
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread; drops them instead of blocking when it falls behind.
+
+    The message is merged with its arguments here, so the writer sees the
+    values as they were when the record was logged.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def configure_logging(level: str = LOG_LEVEL, levels: str = LOG_LEVELS, fmt: str = LOG_FORMAT,
+                      rate: float = LOG_RATE_LIMIT, stream=None) -> NonBlockingQueueHandler:
+    """Route every log record through a queue to a background writer thread.
+
+    Logging calls on the event loop only check the level, sample and enqueue;
+    formatting to text and writing to stderr happen on the writer thread.
+    Replaces any handlers already on the root logger. Safe to call again.
+    """
+    global _listener
+    stop_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(parse_levels(f'root={level}').get('root', logging.INFO))
+    for name, module_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+    handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(TemplateSampler(rate))
+    root.addHandler(handler)
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=False)
+    _listener.start()
+    return handler
+
+def stop_logging():
+    """Write out everything queued and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
+
+# Unit tests
+
+class TestLogConfig(unittest.TestCase):
+
+    def tearDown(self):
+        stop_logging()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+
+    def test_json_lines_through_the_queue(self):
+        import io
+        stream = io.StringIO()
+        configure_logging('DEBUG', 'noisy=ERROR', 'json', rate=0, stream=stream)
+        log = logging.getLogger('rooms')
+        log.debug('Player %s joined room %s', 'alice', 'ABC123', extra={'fields': {'room_code': 'ABC123'}})
+        logging.getLogger('noisy').warning('not shown')
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            log.exception('Failed')
+        stop_logging()
+        lines = [json_codec.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['msg'], 'Player alice joined room ABC123')
+        self.assertEqual((lines[0]['logger'], lines[0]['level'], lines[0]['room_code']), ('rooms', 'DEBUG', 'ABC123'))
+        self.assertIn('ValueError: boom', lines[1]['exc'])
+
+    def test_arguments_are_not_formatted_below_the_level(self):
+        import io
+
+        class Expensive:
+            def __str__(self):
+                raise AssertionError('formatted a filtered record')
+
+        configure_logging('INFO', '', 'json', stream=io.StringIO())
+        logging.getLogger('rooms').debug('State: %s', Expensive())
+
+    def test_sampler(self):
+        now = [0.0]
+        sampler = TemplateSampler(rate=2, clock=lambda: now[0])
+
+        def record(msg, level=logging.DEBUG):
+            return logging.LogRecord('app', level, __file__, 1, msg, ('x',), None)
+
+        passed = [sampler.filter(record('Joined %s')) for _ in range(5)]
+        self.assertEqual(passed, [True, True, False, False, False])
+        self.assertTrue(sampler.filter(record('Left %s')))
+        self.assertTrue(sampler.filter(record('Joined %s', logging.ERROR)))
+        now[0] = 1.0
+        first = record('Joined %s')
+        self.assertTrue(sampler.filter(first))
+        self.assertEqual(first.suppressed, 3)
+
+    def test_parse_levels(self):
+        self.assertEqual(parse_levels('room_db=DEBUG, app=warning,bad,x=LOUD'), {'room_db': 10, 'app': 30})
+
+if __name__ == '__main__':
+    unittest.main()
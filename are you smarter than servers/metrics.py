@@ -0,0 +1,371 @@
+import asyncio
+import bisect
+import collections
+import contextlib
+import logging
+import sys
+import threading
+import time
+import unittest
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from 100us to 10s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """The child for these label values, created on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} takes labels {self.labelnames}, got {values}')
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        return self.labels() if not self.labelnames else None
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+class _Value:
+    __slots__ = ('value', 'function', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.function: Optional[Callable[[], float]] = None
+        # Database threads update metrics too
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from function() at scrape time instead."""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}']
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default().set_function(function)
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def _render_child(self, values, child):
+        with child.lock:
+            counts, total = list(child.counts), child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+class Registry:
+    """Named metrics, rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f'Metric {metric.name} is already registered differently')
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self._metrics):
+            try:
+                lines.extend(self._metrics[name].render())
+            except Exception as e:
+                logger.error("Failed to render metric %s: %s", name, e)
+        return '\n'.join(lines) + '\n'
+
+# Shared by every module that records metrics; app.py serves it at /metrics
+registry = Registry()
+
+# Waits that serialize database work: a free pooled connection, the room
+# flush lock and the answer batch lock. Only waits that actually blocked are
+# observed.
+# SQLite's own writer lock is waited out inside sqlite3 (busy_timeout), where it can't be timed, so it isn't included
+DB_LOCK_WAIT = registry.histogram(
+    'db_lock_wait_seconds',
+    'Time spent waiting for a free pooled database connection (lock="pool") or an in-process lock '
+    '(room_flush, answer_batch). Does not include waits for the SQLite writer lock (busy_timeout).',
+    ('lock',))
+
+@contextlib.asynccontextmanager
+async def waited(lock: asyncio.Lock, name: str):
+    """async with lock, recording how long it blocked under DB_LOCK_WAIT."""
+    if lock.locked():
+        waiting = time.perf_counter()
+        await lock.acquire()
+        DB_LOCK_WAIT.labels(name).observe(time.perf_counter() - waiting)
+    else:
+        await lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+class MetricsMiddleware:
+    """ASGI middleware that times every HTTP request by method and route.
+
+    The route is the matched path template (/game_room/{room_code}), so room
+    codes don't create a label each; unmatched paths are counted as
+    'unmatched'.
+    """
+
+    def __init__(self, app, registry: Registry = registry):
+        self.app = app
+        self.latency = registry.histogram(
+            'http_request_duration_seconds', 'HTTP request latency by route.', ('method', 'route', 'status'))
+        self.in_progress = registry.gauge('http_requests_in_progress', 'HTTP requests being handled.')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        self.in_progress.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.in_progress.dec()
+            route = scope.get('route')
+            path = getattr(route, 'path', None) or 'unmatched'
+            self.latency.labels(scope['method'], path, str(status[0])).observe(time.perf_counter() - start)
+
+class SamplingProfiler:
+    """Statistical profiler that samples every thread's stack from a daemon thread.
+
+    While running, it records the stack of each thread every interval seconds
+    and counts identical stacks. top() returns them in the collapsed
+    'frame;frame;frame count' format that flame graph tools read. Costs
+    nothing while stopped and can be started and stopped at runtime.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks: 'collections.Counter[str]' = collections.Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: Optional[float] = None):
+        if interval is not None:
+            self.interval = interval
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        logger.debug("Sampling profiler started, interval %.1f ms", self.interval * 1000)
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            logger.debug("Sampling profiler stopped after %s samples", self.samples)
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id == own:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < self.max_depth:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{frame.f_lineno})')
+                        frame = frame.f_back
+                    self._stacks[';'.join(reversed(stack))] += 1
+
+    def top(self, limit: int = 50) -> List[Tuple[str, int]]:
+        with self._lock:
+            return self._stacks.most_common(limit)
+
+    def collapsed(self, limit: int = 500) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.top(limit))
+
+# Unit tests
+
+class TestMetrics(unittest.TestCase):
+
+    def test_prometheus_text(self):
+        registry = Registry()
+        requests = registry.counter('requests_total', 'Requests.', ('route',))
+        rooms = registry.gauge('rooms', 'Rooms.')
+        latency = registry.histogram('latency_seconds', 'Latency.', ('fn',), buckets=(0.01, 0.1))
+        requests.labels('/a "b"').inc()
+        requests.labels('/a "b"').inc(2)
+        rooms.set_function(lambda: 7)
+        for value in (0.005, 0.05, 0.05, 3.0):
+            latency.labels('get_room').observe(value)
+        self.assertIs(registry.counter('requests_total', 'Requests.', ('route',)), requests)
+        with self.assertRaises(ValueError):
+            registry.gauge('requests_total', 'Requests.')
+        text = registry.render()
+        self.assertIn('# TYPE requests_total counter\nrequests_total{route="/a \\"b\\""} 3\n', text)
+        self.assertIn('rooms 7\n', text)
+        self.assertIn('latency_seconds_bucket{fn="get_room",le="0.01"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{fn="get_room",le="0.1"} 3\n', text)
+        self.assertIn('latency_seconds_bucket{fn="get_room",le="+Inf"} 4\n', text)
+        self.assertIn('latency_seconds_count{fn="get_room"} 4\n', text)
+        with self.assertRaises(ValueError):
+            latency.labels()
+
+    def test_sampling_profiler(self):
+        profiler = SamplingProfiler(interval=0.001)
+        done = threading.Event()
+
+        def busy_loop():
+            while not done.is_set():
+                sum(range(1000))
+
+        worker = threading.Thread(target=busy_loop)
+        worker.start()
+        profiler.start()
+        time.sleep(0.05)
+        profiler.stop()
+        done.set()
+        worker.join()
+        self.assertFalse(profiler.running)
+        self.assertGreater(profiler.samples, 0)
+        self.assertIn('busy_loop', profiler.collapsed())
+        profiler.reset()
+        self.assertEqual(profiler.top(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,18 @@
+"""Upgrade an existing trivia_game.db to the current schema in place.
+
+Usage: python migrate_db.py [path/to/trivia_game.db ...]
+
+Without a path, every shard file of the configured database is upgraded
+(just trivia_game.db unless ROOM_DB_SHARDS is set).
+"""
+import sys
+
+from room_db import SCHEMA_VERSION, migrate_db, shard_paths
+
+if __name__ == '__main__':
+    for database in sys.argv[1:] or shard_paths():
+        old_version = migrate_db(database)
+        if old_version >= SCHEMA_VERSION:
+            print(f"{database} is already at schema version {old_version}")
+        else:
+            print(f"Migrated {database} from schema version {old_version} to {SCHEMA_VERSION}")
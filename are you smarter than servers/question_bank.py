@@ -0,0 +1,491 @@
+import asyncio
+import html
+import json
+import logging
+import random
+import time
+import unittest
+import urllib.parse
+import urllib.request
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+OPENTDB_URL = 'https://opentdb.com/api.php'
+FETCH_AMOUNT = 50         # questions per request, the OpenTDB maximum
+FETCH_INTERVAL = 5.0      # OpenTDB allows one request per IP every 5 seconds
+LOW_WATER = 20            # refill a bucket once it holds fewer fresh questions than this
+PREFETCH_INTERVAL = 1.0   # seconds between prefetcher passes
+ARCHIVE_SIZE = 500        # served questions kept per bucket for reuse when it runs dry
+SEEN_SIZE = 2 * ARCHIVE_SIZE  # question ids remembered per bucket to skip duplicates
+MAX_BACKOFF = 300.0       # longest wait before refetching a bucket whose fetches keep coming back empty
+
+# (category, difficulty); category None means "any category"
+BucketKey = Tuple[Optional[int], str]
+
+def question_id(question: dict) -> str:
+    """Identity used for de-duplication."""
+    return question['question']
+
+def unescape_question(question: dict) -> dict:
+    """A copy of question with its text decoded. OpenTDB's default encoding sends HTML entities."""
+    decoded = dict(question)
+    for field in ('question', 'correct_answer', 'category'):
+        if isinstance(decoded.get(field), str):
+            decoded[field] = html.unescape(decoded[field])
+    decoded['incorrect_answers'] = [html.unescape(answer) for answer in question.get('incorrect_answers', [])]
+    return decoded
+
+class OpenTDBSource:
+    """Fetches questions from opentdb.com. fetch() blocks, run it in a worker thread.
+
+    OpenTDB answers response_code 1 when a category and difficulty hold fewer
+    questions than asked for. fetch() then retries with half the amount,
+    waiting out the rate limit in between, and remembers the amount that
+    worked for the next fetch of that bucket.
+    """
+
+    def __init__(self, url: str = OPENTDB_URL, timeout: float = 10.0, retry_interval: float = FETCH_INTERVAL):
+        self.url = url
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._amounts: Dict[BucketKey, int] = {}
+
+    def _get(self, params: dict) -> dict:
+        with urllib.request.urlopen(f"{self.url}?{urllib.parse.urlencode(params)}", timeout=self.timeout) as response:
+            return json.load(response)
+
+    def fetch(self, category: Optional[int], difficulty: str, amount: int) -> List[dict]:
+        key = (category, difficulty)
+        amount = min(amount, self._amounts.get(key, amount))
+        params = {'difficulty': difficulty, 'type': 'multiple'}
+        if category is not None:
+            params['category'] = category
+        while True:
+            payload = self._get(dict(params, amount=amount))
+            code = payload.get('response_code')
+            if code == 0:
+                self._amounts[key] = amount
+                return payload['results']
+            if code != 1:
+                raise RuntimeError(f"OpenTDB returned response_code {code}")
+            if amount == 1:
+                self._amounts[key] = 1
+                return []
+            amount //= 2
+            time.sleep(self.retry_interval)
+
+class FixtureSource:
+    """Serves questions from a local list or JSON file, for offline runs and tests.
+
+    The file may be a bare list of questions or an OpenTDB response with 'results'.
+    """
+
+    def __init__(self, questions=None, path: Optional[str] = None):
+        if path is not None:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            questions = data['results'] if isinstance(data, dict) else data
+        self.questions = list(questions or [])
+        self._offsets: Dict[BucketKey, int] = {}
+
+    def fetch(self, category: Optional[int], difficulty: str, amount: int) -> List[dict]:
+        matching = [q for q in self.questions
+                    if q.get('difficulty') == difficulty
+                    and (category is None or q.get('category_id', category) == category)]
+        start = self._offsets.get((category, difficulty), 0)
+        batch = matching[start:start + amount]
+        self._offsets[(category, difficulty)] = start + len(batch)
+        return batch
+
+class QuestionBucket:
+    __slots__ = ('fresh', 'archive', 'seen', 'misses', 'retry_at')
+
+    def __init__(self):
+        self.fresh = deque()
+        self.archive = deque(maxlen=ARCHIVE_SIZE)
+        self.seen: Dict[str, None] = {}  # ids of loaded questions, oldest first, at most SEEN_SIZE
+        self.misses = 0        # fetches in a row that added nothing
+        self.retry_at = 0.0    # monotonic time before which the prefetcher skips the bucket
+
+class Deck:
+    """A room's questions for one game, in a fixed order.
+
+    Entries are (question, choices, correct_index) tuples that reference the
+    bank's question dicts. The seeded RNG makes the order and the answer
+    shuffles reproducible from the seed and the drawn questions.
+    """
+    __slots__ = ('seed', 'categories', 'difficulty', 'entries', 'answered', 'rng')
+
+    def __init__(self, seed: int, categories: List[int], difficulty: str):
+        self.seed = seed
+        self.categories = list(categories)
+        self.difficulty = difficulty
+        self.entries: List[Tuple[dict, Tuple[str, ...], int]] = []
+        self.answered = set()  # (player_name, index) pairs already graded
+        self.rng = random.Random(seed)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def category_at(self, position: int) -> Optional[int]:
+        return self.categories[position % len(self.categories)] if self.categories else None
+
+    def append(self, question: dict):
+        choices = [question['correct_answer'], *question.get('incorrect_answers', [])]
+        self.rng.shuffle(choices)
+        self.entries.append((question, tuple(choices), choices.index(question['correct_answer'])))
+
+    def served(self):
+        return {question_id(entry[0]) for entry in self.entries}
+
+class QuestionBank:
+    """In-memory question store keyed by (category, difficulty).
+
+    Buckets are filled by bulk loads and by a background prefetcher that keeps
+    every bucket in use above LOW_WATER. The prefetcher fetches one bucket per
+    pass: first those a deck ran dry on, oldest first, then the emptiest.
+    A bucket whose fetches add nothing (a category with no questions at that
+    difficulty, or a failing source) is retried after an exponential backoff,
+    so it can't starve the others. Each room plays from one shared Deck,
+    so every player in a room sees the same questions in order and answers can
+    be graded on the server. Must be used from the event loop.
+    """
+
+    def __init__(self, source=None, low_water: int = LOW_WATER, fetch_amount: int = FETCH_AMOUNT,
+                 fetch_interval: float = FETCH_INTERVAL):
+        self.source = source if source is not None else OpenTDBSource()
+        self.low_water = low_water
+        self.fetch_amount = fetch_amount
+        self.fetch_interval = fetch_interval
+        self._buckets: Dict[BucketKey, QuestionBucket] = {}
+        self._decks: Dict[str, Deck] = {}
+        # Buckets a deck found empty, with when it first did
+        self._waiting: Dict[BucketKey, float] = {}
+        self._last_fetch = 0.0
+
+    def _bucket(self, key: BucketKey) -> QuestionBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = QuestionBucket()
+        return bucket
+
+    def load(self, key: BucketKey, questions: Iterable[dict]) -> int:
+        """Bulk-load questions into a bucket, skipping duplicates. Returns how many were added.
+
+        Text is unescaped once here, so choices are served and graded as players see them.
+        """
+        bucket = self._bucket(key)
+        added = 0
+        for question in questions:
+            question = unescape_question(question)
+            qid = question_id(question)
+            if qid in bucket.seen:
+                continue
+            bucket.seen[qid] = None
+            if len(bucket.seen) > SEEN_SIZE:
+                del bucket.seen[next(iter(bucket.seen))]
+            bucket.fresh.append(question)
+            added += 1
+        if added:
+            self._waiting.pop(key, None)
+        return added
+
+    def want(self, categories: List[int], difficulty: str):
+        """Register the buckets a room will draw from so the prefetcher fills them."""
+        for category in categories or [None]:
+            self._bucket((category, difficulty))
+
+    def available(self, key: BucketKey) -> int:
+        bucket = self._buckets.get(key)
+        return len(bucket.fresh) if bucket else 0
+
+    def draw(self, key: BucketKey, exclude=(), rng=random) -> Optional[dict]:
+        """Take a fresh question, falling back to a served one when the bucket is dry."""
+        bucket = self._bucket(key)
+        if bucket.fresh:
+            question = bucket.fresh.popleft()
+            bucket.archive.append(question)
+            return question
+        self._waiting.setdefault(key, time.monotonic())
+        candidates = [q for q in bucket.archive if question_id(q) not in exclude]
+        return rng.choice(candidates) if candidates else None
+
+    def _extend(self, deck: Deck, count: int, served: set) -> List[dict]:
+        drawn = []
+        for position in range(len(deck), len(deck) + count):
+            question = self.draw((deck.category_at(position), deck.difficulty), exclude=served, rng=deck.rng)
+            if question is None:
+                break
+            served.add(question_id(question))
+            drawn.append(question)
+        return drawn
+
+    def build_deck(self, room_code: str, categories: List[int], difficulty: str, size: int,
+                   seed: Optional[int] = None) -> Deck:
+        """Draw and shuffle a room's deck for a new game, replacing any previous one.
+
+        The deck may come out shorter than size if the bank is low; it is
+        extended from the bank on demand as players get further.
+        """
+        deck = Deck(seed if seed is not None else random.getrandbits(32), categories, difficulty)
+        drawn = self._extend(deck, size, set())
+        deck.rng.shuffle(drawn)
+        for question in drawn:
+            deck.append(question)
+        self._decks[room_code] = deck
+        return deck
+
+    def deck_entry(self, room_code: str, index: int, categories: List[int], difficulty: str):
+        """The room's (question, choices, correct_index) at index, or None if the bank is dry."""
+        deck = self._decks.get(room_code)
+        if deck is None:
+            deck = self._decks[room_code] = Deck(random.getrandbits(32), categories, difficulty)
+        if index >= len(deck):
+            for question in self._extend(deck, index + 1 - len(deck), deck.served()):
+                deck.append(question)
+            if index >= len(deck):
+                return None
+        return deck.entries[index]
+
+    def question_for(self, room_code: str, index: int, categories: List[int], difficulty: str) -> Optional[dict]:
+        """The room's question at index as served to clients, with its shuffled choices.
+
+        Only the text, category, difficulty and choices are served; the answer
+        stays in the deck for grade_answer.
+        """
+        entry = self.deck_entry(room_code, index, categories, difficulty)
+        if entry is None:
+            return None
+        question, choices, _ = entry
+        return {
+            'question': question['question'],
+            'category': question.get('category', question.get('category_id')),
+            'difficulty': question.get('difficulty', difficulty),
+            'choices': list(choices),
+        }
+
+    def grade_answer(self, room_code: str, player_name: str, index: int, answer: str) -> Tuple[Optional[bool], str]:
+        """Check an answer against the room's deck.
+
+        Returns (is_correct, '') or (None, reason) if the answer can't be graded.
+        Each player can be graded once per question: the question is marked
+        answered until release_answer() is called, which the caller does if
+        the answer could not be recorded.
+        """
+        deck = self._decks.get(room_code)
+        if deck is None or not 0 <= index < len(deck):
+            return None, f'No question {index} in room {room_code}'
+        if (player_name, index) in deck.answered:
+            return None, f'Question {index} was already answered'
+        deck.answered.add((player_name, index))
+        question, choices, correct_index = deck.entries[index]
+        return answer == choices[correct_index], ''
+
+    def release_answer(self, room_code: str, player_name: str, index: int):
+        """Let the player answer the question again, after their answer failed to record."""
+        deck = self._decks.get(room_code)
+        if deck is not None:
+            deck.answered.discard((player_name, index))
+
+    def forget_room(self, room_code: str):
+        self._decks.pop(room_code, None)
+
+    async def fetch(self, key: BucketKey) -> int:
+        """Fetch one batch for a bucket from the source, honoring the fetch interval.
+
+        A fetch that adds nothing or fails backs the bucket off for
+        fetch_interval * 2**misses seconds, up to MAX_BACKOFF.
+        """
+        wait = self._last_fetch + self.fetch_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_fetch = time.monotonic()
+        bucket = self._bucket(key)
+        category, difficulty = key
+        added = 0
+        try:
+            questions = await asyncio.to_thread(self.source.fetch, category, difficulty, self.fetch_amount)
+            added = self.load(key, questions)
+        finally:
+            # The source may have retried, so the interval runs from its last request
+            self._last_fetch = time.monotonic()
+            if added:
+                bucket.misses = 0
+                bucket.retry_at = 0.0
+            else:
+                bucket.misses += 1
+                backoff = min(max(self.fetch_interval, 1.0) * 2 ** bucket.misses, MAX_BACKOFF)
+                bucket.retry_at = time.monotonic() + backoff
+        return added
+
+    def next_to_fetch(self) -> Optional[BucketKey]:
+        """The bucket the prefetcher fills next, or None if none needs it now."""
+        now = time.monotonic()
+        low = [key for key, bucket in self._buckets.items()
+               if len(bucket.fresh) < self.low_water and bucket.retry_at <= now]
+        if not low:
+            return None
+        return min(low, key=lambda key: (key not in self._waiting, self._waiting.get(key, 0.0),
+                                         len(self._buckets[key].fresh)))
+
+    async def top_up(self) -> int:
+        """One prefetcher pass: fetch the bucket next_to_fetch() picks. Returns how many questions were added."""
+        key = self.next_to_fetch()
+        if key is None:
+            return 0
+        try:
+            return await self.fetch(key)
+        except Exception as e:
+            logger.error("Failed to prefetch questions for %s: %s", key, e)
+            return 0
+
+    async def run(self, interval: float = PREFETCH_INTERVAL):
+        """Background task that keeps every bucket topped up."""
+        while True:
+            if not await self.top_up():
+                await asyncio.sleep(interval)
+
+# Unit tests
+def _fixture_questions(difficulty, count, category=9):
+    return [{
+        'category_id': category,
+        'difficulty': difficulty,
+        'question': f'{difficulty} question {category}-{n}',
+        'correct_answer': 'yes',
+        'incorrect_answers': ['no', 'maybe', 'never'],
+    } for n in range(count)]
+
+class TestQuestionBank(unittest.TestCase):
+    def test_load_skips_duplicates(self):
+        bank = QuestionBank(FixtureSource())
+        questions = _fixture_questions('easy', 5)
+        self.assertEqual(bank.load((9, 'easy'), questions), 5)
+        self.assertEqual(bank.load((9, 'easy'), questions), 0)
+        self.assertEqual(bank.available((9, 'easy')), 5)
+
+    def test_room_sees_one_sequence(self):
+        bank = QuestionBank(FixtureSource())
+        bank.load((9, 'easy'), _fixture_questions('easy', 3, 9))
+        bank.load((10, 'easy'), _fixture_questions('easy', 3, 10))
+        first = bank.question_for('room1', 0, [9, 10], 'easy')
+        second = bank.question_for('room1', 1, [9, 10], 'easy')
+        self.assertEqual(first['category'], 9)
+        self.assertEqual(second['category'], 10)
+        self.assertEqual(sorted(first['choices']), ['maybe', 'never', 'no', 'yes'])
+        self.assertEqual(sorted(first), ['category', 'choices', 'difficulty', 'question'])
+        self.assertEqual(bank.question_for('room1', 0, [9, 10], 'easy'), first)
+        other = bank.question_for('room2', 0, [9, 10], 'easy')
+        self.assertNotEqual(question_id(other), question_id(first))
+
+    def test_dry_bucket_reuses_served_questions(self):
+        bank = QuestionBank(FixtureSource())
+        bank.load((None, 'hard'), _fixture_questions('hard', 2))
+        bank.question_for('room1', 1, [], 'hard')
+        self.assertEqual(bank.available((None, 'hard')), 0)
+        # room2 can still play, but room1 has seen everything
+        self.assertIsNotNone(bank.question_for('room2', 0, [], 'hard'))
+        self.assertIsNone(bank.question_for('room1', 2, [], 'hard'))
+
+    def test_deck_is_reproducible_from_seed(self):
+        questions = _fixture_questions('easy', 6, 9) + _fixture_questions('easy', 6, 10)
+        orders = []
+        for _ in range(2):
+            bank = QuestionBank(FixtureSource())
+            bank.load((9, 'easy'), questions[:6])
+            bank.load((10, 'easy'), questions[6:])
+            deck = bank.build_deck('room1', [9, 10], 'easy', 8, seed=42)
+            orders.append([(question_id(q), choices) for q, choices, _ in deck.entries])
+        self.assertEqual(len(orders[0]), 8)
+        self.assertEqual(orders[0], orders[1])
+
+    def test_grade_answer(self):
+        bank = QuestionBank(FixtureSource())
+        bank.load((None, 'easy'), _fixture_questions('easy', 3))
+        bank.build_deck('room1', [], 'easy', 3, seed=1)
+        self.assertEqual(bank.grade_answer('room1', 'alice', 0, 'yes'), (True, ''))
+        self.assertEqual(bank.grade_answer('room1', 'bob', 0, 'no'), (False, ''))
+        self.assertIsNone(bank.grade_answer('room1', 'alice', 0, 'yes')[0])
+        bank.release_answer('room1', 'alice', 0)
+        self.assertEqual(bank.grade_answer('room1', 'alice', 0, 'no'), (False, ''))
+        self.assertIsNone(bank.grade_answer('room1', 'alice', 5, 'yes')[0])
+        self.assertIsNone(bank.grade_answer('room2', 'alice', 0, 'yes')[0])
+
+    def test_opentdb_asks_for_fewer_when_a_bucket_is_small(self):
+        requests = []
+
+        class SmallCategory(OpenTDBSource):
+            def _get(self, params):
+                requests.append(params['amount'])
+                if params['amount'] > 12:
+                    return {'response_code': 1, 'results': []}
+                return {'response_code': 0, 'results': _fixture_questions('hard', params['amount'], 30)}
+
+        source = SmallCategory(retry_interval=0)
+        self.assertEqual(len(source.fetch(30, 'hard', 50)), 12)
+        self.assertEqual(len(source.fetch(30, 'hard', 50)), 12)
+        self.assertEqual(requests, [50, 25, 12, 12])
+
+        class RateLimited(OpenTDBSource):
+            def _get(self, params):
+                return {'response_code': 5}
+
+        with self.assertRaises(RuntimeError):
+            RateLimited().fetch(None, 'easy', 10)
+
+    def test_seen_is_bounded(self):
+        bank = QuestionBank(FixtureSource())
+        bank.load((None, 'easy'), _fixture_questions('easy', SEEN_SIZE + 10))
+        self.assertEqual(len(bank._buckets[(None, 'easy')].seen), SEEN_SIZE)
+
+    def test_entities_are_decoded(self):
+        bank = QuestionBank(FixtureSource())
+        bank.load((None, 'easy'), [{
+            'difficulty': 'easy',
+            'question': 'Who wrote &quot;Hamlet&quot;?',
+            'correct_answer': 'William Shakespeare&#039;s ghost &amp; co',
+            'incorrect_answers': ['Marlowe &amp; Kyd', 'Jonson', 'Bacon'],
+        }])
+        question = bank.question_for('room1', 0, [], 'easy')
+        self.assertEqual(question['question'], 'Who wrote "Hamlet"?')
+        self.assertIn('Marlowe & Kyd', question['choices'])
+        self.assertEqual(bank.grade_answer('room1', 'alice', 0, "William Shakespeare's ghost & co"), (True, ''))
+
+    def test_prefetcher_tops_up_wanted_buckets(self):
+        source = FixtureSource(_fixture_questions('medium', 30, 12))
+        bank = QuestionBank(source, low_water=10, fetch_amount=8, fetch_interval=0)
+        bank.want([12], 'medium')
+        self.assertEqual(asyncio.run(bank.top_up()), 8)
+        self.assertEqual(asyncio.run(bank.top_up()), 8)
+        self.assertEqual(asyncio.run(bank.top_up()), 0)  # above low_water now
+        self.assertEqual(bank.available((12, 'medium')), 16)
+
+    def test_waiting_bucket_is_fetched_first(self):
+        source = FixtureSource(_fixture_questions('easy', 30, 9))
+        bank = QuestionBank(source, low_water=10, fetch_amount=8, fetch_interval=0)
+        # Buckets the source has nothing for, registered first
+        bank.want([], 'medium')
+        bank.want([], 'hard')
+        bank.want([9], 'easy')
+        self.assertIsNone(bank.question_for('room1', 0, [9], 'easy'))
+        self.assertEqual(bank.next_to_fetch(), (9, 'easy'))
+        self.assertEqual(asyncio.run(bank.top_up()), 8)
+        self.assertIsNotNone(bank.question_for('room1', 0, [9], 'easy'))
+
+    def test_empty_buckets_back_off(self):
+        bank = QuestionBank(FixtureSource(_fixture_questions('easy', 30, 9)), low_water=10, fetch_amount=8,
+                            fetch_interval=0)
+        bank.want([], 'hard')
+        bank.want([9], 'easy')
+        fetched = []
+        for _ in range(3):
+            fetched.append(bank.next_to_fetch())
+            asyncio.run(bank.top_up())
+        # hard came back empty once and waits; easy is filled meanwhile
+        self.assertEqual(fetched.count((None, 'hard')), 1)
+        self.assertEqual(bank.available((9, 'easy')), 16)
+        self.assertGreater(bank._buckets[(None, 'hard')].retry_at, time.monotonic())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+import time
+import unittest
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# How long a disconnected player keeps their place; 0 removes them right away
+RECONNECT_GRACE = float(os.environ.get('RECONNECT_GRACE_SECONDS', 20))
+RECONNECT_TICK = 1.0  # seconds between passes over expired holds
+
+Departure = Tuple[str, str]  # (room_code, player_name)
+
+class DisconnectGrace:
+    """Keeps a disconnected player in their room for a grace period.
+
+    hold() starts a player's grace period when their last session drops and
+    cancel() ends it when they come back. Every tick, run() hands all holds
+    that ran out to remove(departures) in a single call, so a burst of
+    dropped connections costs one batch of removals instead of one per
+    player. Holds expire in the order they were made, since the grace period
+    is the same for all of them.
+    """
+
+    def __init__(self, remove: Callable[[List[Departure]], Awaitable[None]], grace: float = RECONNECT_GRACE,
+                 tick: float = RECONNECT_TICK, clock: Callable[[], float] = time.monotonic):
+        self.remove = remove
+        self.grace = grace
+        self.tick = tick
+        self.clock = clock
+        # Deadlines in the order they were set
+        self._deadlines: Dict[Departure, float] = {}
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, departure: Departure):
+        return departure in self._deadlines
+
+    async def hold(self, room_code: str, player_name: str):
+        """Start the player's grace period, or remove them now if there is none."""
+        if self.grace <= 0:
+            await self.remove([(room_code, player_name)])
+            return
+        self._deadlines.pop((room_code, player_name), None)
+        self._deadlines[(room_code, player_name)] = self.clock() + self.grace
+
+    def cancel(self, room_code: str, player_name: str) -> bool:
+        """The player is back. Returns True if they were being held."""
+        return self._deadlines.pop((room_code, player_name), None) is not None
+
+    def forget_room(self, room_code: str):
+        for departure in [d for d in self._deadlines if d[0] == room_code]:
+            del self._deadlines[departure]
+
+    def expired(self) -> List[Departure]:
+        """Take every hold whose grace period is over."""
+        now = self.clock()
+        departures = []
+        for departure, deadline in self._deadlines.items():
+            if deadline > now:
+                break
+            departures.append(departure)
+        for departure in departures:
+            del self._deadlines[departure]
+        return departures
+
+    async def remove_expired(self) -> int:
+        departures = self.expired()
+        if departures:
+            await self.remove(departures)
+        return len(departures)
+
+    async def run(self):
+        """Background task that removes expired holds every tick."""
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                removed = await self.remove_expired()
+                if removed:
+                    logger.debug("Removed %s players whose reconnect grace ran out", removed)
+            except Exception as e:
+                logger.error("Failed to remove disconnected players: %s", e)
+
+# Unit tests
+
+class TestDisconnectGrace(unittest.TestCase):
+
+    def test_holds_expire_in_one_batch(self):
+        now = [0.0]
+        batches = []
+
+        async def remove(departures):
+            batches.append(departures)
+
+        async def scenario():
+            grace = DisconnectGrace(remove, grace=10, clock=lambda: now[0])
+            await grace.hold('ROOM01', 'alice')
+            now[0] = 2
+            await grace.hold('ROOM01', 'bob')
+            await grace.hold('ROOM02', 'carol')
+            now[0] = 5
+            await grace.hold('ROOM03', 'dave')
+            # alice's connection drops again, her grace period restarts
+            await grace.hold('ROOM01', 'alice')
+            self.assertTrue(grace.cancel('ROOM02', 'carol'))
+            self.assertFalse(grace.cancel('ROOM02', 'carol'))
+            now[0] = 9
+            self.assertEqual(await grace.remove_expired(), 0)
+            now[0] = 15
+            self.assertEqual(await grace.remove_expired(), 3)
+            self.assertEqual(len(grace), 0)
+
+            immediate = DisconnectGrace(remove, grace=0)
+            await immediate.hold('ROOM04', 'erin')
+            self.assertEqual(len(immediate), 0)
+
+        asyncio.run(scenario())
+        self.assertEqual(batches, [[('ROOM01', 'bob'), ('ROOM03', 'dave'), ('ROOM01', 'alice')],
+                                   [('ROOM04', 'erin')]])
+
+    def test_forget_room(self):
+        async def scenario():
+            grace = DisconnectGrace(None, grace=10)
+            await grace.hold('ROOM01', 'alice')
+            await grace.hold('ROOM02', 'bob')
+            grace.forget_room('ROOM01')
+            return grace
+
+        grace = asyncio.run(scenario())
+        self.assertNotIn(('ROOM01', 'alice'), grace)
+        self.assertIn(('ROOM02', 'bob'), grace)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import logging
+import os
+import string
+import unittest
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 6
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH  # 36^6, just over 2^31
+HALF_BITS = 16                             # Feistel halves; 2^32 covers CODE_SPACE
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+def encode_code(n: int) -> str:
+    """Render 0 <= n < CODE_SPACE as a fixed-width room code."""
+    chars = []
+    for _ in range(CODE_LENGTH):
+        n, digit = divmod(n, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+class RoomCodeAllocator:
+    """Hands out room codes without collisions and without database lookups.
+
+    Codes are a keyed permutation of a counter: a 4-round Feistel network over
+    32 bits, cycle-walked into the 36^6 code space. The permutation is a
+    bijection, so two counter values never map to the same code and the codes
+    still look random to players. Codes that are in use (reserved at startup,
+    or allocated but not yet released) are skipped, which keeps codes unique
+    across restarts when the key and counter start fresh. allocate() and
+    release() are O(1) and run on the event loop, so no lock is needed.
+    """
+
+    def __init__(self, key: Optional[bytes] = None, start: Optional[int] = None):
+        key = key if key is not None else os.urandom(ROUNDS * 2)
+        self._round_keys = [int.from_bytes(key[i * 2:i * 2 + 2], 'big') for i in range(ROUNDS)]
+        self._next = (start if start is not None else int.from_bytes(os.urandom(4), 'big')) % CODE_SPACE
+        self._in_use = set()
+
+    def _permute(self, n: int) -> int:
+        left, right = n >> HALF_BITS, n & HALF_MASK
+        for round_key in self._round_keys:
+            mixed = ((right ^ round_key) * 0x45D9F3B) & 0xFFFFFFFF
+            mixed ^= mixed >> 16
+            left, right = right, left ^ (mixed & HALF_MASK)
+        return (left << HALF_BITS) | right
+
+    def _code_at(self, n: int) -> str:
+        # Cycle-walk: re-apply the permutation until it lands inside the code space
+        n = self._permute(n)
+        while n >= CODE_SPACE:
+            n = self._permute(n)
+        return encode_code(n)
+
+    def __len__(self) -> int:
+        return len(self._in_use)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._in_use
+
+    def __iter__(self):
+        return iter(self._in_use)
+
+    def reserve(self, codes: Iterable[str]):
+        """Mark codes that already exist, e.g. rooms loaded from the database."""
+        self._in_use.update(codes)
+
+    def allocate(self) -> str:
+        if len(self._in_use) >= CODE_SPACE:
+            raise RuntimeError('Room code space exhausted')
+        while True:
+            code = self._code_at(self._next)
+            self._next = (self._next + 1) % CODE_SPACE
+            if code not in self._in_use:
+                self._in_use.add(code)
+                return code
+            logger.debug("Room code %s is still in use, skipping", code)
+
+    def release(self, code: str):
+        self._in_use.discard(code)
+
+# Unit tests
+
+class TestRoomCodeAllocator(unittest.TestCase):
+
+    def test_codes_are_unique_and_well_formed(self):
+        allocator = RoomCodeAllocator(key=b'testkey!', start=0)
+        codes = [allocator.allocate() for _ in range(20000)]
+        self.assertEqual(len(set(codes)), len(codes))
+        for code in codes[:100]:
+            self.assertEqual(len(code), CODE_LENGTH)
+            self.assertTrue(all(c in ALPHABET for c in code))
+        self.assertEqual(len(allocator), 20000)
+
+    def test_permutation_is_a_bijection(self):
+        allocator = RoomCodeAllocator(key=b'testkey!')
+        sample = range(0, 1 << 32, 65537)
+        self.assertEqual(len({allocator._permute(n) for n in sample}), len(sample))
+
+    def test_reserved_codes_are_skipped(self):
+        first = RoomCodeAllocator(key=b'testkey!', start=0)
+        taken = [first.allocate() for _ in range(5)]
+        second = RoomCodeAllocator(key=b'testkey!', start=0)
+        second.reserve(taken[1:4])
+        self.assertEqual(second.allocate(), taken[0])
+        self.assertEqual(second.allocate(), taken[4])
+
+    def test_release(self):
+        allocator = RoomCodeAllocator()
+        code = allocator.allocate()
+        self.assertIn(code, allocator)
+        allocator.release(code)
+        self.assertNotIn(code, allocator)
+        self.assertEqual(len(allocator), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,135 +1,509 @@
+import os
+import queue
 import sqlite3
+import threading
 import time
 import json
+import tempfile
 import unittest
-from contextlib import closing
+import zlib
+from contextlib import closing, contextmanager
+
+import json_codec
+from metrics import DB_LOCK_WAIT
 
 DATABASE = 'trivia_game.db'
+SCHEMA_VERSION = 7  # stored in PRAGMA user_version, see migrate_db()
+
+# Connection pool settings. The pool hands out long-lived connections to the
+# db_executor threads, so size it close to the number of worker threads that
+# touch the database at the same time.
+POOL_SIZE = int(os.environ.get('ROOM_DB_POOL_SIZE', 8))
+BUSY_TIMEOUT = 5.0  # seconds to wait on a locked database before failing
+
+# Rooms are spread over this many database files by a hash of room_code. Each
+# file has its own pool and its own writer lock, so independent rooms don't
+# wait on each other's writes. With one shard the file is DATABASE itself.
+SHARDS = int(os.environ.get('ROOM_DB_SHARDS', 1))
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',      # readers no longer block the writer
+    'PRAGMA synchronous = NORMAL',    # safe with WAL, one fsync per checkpoint
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -8000',      # 8 MB page cache per connection
+)
+
+class ConnectionPool:
+    """A bounded pool of reusable SQLite connections.
+
+    A thread that already holds a connection gets the same one back on nested
+    calls, so helpers that call each other never deadlock on an exhausted pool.
+    """
+
+    def __init__(self, database, size):
+        self.database = database
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _open(self):
+        conn = sqlite3.connect(self.database, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if not can_create:
+            waiting = time.perf_counter()
+            conn = self._idle.get()
+            DB_LOCK_WAIT.labels('pool').observe(time.perf_counter() - waiting)
+            return conn
+        try:
+            return self._open()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    @property
+    def created(self):
+        return self._created
+
+    def close(self):
+        """Close every idle connection. Checked-out connections are left alone."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+_pools = None
+_pool_lock = threading.Lock()
+
+def shard_paths():
+    """The database file of every shard, in shard order."""
+    if SHARDS <= 1:
+        return [DATABASE]
+    base, ext = os.path.splitext(DATABASE)
+    return [f'{base}-{shard}{ext}' for shard in range(SHARDS)]
+
+def shard_for(room_code):
+    """Index of the shard that stores a room, or a player's stats. Stable across processes."""
+    return zlib.crc32(room_code.encode()) % SHARDS if SHARDS > 1 else 0
+
+def get_pools():
+    """Return one pool per shard, rebuilding them if DATABASE, POOL_SIZE or SHARDS changed."""
+    global _pools
+    pools = _pools
+    paths = shard_paths()
+    if pools is not None and [pool.database for pool in pools] == paths and pools[0].size == max(1, POOL_SIZE):
+        return pools
+    with _pool_lock:
+        if _pools is None or [pool.database for pool in _pools] != paths or _pools[0].size != max(1, POOL_SIZE):
+            if _pools is not None:
+                for pool in _pools:
+                    pool.close()
+            _pools = [ConnectionPool(path, POOL_SIZE) for path in paths]
+        return _pools
+
+def get_pool(shard=0):
+    return get_pools()[shard]
+
+def configure_pool(database=None, pool_size=None, shards=None):
+    """Point the module at another database file, resize the pool or change the shard count."""
+    global DATABASE, POOL_SIZE, SHARDS
+    if database is not None:
+        DATABASE = database
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    if shards is not None:
+        SHARDS = shards
+    return get_pool()
+
+def close_pool():
+    global _pools
+    with _pool_lock:
+        if _pools is not None:
+            for pool in _pools:
+                pool.close()
+            _pools = None
+
+def _connection(room_code=None):
+    """A connection to the shard holding room_code, or to the first shard."""
+    return get_pool(shard_for(room_code) if room_code is not None else 0).connection()
+
+def _scatter(query):
+    """Run query(conn) on every shard and return the results in shard order."""
+    results = []
+    for pool in get_pools():
+        with pool.connection() as conn:
+            results.append(query(conn))
+    return results
 
 def init_db():
+    """Recreate every table empty, for tests. Servers call migrate_db(), which keeps the data."""
     with open('schema.sql', 'r') as f:
         schema = f.read()
-    with closing(sqlite3.connect(DATABASE)) as conn:
+
+    def reset(conn):
         with conn:
+            conn.execute('DROP TABLE IF EXISTS room_players')
             conn.execute('DROP TABLE IF EXISTS player_scores')
             conn.execute('DROP TABLE IF EXISTS rooms')
+            conn.execute('DROP TABLE IF EXISTS leaderboard')
+            conn.execute('DROP TABLE IF EXISTS player_stats')
+            conn.execute('DROP TABLE IF EXISTS game_events')
         with conn:
             conn.executescript(schema)
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    _scatter(reset)
+
+@contextmanager
+def temporary_database():
+    """Point the module at a fresh database in a temporary directory, for tests.
+
+    init_db() drops every table, so tests must never run it against the working database.
+    """
+    database = DATABASE
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            configure_pool(database=os.path.join(tmp, os.path.basename(database)))
+            init_db()
+            yield
+        finally:
+            close_pool()
+            configure_pool(database=database)
+
+def migrate_db(database=None):
+    """Upgrade an existing database file to SCHEMA_VERSION in place.
+
+    Version 2 moves the JSON-encoded rooms.players column into the room_players
+    table and adds the player_scores indexes; version 3 adds the last_active
+    index; version 4 adds the leaderboard table, seeded from the scores still
+    on file; version 5 adds the player_stats table; version 6 adds the
+    game_events table; version 7 seeds player_stats from the scores on file
+    and orders the player history index by time.
+    Missing tables and indexes come from schema.sql. Every step is
+    idempotent, and the version is only written once all of them are done, so
+    an interrupted migration can simply be run again. Returns the old version.
+    Without a path every shard is migrated and the lowest old version is
+    returned.
+    """
+    paths = shard_paths() if database is None else [database]
+    version = min(_migrate_file(path) for path in paths)
+    if version < 7:
+        _seed_player_stats(paths)
+    for path in paths:
+        with closing(sqlite3.connect(path, timeout=BUSY_TIMEOUT)) as conn:
+            with conn:
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    return version
+
+def _migrate_file(database):
+    """Bring one file's tables up to date. Returns its old version; migrate_db() writes the new one."""
+    with open('schema.sql', 'r') as f:
+        schema = f.read()
+    conn = sqlite3.connect(database, timeout=BUSY_TIMEOUT)
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return version
+        with conn:
+            # Files from before these columns existed
+            for table, column, definition in (
+                ('rooms', 'categories', 'TEXT'),
+                ('player_scores', 'wins', 'INTEGER NOT NULL DEFAULT 0'),
+            ):
+                columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+                if columns and column not in columns:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            # The unique index below needs one score row per player per room
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'player_scores'").fetchone():
+                conn.execute('''
+                    DELETE FROM player_scores WHERE id NOT IN (
+                        SELECT MIN(id) FROM player_scores GROUP BY room_code, player_name
+                    )
+                ''')
+            conn.execute('DROP INDEX IF EXISTS idx_player_scores_player')
+        conn.executescript(schema)
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(rooms)')]
+        with conn:
+            if 'players' in columns:
+                rows = conn.execute('SELECT room_code, players, last_active FROM rooms').fetchall()
+                conn.executemany('''
+                    INSERT OR IGNORE INTO room_players (room_code, player_name, position, joined_at)
+                    VALUES (?, ?, ?, ?)
+                ''', [
+                    (room_code, player_name, position, last_active or time.time())
+                    for room_code, players, last_active in rows
+                    for position, player_name in enumerate(json_codec.loads(players) if players else [])
+                ])
+                conn.execute('ALTER TABLE rooms DROP COLUMN players')
+            if version < 4:
+                conn.execute('''
+                    INSERT OR IGNORE INTO leaderboard (board, player_name, wins, points, updated)
+                    SELECT board, player_name, SUM(wins), SUM(score), MAX(timestamp) FROM (
+                        SELECT 'all' AS board, s.player_name, s.wins, s.score, s.timestamp
+                        FROM player_scores s
+                        UNION ALL
+                        SELECT 'difficulty:' || r.difficulty, s.player_name, s.wins, s.score, s.timestamp
+                        FROM player_scores s JOIN rooms r ON r.room_code = s.room_code
+                        UNION ALL
+                        SELECT 'category:' || c.value, s.player_name, s.wins, s.score, s.timestamp
+                        FROM player_scores s JOIN rooms r ON r.room_code = s.room_code, json_each(r.categories) c
+                    ) GROUP BY board, player_name
+                ''')
+        return version
+    finally:
+        conn.close()
+
+def _seed_player_stats(paths):
+    """Count the games already in player_scores into player_stats.
+
+    A player is counted in every game of each room they have a score row in.
+    A room's games are its highest win count, at least 1 once it has had a
+    winner, so games with several winners are undercounted rather than
+    over. Streaks can't be recovered from the totals and start at 0. Each
+    player's row goes to the file of shard_for(player_name); existing rows
+    keep whichever counts are higher, so seeding twice changes nothing.
+    """
+    totals = {}
+    for path in paths:
+        with closing(sqlite3.connect(path, timeout=BUSY_TIMEOUT)) as conn:
+            for player_name, played, won, last_played in conn.execute('''
+                SELECT s.player_name, SUM(MAX(g.games, 1)), SUM(s.wins), MAX(s.timestamp)
+                FROM player_scores s
+                JOIN rooms r ON r.room_code = s.room_code
+                JOIN (SELECT room_code, MAX(wins) AS games FROM player_scores GROUP BY room_code) g
+                    ON g.room_code = s.room_code
+                WHERE g.games > 0 OR COALESCE(r.winners, '[]') != '[]'
+                GROUP BY s.player_name
+            '''):
+                total = totals.get(player_name, (0, 0, 0.0))
+                totals[player_name] = (total[0] + played, total[1] + won, max(total[2], last_played))
+    by_path = {}
+    for player_name, (played, won, last_played) in totals.items():
+        path = paths[shard_for(player_name)] if len(paths) > 1 else paths[0]
+        by_path.setdefault(path, []).append((player_name, played, won, last_played))
+    for path, rows in by_path.items():
+        with closing(sqlite3.connect(path, timeout=BUSY_TIMEOUT)) as conn:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO player_stats (player_name, games_played, games_won, current_streak, best_streak, last_played)
+                    VALUES (?, ?, ?, 0, 0, ?)
+                    ON CONFLICT(player_name) DO UPDATE SET
+                        games_played = MAX(games_played, excluded.games_played),
+                        games_won = MAX(games_won, excluded.games_won),
+                        last_played = MAX(COALESCE(last_played, 0), excluded.last_played)
+                ''', rows)
+
+def leaderboard_day(now=None):
+    """The UTC date naming a daily leaderboard."""
+    return time.strftime('%Y-%m-%d', time.gmtime(now))
+
+def _bump_leaderboard(conn, room_code, deltas, now):
+    """Add {player_name: (wins, points)} to every leaderboard the room counts towards.
+
+    Runs inside the caller's transaction and returns the (board, player_name,
+    wins, points) rows it added, for the in-memory Leaderboard.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta != (0, 0)}
+    if not deltas:
+        return []
+    room = conn.execute('SELECT difficulty, categories FROM rooms WHERE room_code = ?', (room_code,)).fetchone()
+    if room is None:
+        return []
+    boards = ['all', f'daily:{leaderboard_day(now)}', f"difficulty:{room['difficulty']}"]
+    boards += [f'category:{category}' for category in (json_codec.loads(room['categories']) if room['categories'] else [])]
+    rows = [(board, name, wins, points) for board in boards for name, (wins, points) in deltas.items()]
+    conn.executemany('''
+        INSERT INTO leaderboard (board, player_name, wins, points, updated) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(board, player_name) DO UPDATE SET
+            wins = wins + excluded.wins, points = points + excluded.points, updated = excluded.updated
+    ''', [row + (now,) for row in rows])
+    return rows
+
+def load_leaderboard(day=None):
+    """Every leaderboard row except past days' boards, summed across shards."""
+    today = f'daily:{leaderboard_day() if day is None else day}'
+    totals = {}
+    for rows in _scatter(lambda conn: conn.execute('''
+        SELECT board, player_name, wins, points FROM leaderboard
+        WHERE board NOT LIKE 'daily:%' OR board = ?
+    ''', (today,)).fetchall()):
+        for board, player_name, wins, points in rows:
+            total = totals.get((board, player_name), (0, 0))
+            totals[(board, player_name)] = (total[0] + wins, total[1] + points)
+    return [(board, player_name, wins, points) for (board, player_name), (wins, points) in totals.items()]
 
 def add_room(room_code, host, question_goal, max_players, difficulty, categories=None):
-    players = [host]
-    categories_json = json.dumps(categories if categories is not None else [])
-    players_json = json.dumps(players)
-    with closing(sqlite3.connect(DATABASE)) as conn:
+    categories_json = json_codec.dumps_str(categories if categories is not None else [])
+    now = time.time()
+    with _connection(room_code) as conn:
         with conn:
             conn.execute('''
                 INSERT INTO rooms (
-                    room_code, host, players, game_started, question_goal, max_players, winners,
+                    room_code, host, game_started, question_goal, max_players, winners,
                     difficulty, categories, last_active, creation_time
                 )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
-                room_code, host, players_json, False, question_goal, max_players, '[]',
-                difficulty, categories_json, time.time(), time.time()
+                room_code, host, False, question_goal, max_players, '[]',
+                difficulty, categories_json, now, now
             ))
-    # Add the host to player_scores immediately after room creation
-    add_or_update_player(room_code, host)
+            conn.execute('''
+                INSERT INTO room_players (room_code, player_name, position, joined_at)
+                VALUES (?, ?, 0, ?)
+            ''', (room_code, host, now))
+            # Add the host to player_scores immediately after room creation
+            _upsert_player(conn, room_code, host, now)
+
+def _room_from_row(room, players):
+    return {
+        'room_code': room['room_code'],
+        'host': room['host'],
+        'players': players,
+        'game_started': bool(room['game_started']),
+        'question_goal': room['question_goal'],
+        'max_players': room['max_players'],
+        'winners': json_codec.loads(room['winners']) if room['winners'] else [],
+        'difficulty': room['difficulty'],
+        'categories': json_codec.loads(room['categories']) if room['categories'] else [],
+        'last_active': room['last_active'],
+        'creation_time': room['creation_time'],
+    }
 
 def get_room(room_code):
-    with closing(sqlite3.connect(DATABASE)) as conn:
-        conn.row_factory = sqlite3.Row
+    with _connection(room_code) as conn:
         with conn:
             room = conn.execute('SELECT * FROM rooms WHERE room_code = ?', (room_code,)).fetchone()
             if room:
-                return {
-                    'room_code': room['room_code'],
-                    'host': room['host'],
-                    'players': json.loads(room['players']) if room['players'] else [],
-                    'game_started': bool(room['game_started']),
-                    'question_goal': room['question_goal'],
-                    'max_players': room['max_players'],
-                    'winners': json.loads(room['winners']) if room['winners'] else [],
-                    'difficulty': room['difficulty'],
-                    'categories': json.loads(room['categories']) if room['categories'] else [],
-                    'last_active': room['last_active'],
-                    'creation_time': room['creation_time'],
-                }
+                players = conn.execute('''
+                    SELECT player_name FROM room_players WHERE room_code = ? ORDER BY position
+                ''', (room_code,)).fetchall()
+                return _room_from_row(room, [player[0] for player in players])
             return None
 
 def get_all_rooms():
-    with closing(sqlite3.connect(DATABASE)) as conn:
-        conn.row_factory = sqlite3.Row
+    def query(conn):
         with conn:
             rooms = conn.execute('SELECT * FROM rooms').fetchall()
-            return [{
-                'room_code': room['room_code'],
-                'host': room['host'],
-                'players': json.loads(room['players']) if room['players'] else [],
-                'game_started': bool(room['game_started']),
-                'question_goal': room['question_goal'],
-                'max_players': room['max_players'],
-                'winners': json.loads(room['winners']) if room['winners'] else [],
-                'difficulty': room['difficulty'],
-                'categories': json.loads(room['categories']) if room['categories'] else [],
-                'last_active': room['last_active'],
-                'creation_time': room['creation_time'],
-            } for room in rooms]
+            players = {}
+            for room_code, player_name in conn.execute('''
+                SELECT room_code, player_name FROM room_players ORDER BY room_code, position
+            '''):
+                players.setdefault(room_code, []).append(player_name)
+            return [_room_from_row(room, players.get(room['room_code'], [])) for room in rooms]
+    return [room for rooms in _scatter(query) for room in rooms]
+
+def _set_players(conn, room_code, players):
+    """Replace a room's membership with the given list, keeping its order."""
+    now = time.time()
+    conn.execute('DELETE FROM room_players WHERE room_code = ?', (room_code,))
+    conn.executemany('''
+        INSERT OR IGNORE INTO room_players (room_code, player_name, position, joined_at)
+        SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM rooms WHERE room_code = ?)
+    ''', [(room_code, player_name, position, now, room_code) for position, player_name in enumerate(players)])
+
+def _apply_roster_changes(conn, room_code, joined, left):
+    """Apply the leaves, then the joins, since the last flush, one player at a time.
+
+    joined is a list of (player_name, joined_at) in join order; each is added
+    after the room's current last position. Everyone else keeps their row,
+    so joined_at and positions survive the flush.
+    """
+    conn.executemany('DELETE FROM room_players WHERE room_code = ? AND player_name = ?',
+                     [(room_code, player_name) for player_name in left])
+    conn.executemany('''
+        INSERT OR IGNORE INTO room_players (room_code, player_name, position, joined_at)
+        SELECT r.room_code, ?,
+               (SELECT COALESCE(MAX(position), -1) + 1 FROM room_players WHERE room_code = r.room_code), ?
+        FROM rooms r WHERE r.room_code = ?
+    ''', [(player_name, joined_at, room_code) for player_name, joined_at in joined])
 
 def update_room(room_code, players=None, game_started=None, winners=None, last_active=None):
-    with closing(sqlite3.connect(DATABASE)) as conn:
+    with _connection(room_code) as conn:
         with conn:
             if players is not None:
-                players_json = json.dumps(players)
-                conn.execute('UPDATE rooms SET players = ? WHERE room_code = ?', (players_json, room_code))
+                _set_players(conn, room_code, players)
             if game_started is not None:
                 conn.execute('UPDATE rooms SET game_started = ? WHERE room_code = ?', (game_started, room_code))
             if winners is not None:
-                winners_json = json.dumps(winners)
+                winners_json = json_codec.dumps_str(winners)
                 conn.execute('UPDATE rooms SET winners = ? WHERE room_code = ?', (winners_json, room_code))
             if last_active is not None:
                 conn.execute('UPDATE rooms SET last_active = ? WHERE room_code = ?', (last_active, room_code))
 
+def _upsert_player(conn, room_code, player_name, now):
+    # Update existing player's timestamp without resetting score or wins
+    conn.execute('''
+        INSERT INTO player_scores (room_code, player_name, score, wins, timestamp)
+        VALUES (?, ?, 0, 0, ?)
+        ON CONFLICT(room_code, player_name) DO UPDATE SET timestamp = excluded.timestamp
+    ''', (room_code, player_name, now))
+
 def add_or_update_player(room_code, player_name):
-    with closing(sqlite3.connect(DATABASE)) as conn:
-        conn.row_factory = sqlite3.Row  # Set row_factory to sqlite3.Row
+    with _connection(room_code) as conn:
         with conn:
-            result = conn.execute('''
-                SELECT id, wins FROM player_scores WHERE room_code = ? AND player_name = ?
-            ''', (room_code, player_name)).fetchone()
-
-            if result is None:
-                conn.execute('''
-                    INSERT INTO player_scores (room_code, player_name, score, wins, timestamp)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (room_code, player_name, 0, 0, time.time()))
-            else:
-                # Update existing player's timestamp without resetting wins
-                wins = result['wins']  # This will now work
-                conn.execute('''
-                    UPDATE player_scores 
-                    SET timestamp = ?
-                    WHERE room_code = ? AND player_name = ?
-                ''', (time.time(), room_code, player_name))
-                print(f"Player {player_name} rejoined the room with {wins} wins.")
+            _upsert_player(conn, room_code, player_name, time.time())
 
 def increment_player_win(conn, room_code, player_name):
-    conn.execute('''
+    return conn.execute('''
         UPDATE player_scores
         SET wins = wins + 1, timestamp = ?
         WHERE room_code = ? AND player_name = ?
-    ''', (time.time(), room_code, player_name))
+    ''', (time.time(), room_code, player_name)).rowcount == 1
 
-def update_player_score(room_code, player_name, points_to_add, wins_to_add=0):
-    with closing(sqlite3.connect(DATABASE)) as conn:
+def update_player_score(room_code, player_name, points_to_add, wins_to_add=0, ranked=True):
+    """Add points and wins to a player's score. Returns the leaderboard rows added.
+
+    With ranked=False only the room's score changes, for client-reported
+    totals that must not reach the global leaderboard.
+    """
+    now = time.time()
+    with _connection(room_code) as conn:
         with conn:
-            conn.execute('''
+            updated = conn.execute('''
                 UPDATE player_scores 
                 SET score = score + ?, wins = wins + ?, timestamp = ?
                 WHERE room_code = ? AND player_name = ?
-            ''', (points_to_add, wins_to_add, time.time(), room_code, player_name))
+            ''', (points_to_add, wins_to_add, now, room_code, player_name)).rowcount
+            if not updated or not ranked:
+                return []
+            return _bump_leaderboard(conn, room_code, {player_name: (wins_to_add, points_to_add)}, now)
 
 def get_player_scores(room_code):
-    with closing(sqlite3.connect(DATABASE)) as conn:
+    with _connection(room_code) as conn:
         with conn:
             scores = conn.execute('''
                 SELECT player_name, score, wins FROM player_scores WHERE room_code = ?
@@ -137,58 +511,217 @@ def get_player_scores(room_code):
             return [{'player_name': score[0], 'score': score[1], 'wins': score[2]} for score in scores]
 
 def get_player_statistics(player_name):
-    with closing(sqlite3.connect(DATABASE)) as conn:
-        with conn:
-            stats = conn.execute('''
-                SELECT room_code, score, wins, timestamp FROM player_scores WHERE player_name = ?
-            ''', (player_name,)).fetchall()
-            return [{'room_code': stat[0], 'score': stat[1], 'wins': stat[2], 'timestamp': stat[3]} for stat in stats]
+    def query(conn):
+        return conn.execute('''
+            SELECT room_code, score, wins, timestamp FROM player_scores WHERE player_name = ?
+        ''', (player_name,)).fetchall()
+    return [
+        {'room_code': stat[0], 'score': stat[1], 'wins': stat[2], 'timestamp': stat[3]}
+        for stats in _scatter(query) for stat in stats
+    ]
 
 def add_player_to_room(room_code, player_name):
-    room = get_room(room_code)
-    if room:
-        # Allow rejoining if player was already in the room
-        if player_name in room['players']:
-            update_room(room_code, last_active=time.time())
-            add_or_update_player(room_code, player_name)
-            return True
-
-        # Allow adding new player if room isn't full and (game hasn't started or game has ended)
-        if len(room['players']) < room['max_players'] and (not room['game_started'] or room['winners']):
-            room['players'].append(player_name)
-            update_room(room_code, players=room['players'], last_active=time.time())
-            add_or_update_player(room_code, player_name)
-            return True
-    return False
+    now = time.time()
+    with _connection(room_code) as conn:
+        with conn:
+            # Allow rejoining if player was already in the room
+            joined = conn.execute('''
+                SELECT 1 FROM room_players WHERE room_code = ? AND player_name = ?
+            ''', (room_code, player_name)).fetchone() is not None
+            if not joined:
+                # Allow adding new player if room isn't full and (game hasn't started or game has ended).
+                # Checking and inserting in one statement keeps concurrent joins from overfilling the room.
+                joined = conn.execute('''
+                    INSERT OR IGNORE INTO room_players (room_code, player_name, position, joined_at)
+                    SELECT r.room_code, ?,
+                           (SELECT COALESCE(MAX(position), -1) + 1 FROM room_players WHERE room_code = r.room_code), ?
+                    FROM rooms r
+                    WHERE r.room_code = ?
+                      AND (NOT r.game_started OR COALESCE(r.winners, '[]') != '[]')
+                      AND (SELECT COUNT(*) FROM room_players WHERE room_code = r.room_code) < r.max_players
+                ''', (player_name, now, room_code)).rowcount == 1
+            if joined:
+                conn.execute('UPDATE rooms SET last_active = ? WHERE room_code = ?', (now, room_code))
+                _upsert_player(conn, room_code, player_name, now)
+            return joined
 
 def remove_player_from_room(room_code, player_name):
-    room = get_room(room_code)
-    if room and player_name in room['players']:
-        room['players'].remove(player_name)
-        update_room(room_code, players=room['players'], last_active=time.time())
-        return True
-    return False
-
-def end_game(room_code, winners):
-    with closing(sqlite3.connect(DATABASE)) as conn:
+    with _connection(room_code) as conn:
+        with conn:
+            removed = conn.execute('''
+                DELETE FROM room_players WHERE room_code = ? AND player_name = ?
+            ''', (room_code, player_name)).rowcount == 1
+            if removed:
+                conn.execute('UPDATE rooms SET last_active = ? WHERE room_code = ?', (time.time(), room_code))
+            return removed
+
+def _game_players(conn, room_code):
+    """The roster as stored, for callers that don't pass the live one."""
+    return [row[0] for row in conn.execute('''
+        SELECT player_name FROM room_players WHERE room_code = ? ORDER BY position
+    ''', (room_code,))]
+
+def _record_games(games, now):
+    """Count finished games, given as (players, winners) pairs, in player_stats.
+
+    Each player's row lives in shard_for(player_name), so this runs after the
+    room's own transaction, with one transaction per stats shard.
+    """
+    by_shard = {}
+    for players, winners in games:
+        for player_name in players:
+            won = 1 if player_name in winners else 0
+            by_shard.setdefault(shard_for(player_name), []).append((player_name, won, won, won, now))
+    for shard, rows in by_shard.items():
+        with get_pool(shard).connection() as conn:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO player_stats (player_name, games_played, games_won, current_streak, best_streak, last_played)
+                    VALUES (?, 1, ?, ?, ?, ?)
+                    ON CONFLICT(player_name) DO UPDATE SET
+                        games_played = games_played + 1,
+                        games_won = games_won + excluded.games_won,
+                        current_streak = CASE WHEN excluded.games_won THEN current_streak + 1 ELSE 0 END,
+                        best_streak = MAX(best_streak, CASE WHEN excluded.games_won THEN current_streak + 1 ELSE 0 END),
+                        last_played = excluded.last_played
+                ''', rows)
+
+def get_player_summary(player_name):
+    """Totals over every finished game the player took part in."""
+    with _connection(player_name) as conn:
+        row = conn.execute('''
+            SELECT games_played, games_won, current_streak, best_streak, last_played
+            FROM player_stats WHERE player_name = ?
+        ''', (player_name,)).fetchone()
+    games_played, games_won, current_streak, best_streak, last_played = row if row else (0, 0, 0, 0, None)
+    return {
+        'games_played': games_played,
+        'games_won': games_won,
+        'win_rate': games_won / games_played if games_played else 0.0,
+        'current_streak': current_streak,
+        'best_streak': best_streak,
+        'last_played': last_played,
+    }
+
+def get_player_history(player_name, cursor=None, limit=20):
+    """One page of the player's player_scores rows, most recently played first.
+
+    Rows are ordered by (timestamp, room_code), newest first. Pass the
+    returned cursor back to get the next page; it is None on the last page.
+    Each shard reads at most limit + 1 rows off the player index. Raises
+    ValueError for a cursor this function didn't return.
+    """
+    if cursor:
+        timestamp, separator, room_code = cursor.partition(':')
+        if not separator:
+            raise ValueError(f'Invalid cursor {cursor!r}')
+        after = (float(timestamp), room_code)
+    else:
+        after = (float('inf'), '')
+
+    def query(conn):
+        return conn.execute('''
+            SELECT room_code, score, wins, timestamp FROM player_scores
+            WHERE player_name = ? AND (timestamp < ? OR (timestamp = ? AND room_code < ?))
+            ORDER BY timestamp DESC, room_code DESC LIMIT ?
+        ''', (player_name, after[0], after[0], after[1], limit + 1)).fetchall()
+    rows = sorted((row for rows in _scatter(query) for row in rows), key=lambda row: (row[3], row[0]), reverse=True)
+    page = [{'room_code': row[0], 'score': row[1], 'wins': row[2], 'timestamp': row[3]} for row in rows[:limit]]
+    next_cursor = f"{page[-1]['timestamp']!r}:{page[-1]['room_code']}" if len(rows) > limit else None
+    return page, next_cursor
+
+def end_game(room_code, winners, players=None):
+    """End the game and credit the winners. Returns the leaderboard rows added.
+
+    players is the room's roster for player_stats. Pass the live one when
+    room_players may lag behind it (RoomStateStore writes membership behind);
+    if it is None the stored roster is used.
+    """
+    now = time.time()
+    with _connection(room_code) as conn:
         with conn:
-            winners_json = json.dumps(winners)
+            winners_json = json_codec.dumps_str(winners)
             conn.execute('''
                 UPDATE rooms SET game_started = ?, winners = ?, last_active = ?
                 WHERE room_code = ?
-            ''', (False, winners_json, time.time(), room_code))
+            ''', (False, winners_json, now, room_code))
             # Increment wins for each winner using the same connection
+            credited = {}
             for winner in winners:
-                increment_player_win(conn, room_code, winner)
+                if increment_player_win(conn, room_code, winner):
+                    credited[winner] = (credited.get(winner, (0, 0))[0] + 1, 0)
+            leaderboard = _bump_leaderboard(conn, room_code, credited, now)
+            if players is None:
+                players = _game_players(conn, room_code)
+    _record_games([(players, set(winners))], now)
+    return leaderboard
 
 def delete_room(room_code):
-    with closing(sqlite3.connect(DATABASE)) as conn:
+    with _connection(room_code) as conn:
         with conn:
-            conn.execute('DELETE FROM rooms WHERE room_code = ?', (room_code,))
+            deleted = conn.execute('DELETE FROM rooms WHERE room_code = ?', (room_code,)).rowcount == 1
+            conn.execute('DELETE FROM room_players WHERE room_code = ?', (room_code,))
             conn.execute('DELETE FROM player_scores WHERE room_code = ?', (room_code,))
+            return deleted
+
+def delete_rooms(room_codes):
+    """Delete several rooms, one transaction per shard. Returns the codes that existed."""
+    by_shard = {}
+    for room_code in room_codes:
+        by_shard.setdefault(shard_for(room_code), []).append(room_code)
+    deleted = []
+    for shard, codes in by_shard.items():
+        with get_pool(shard).connection() as conn:
+            with conn:
+                cursor = conn.execute('''
+                    DELETE FROM rooms WHERE room_code IN (SELECT value FROM json_each(?)) RETURNING room_code
+                ''', (json_codec.dumps_str(codes),))
+                deleted.extend(row[0] for row in cursor.fetchall())
+                conn.executemany('DELETE FROM room_players WHERE room_code = ?', [(code,) for code in codes])
+                conn.executemany('DELETE FROM player_scores WHERE room_code = ?', [(code,) for code in codes])
+    return deleted
+
+def delete_expired_rooms(cutoff, room_codes=None):
+    """Delete every room idle since before cutoff, one transaction per shard.
+
+    Uses the last_active index, so the cost depends on the number of expired
+    rooms rather than the size of the table. If room_codes is given, only
+    those rooms are candidates. Returns the deleted room codes.
+    """
+    candidates = None
+    if room_codes is not None:
+        candidates = [[] for _ in get_pools()]
+        for room_code in room_codes:
+            candidates[shard_for(room_code)].append(room_code)
+    deleted = []
+    for shard, pool in enumerate(get_pools()):
+        if candidates is not None and not candidates[shard]:
+            continue
+        with pool.connection() as conn:
+            with conn:
+                if candidates is None:
+                    cursor = conn.execute('DELETE FROM rooms WHERE last_active < ? RETURNING room_code', (cutoff,))
+                else:
+                    cursor = conn.execute('''
+                        DELETE FROM rooms WHERE last_active < ? AND room_code IN (SELECT value FROM json_each(?))
+                        RETURNING room_code
+                    ''', (cutoff, json_codec.dumps_str(candidates[shard])))
+                codes = [row[0] for row in cursor.fetchall()]
+                if codes:
+                    conn.executemany('DELETE FROM room_players WHERE room_code = ?', [(code,) for code in codes])
+                    conn.executemany('DELETE FROM player_scores WHERE room_code = ?', [(code,) for code in codes])
+        deleted.extend(codes)
+    return deleted
+
+def count_rooms():
+    return sum(_scatter(lambda conn: conn.execute('SELECT COUNT(*) FROM rooms').fetchone()[0]))
+
+def get_room_codes():
+    shards = _scatter(lambda conn: [row[0] for row in conn.execute('SELECT room_code FROM rooms')])
+    return [code for codes in shards for code in codes]
 
 def get_game_history(room_code):
-    with closing(sqlite3.connect(DATABASE)) as conn:
+    with _connection(room_code) as conn:
         with conn:
             history = conn.execute('''
                 SELECT player_name, score, wins, timestamp
@@ -196,6 +729,37 @@ def get_game_history(room_code):
             ''', (room_code,)).fetchall()
             return [{'player_name': entry[0], 'score': entry[1], 'wins': entry[2], 'timestamp': entry[3]} for entry in history]
 
+def append_events(rows):
+    """Append (room_code, seq, kind, data_json) rows, one transaction per shard."""
+    by_shard = {}
+    for row in rows:
+        by_shard.setdefault(shard_for(row[0]), []).append(row)
+    for shard, shard_rows in by_shard.items():
+        with get_pool(shard).connection() as conn:
+            with conn:
+                conn.executemany('''
+                    INSERT OR IGNORE INTO game_events (room_code, seq, kind, data) VALUES (?, ?, ?, ?)
+                ''', shard_rows)
+
+def read_events(room_code, since=None, until=None, limit=None):
+    """A room's events with since <= time < until (unix seconds), oldest first."""
+    low = round(since * 1_000_000) if since is not None else 0
+    high = round(until * 1_000_000) if until is not None else 2 ** 63 - 1
+    with _connection(room_code) as conn:
+        rows = conn.execute('''
+            SELECT seq, kind, data FROM game_events
+            WHERE room_code = ? AND seq >= ? AND seq < ? ORDER BY seq LIMIT ?
+        ''', (room_code, low, high, limit if limit is not None else -1)).fetchall()
+    return [{'room_code': room_code, 'seq': seq, 'time': seq / 1_000_000, 'kind': kind, 'data': json_codec.loads(data)}
+            for seq, kind, data in rows]
+
+def delete_old_events(cutoff):
+    """Drop events from before cutoff on every shard. Returns how many were deleted."""
+    def query(conn):
+        with conn:
+            return conn.execute('DELETE FROM game_events WHERE seq < ?', (round(cutoff * 1_000_000),)).rowcount
+    return sum(_scatter(query))
+
 def start_game(room_code):
     """Starts the game and ensures all players are added to player_scores."""
     room = get_room(room_code)
@@ -204,17 +768,153 @@ def start_game(room_code):
         for player_name in room['players']:
             add_or_update_player(room_code, player_name)
 
-        with closing(sqlite3.connect(DATABASE)) as conn:
+        with _connection(room_code) as conn:
             with conn:
                 conn.execute('''
                     UPDATE rooms SET game_started = ?, last_active = ?
                     WHERE room_code = ?
                 ''', (True, time.time(), room_code))
 
+def load_room_state(room_code):
+    """Load a room together with all of its player_scores rows in one connection."""
+    with _connection(room_code):
+        room = get_room(room_code)
+        if room is None:
+            return None
+        room['scores'] = get_game_history(room_code)
+        return room
+
+def save_room_states(snapshots):
+    """Write a batch of in-memory room snapshots, one transaction per shard.
+
+    Only the write-behind columns are written: the players who joined or left
+    since the last flush, last_active and score timestamps, plus player_scores
+    rows for players who joined since the last flush. Scores, wins and the game phase are written through by
+    record_answer, start_game and end_game, so a stale snapshot can never roll
+    them back. Rooms that were deleted in the meantime are skipped.
+    """
+    by_shard = {}
+    for snapshot in snapshots:
+        by_shard.setdefault(shard_for(snapshot['room_code']), []).append(snapshot)
+    for shard, shard_snapshots in by_shard.items():
+        room_rows = []
+        score_rows = []
+        for snapshot in shard_snapshots:
+            room_code = snapshot['room_code']
+            room_rows.append((snapshot['last_active'], room_code))
+            for player_name, score, wins, timestamp in snapshot['scores']:
+                score_rows.append((room_code, player_name, score, wins, timestamp, room_code))
+        with get_pool(shard).connection() as conn:
+            with conn:
+                conn.executemany('UPDATE rooms SET last_active = ? WHERE room_code = ?', room_rows)
+                for snapshot in shard_snapshots:
+                    _apply_roster_changes(conn, snapshot['room_code'], snapshot['joined'], snapshot['left'])
+                conn.executemany('''
+                    INSERT INTO player_scores (room_code, player_name, score, wins, timestamp)
+                    SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM rooms WHERE room_code = ?)
+                    ON CONFLICT(room_code, player_name) DO UPDATE SET timestamp = excluded.timestamp
+                ''', score_rows)
+
+def _score_rows(conn, room_code):
+    rows = conn.execute('''
+        SELECT player_name, score, wins, timestamp FROM player_scores WHERE room_code = ?
+    ''', (room_code,)).fetchall()
+    return [{'player_name': row[0], 'score': row[1], 'wins': row[2], 'timestamp': row[3]} for row in rows]
+
+def _record_answer(conn, now, room_code, player_name, is_correct, players=None):
+    room = conn.execute('''
+        SELECT question_goal, game_started FROM rooms WHERE room_code = ?
+    ''', (room_code,)).fetchone()
+    if room is None:
+        return None
+    if is_correct:
+        row = conn.execute('''
+            UPDATE player_scores SET score = score + 1, timestamp = ?
+            WHERE room_code = ? AND player_name = ?
+            RETURNING score
+        ''', (now, room_code, player_name)).fetchone()
+    else:
+        row = conn.execute('''
+            SELECT score FROM player_scores WHERE room_code = ? AND player_name = ?
+        ''', (room_code, player_name)).fetchone()
+    score = row['score'] if row else None
+    reached_goal = score is not None and score >= room['question_goal']
+    game_ended = reached_goal and bool(room['game_started'])
+    if game_ended:
+        conn.execute('''
+            UPDATE rooms SET game_started = ?, winners = ? WHERE room_code = ?
+        ''', (False, json_codec.dumps_str([player_name]), room_code))
+        increment_player_win(conn, room_code, player_name)
+    delta = (1 if game_ended else 0, 1 if is_correct and row else 0)
+    leaderboard = _bump_leaderboard(conn, room_code, {player_name: delta}, now)
+    return {'score': score, 'reached_goal': reached_goal, 'game_ended': game_ended, 'last_active': now,
+            'leaderboard': leaderboard,
+            'players': (list(players) if players is not None else _game_players(conn, room_code)) if game_ended else None}
+
+def record_answer(room_code, player_name, is_correct):
+    """Score one answer in a single transaction.
+
+    Bumps last_active, adds the point and, if the player reached the room's
+    question_goal while the game is running, ends the game with the player as
+    the only winner. Answers are applied under SQLite's write lock, so two
+    players crossing the goal at the same moment can't both win.
+
+    Returns None if the room does not exist, otherwise a dict with the player's
+    score, whether the goal was reached, whether this answer ended the game,
+    the leaderboard rows it added and every player_scores row of the room.
+    """
+    return record_answers([(room_code, player_name, is_correct)])[0]
+
+def record_answers(answers):
+    """Score a batch of (room_code, player_name, is_correct[, players]) answers.
+
+    players is the room's roster, counted in player_stats if the answer ends
+    the game; as with end_game(), the stored roster is used without it.
+
+    Each shard's answers are applied in order in one transaction, so a burst
+    of answers costs one commit per shard instead of one per answer, and the
+    first answer in the batch to reach a room's goal is the only winner.
+    last_active is written with a single executemany per shard. Returns one
+    record_answer() result per answer, in the same order.
+    """
+    now = time.time()
+    results = [None] * len(answers)
+    by_shard = {}
+    for index, answer in enumerate(answers):
+        by_shard.setdefault(shard_for(answer[0]), []).append(index)
+    for shard, indexes in by_shard.items():
+        with get_pool(shard).connection() as conn:
+            with conn:
+                # The first statement takes the write lock for the whole batch
+                room_codes = list(dict.fromkeys(answers[index][0] for index in indexes))
+                conn.executemany('UPDATE rooms SET last_active = ? WHERE room_code = ?',
+                                 [(now, room_code) for room_code in room_codes])
+                for index in indexes:
+                    results[index] = _record_answer(conn, now, *answers[index])
+                scores = {room_code: _score_rows(conn, room_code) for room_code in room_codes}
+        games = []
+        for index in indexes:
+            result = results[index]
+            if result is not None:
+                result['scores'] = scores[answers[index][0]]
+                if result['game_ended']:
+                    games.append((result['players'], {answers[index][1]}))
+        if games:
+            _record_games(games, now)
+    return results
+
 # Unit tests
 class TestTriviaGameDatabase(unittest.TestCase):
     def setUp(self):
-        init_db()
+        database = temporary_database()
+        database.__enter__()
+        self.addCleanup(database.__exit__, None, None, None)
+
+    def execute_on_shards(self, sql):
+        def execute(conn):
+            with conn:
+                conn.execute(sql)
+        _scatter(execute)
 
     def test_add_and_get_room(self):
         add_room('room1', 'host1', 10, 4, 'easy', categories=[9, 10, 11])
@@ -435,5 +1135,340 @@ class TestTriviaGameDatabase(unittest.TestCase):
         self.assertEqual(player23['wins'], 1)
         self.assertEqual(host16['wins'], 0)
 
+    def test_connections_are_reused(self):
+        add_room('room17', 'host17', 10, 4, 'easy')
+        pool = get_pool()
+        created = pool.created
+        for _ in range(5):
+            get_room('room17')
+            get_player_scores('room17')
+        self.assertEqual(pool.created, created)
+        with _connection() as conn:
+            mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode, 'wal')
+
+    def test_pool_shared_across_threads(self):
+        add_room('room18', 'host18', 10, 4, 'easy')
+        errors = []
+
+        def worker(n):
+            try:
+                add_player_to_room('room18', f'player{n}')
+                get_player_scores('room18')
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(POOL_SIZE * 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(get_pool().created, POOL_SIZE)
+
+    def test_save_room_states(self):
+        add_room('room19', 'host19', 10, 4, 'easy')
+        state = load_room_state('room19')
+        self.assertEqual([entry['player_name'] for entry in state['scores']], ['host19'])
+        save_room_states([{
+            'room_code': 'room19',
+            'joined': [('player24', 120.0)],
+            'left': [],
+            'game_started': True,
+            'winners': [],
+            'last_active': 123.0,
+            'scores': [('host19', 2, 1, 123.0), ('player24', 1, 0, 123.0)],
+        }, {
+            'room_code': 'missing_room',
+            'joined': [('ghost', 120.0)],
+            'left': [],
+            'game_started': False,
+            'winners': [],
+            'last_active': 123.0,
+            'scores': [('ghost', 0, 0, 123.0)],
+        }])
+        room = get_room('room19')
+        self.assertEqual(room['players'], ['host19', 'player24'])
+        self.assertFalse(room['game_started'])  # game phase is written through, not behind
+        self.assertEqual(room['last_active'], 123.0)
+        scores = {score['player_name']: score for score in get_player_scores('room19')}
+        self.assertEqual(scores['host19']['score'], 0)  # existing scores are never overwritten
+        self.assertEqual(scores['host19']['wins'], 0)
+        self.assertEqual(scores['player24']['score'], 1)  # new rows are inserted as-is
+        self.assertIsNone(get_room('missing_room'))
+        self.assertEqual(get_player_scores('missing_room'), [])
+
+        def joined_at():
+            with _connection('room19') as conn:
+                return dict(conn.execute('''
+                    SELECT player_name, joined_at FROM room_players WHERE room_code = 'room19'
+                ''').fetchall())
+
+        before = joined_at()
+        self.assertEqual(before['player24'], 120.0)
+        # player24 leaves and rejoins, player25 joins: host19's row is left alone
+        save_room_states([{
+            'room_code': 'room19', 'joined': [('player24', 130.0), ('player25', 131.0)], 'left': ['player24'],
+            'last_active': 131.0, 'scores': [],
+        }])
+        self.assertEqual(get_room('room19')['players'], ['host19', 'player24', 'player25'])
+        after = joined_at()
+        self.assertEqual(after['host19'], before['host19'])
+        self.assertEqual((after['player24'], after['player25']), (130.0, 131.0))
+
+    def test_record_answer(self):
+        add_room('room20', 'host20', 2, 3, 'easy')
+        add_player_to_room('room20', 'player25')
+        start_game('room20')
+        result = record_answer('room20', 'player25', True)
+        self.assertEqual(result['score'], 1)
+        self.assertFalse(result['reached_goal'])
+        self.assertFalse(result['game_ended'])
+        result = record_answer('room20', 'player25', False)
+        self.assertEqual(result['score'], 1)
+        result = record_answer('room20', 'player25', True)
+        self.assertTrue(result['reached_goal'])
+        self.assertTrue(result['game_ended'])
+        room = get_room('room20')
+        self.assertFalse(room['game_started'])
+        self.assertEqual(room['winners'], ['player25'])
+        player25 = next(entry for entry in result['scores'] if entry['player_name'] == 'player25')
+        self.assertEqual(player25['wins'], 1)
+        self.assertIsNone(record_answer('missing_room', 'player25', True))
+
+    def test_record_answers_batch(self):
+        add_room('room26', 'host26', 2, 4, 'easy')
+        add_player_to_room('room26', 'player27')
+        add_room('room27', 'host27', 5, 4, 'easy')
+        start_game('room26')
+        results = record_answers([
+            ('room26', 'host26', True),
+            ('room27', 'host27', True),
+            ('room26', 'player27', True),
+            ('room26', 'player27', True),
+            ('room26', 'host26', True),
+            ('missing_room', 'ghost', True),
+        ])
+        self.assertEqual([result and result['score'] for result in results], [1, 1, 1, 2, 2, None])
+        # Applied in order: player27 reaches the goal first and is the only winner
+        self.assertEqual([result and result['game_ended'] for result in results], [False, False, False, True, False, None])
+        self.assertEqual(get_room('room26')['winners'], ['player27'])
+        self.assertEqual(len(results[0]['scores']), 2)
+        self.assertEqual(results[1]['scores'][0]['score'], 1)
+
+    def test_record_answer_single_winner(self):
+        add_room('room21', 'host21', 1, 3, 'hard')
+        add_player_to_room('room21', 'player26')
+        start_game('room21')
+        first = record_answer('room21', 'host21', True)
+        second = record_answer('room21', 'player26', True)
+        self.assertTrue(first['game_ended'])
+        self.assertTrue(second['reached_goal'])
+        self.assertFalse(second['game_ended'])
+        self.assertEqual(get_room('room21')['winners'], ['host21'])
+        wins = {score['player_name']: score['wins'] for score in get_player_scores('room21')}
+        self.assertEqual(wins, {'host21': 1, 'player26': 0})
+
+    def test_add_player_to_room_keeps_join_order(self):
+        add_room('room22', 'host22', 10, 4, 'easy')
+        add_player_to_room('room22', 'player27')
+        add_player_to_room('room22', 'player28')
+        remove_player_from_room('room22', 'player27')
+        add_player_to_room('room22', 'player27')
+        self.assertEqual(get_room('room22')['players'], ['host22', 'player28', 'player27'])
+        self.assertFalse(remove_player_from_room('room22', 'nobody'))
+
+    def test_migrate_db(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'old.db')
+            with closing(sqlite3.connect(path)) as conn:
+                with conn:
+                    conn.executescript('''
+                        CREATE TABLE rooms (
+                            room_code TEXT PRIMARY KEY, host TEXT NOT NULL, players TEXT,
+                            game_started BOOLEAN, question_goal INTEGER, max_players INTEGER,
+                            winners TEXT, difficulty TEXT, categories TEXT,
+                            last_active REAL, creation_time REAL
+                        );
+                        CREATE TABLE player_scores (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT, room_code TEXT NOT NULL,
+                            player_name TEXT NOT NULL, score INTEGER NOT NULL DEFAULT 0,
+                            wins INTEGER NOT NULL DEFAULT 0, timestamp REAL NOT NULL
+                        );
+                        INSERT INTO rooms VALUES ('OLD1', 'host', '["host", "guest"]', 0, 10, 4, '[]', 'easy', '[]', 1.0, 1.0);
+                        INSERT INTO player_scores (room_code, player_name, score, wins, timestamp) VALUES
+                            ('OLD1', 'host', 3, 1, 1.0), ('OLD1', 'guest', 2, 0, 1.0), ('OLD1', 'guest', 0, 0, 2.0);
+                    ''')
+            self.assertEqual(migrate_db(path), 0)
+            self.assertEqual(migrate_db(path), SCHEMA_VERSION)
+            with closing(sqlite3.connect(path)) as conn:
+                columns = [row[1] for row in conn.execute('PRAGMA table_info(rooms)')]
+                members = conn.execute('''
+                    SELECT player_name FROM room_players WHERE room_code = 'OLD1' ORDER BY position
+                ''').fetchall()
+                scores = conn.execute('''
+                    SELECT player_name, score FROM player_scores ORDER BY id
+                ''').fetchall()
+                stats = conn.execute('SELECT player_name, games_played, games_won FROM player_stats').fetchall()
+            self.assertNotIn('players', columns)
+            self.assertEqual([member[0] for member in members], ['host', 'guest'])
+            self.assertEqual(scores, [('host', 3), ('guest', 2)])
+            self.assertEqual(sorted(stats), [('guest', 1, 0), ('host', 1, 1)])
+
+    def test_restart_keeps_leaderboard(self):
+        add_room('room31', 'host31', 10, 4, 'easy')
+        update_player_score('room31', 'host31', 3)
+        end_game('room31', ['host31'])
+        before = sorted(load_leaderboard())
+        # What a server start does, on a current file and on one from an older version
+        self.assertEqual(migrate_db(), SCHEMA_VERSION)
+        self.execute_on_shards('PRAGMA user_version = 5')
+        self.assertEqual(migrate_db(), 5)
+        self.assertEqual(sorted(load_leaderboard()), before)
+        self.assertIn(('all', 'host31', 1, 3), before)
+
+    def test_migrate_seeds_player_stats(self):
+        add_room('room32', 'host32', 10, 4, 'easy')
+        add_player_to_room('room32', 'guest32')
+        end_game('room32', ['host32'])
+        end_game('room32', ['host32'])
+        add_room('room33', 'host33', 10, 4, 'easy')
+        add_player_to_room('room33', 'guest32')
+        # A database from before version 7, whose player_stats is empty
+        self.execute_on_shards('DELETE FROM player_stats')
+        self.execute_on_shards('PRAGMA user_version = 6')
+        self.assertEqual(migrate_db(), 6)
+        self.assertEqual(get_player_summary('host32')['games_played'], 2)
+        self.assertEqual(get_player_summary('host32')['games_won'], 2)
+        # Both games in room32; room33 has had none yet
+        self.assertEqual(get_player_summary('guest32')['games_played'], 2)
+        migrate_db()
+        self.execute_on_shards('PRAGMA user_version = 6')
+        migrate_db()
+        self.assertEqual(get_player_summary('host32')['games_played'], 2)
+
+    def test_delete_expired_rooms(self):
+        add_room('room23', 'host23', 10, 4, 'easy')
+        add_room('room24', 'host24', 10, 4, 'easy')
+        add_room('room25', 'host25', 10, 4, 'easy')
+        update_room('room23', last_active=100.0)
+        update_room('room24', last_active=200.0)
+        self.assertEqual(count_rooms(), 3)
+        self.assertEqual(sorted(delete_expired_rooms(150.0)), ['room23'])
+        self.assertEqual(sorted(delete_expired_rooms(250.0)), ['room24'])
+        self.assertEqual(delete_expired_rooms(250.0), [])
+        update_room('room25', last_active=300.0)
+        self.assertEqual(delete_expired_rooms(350.0, room_codes=['room24', 'other']), [])
+        self.assertEqual(count_rooms(), 1)
+        self.assertEqual(get_room_codes(), ['room25'])
+        self.assertEqual(delete_expired_rooms(350.0, room_codes=['room25']), ['room25'])
+        self.assertIsNone(get_room('room23'))
+        self.assertEqual(get_player_scores('room24'), [])
+        self.assertIsNone(get_room('room25'))
+
+    def test_delete_rooms(self):
+        add_room('room28', 'host28', 10, 4, 'easy')
+        add_room('room29', 'host29', 10, 4, 'easy')
+        add_room('room30', 'host30', 10, 4, 'easy')
+        self.assertEqual(sorted(delete_rooms(['room28', 'room30', 'missing'])), ['room28', 'room30'])
+        self.assertEqual(get_room_codes(), ['room29'])
+        self.assertEqual(get_player_scores('room28'), [])
+        self.assertEqual(delete_rooms([]), [])
+
+    def test_game_events(self):
+        append_events([
+            ('room26', 1_000_000, 'create', json.dumps({'host': 'host26'})),
+            ('room26', 2_000_000, 'join', json.dumps({'player': 'guest'})),
+            ('room26', 3_000_000, 'leave', json.dumps({'player': 'guest'})),
+            ('room27', 2_500_000, 'create', json.dumps({'host': 'host27'})),
+        ])
+        events = read_events('room26')
+        self.assertEqual([event['kind'] for event in events], ['create', 'join', 'leave'])
+        self.assertEqual(events[1]['data'], {'player': 'guest'})
+        self.assertEqual(events[1]['time'], 2.0)
+        self.assertEqual([event['seq'] for event in read_events('room26', since=2.0, until=3.0)], [2_000_000])
+        self.assertEqual(len(read_events('room26', limit=2)), 2)
+        self.assertEqual(delete_old_events(2.5), 2)
+        self.assertEqual([event['kind'] for event in read_events('room26')], ['leave'])
+        self.assertEqual(len(read_events('room27')), 1)
+
+    def test_leaderboard_rows(self):
+        add_room('room28', 'host28', 10, 4, 'medium', categories=[21])
+        add_player_to_room('room28', 'player28')
+        self.assertEqual(update_player_score('room28', 'ghost', 5), [])
+        self.assertEqual(update_player_score('room28', 'host28', 0, 9, ranked=False), [])
+        rows = update_player_score('room28', 'player28', 4)
+        day = leaderboard_day()
+        self.assertEqual(sorted(rows), sorted([
+            ('all', 'player28', 0, 4), (f'daily:{day}', 'player28', 0, 4),
+            ('difficulty:medium', 'player28', 0, 4), ('category:21', 'player28', 0, 4),
+        ]))
+        self.assertEqual(len(end_game('room28', ['player28'])), 4)
+        totals = {(board, name): (wins, points) for board, name, wins, points in load_leaderboard()}
+        self.assertEqual(totals[('category:21', 'player28')], (1, 4))
+        self.assertNotIn(('all', 'host28'), totals)
+        self.assertEqual(load_leaderboard(day='2000-01-01').count(('all', 'player28', 1, 4)), 1)
+        self.assertNotIn((f'daily:{day}', 'player28', 1, 4), load_leaderboard(day='2000-01-01'))
+
+    def test_player_summary_and_history(self):
+        for n in range(3):
+            add_room(f'room3{n}', 'host30', 10, 4, 'easy')
+            add_player_to_room(f'room3{n}', 'player30')
+        self.assertEqual(get_player_summary('player30')['games_played'], 0)
+        end_game('room30', ['player30'])
+        end_game('room31', ['player30'])
+        end_game('room32', ['host30'])
+        start_game('room30')
+        record_answers([('room30', 'player30', True)] * 10)
+        summary = get_player_summary('player30')
+        self.assertEqual(summary['games_played'], 4)
+        self.assertEqual(summary['games_won'], 3)
+        self.assertEqual(summary['win_rate'], 0.75)
+        self.assertEqual(summary['best_streak'], 2)
+        self.assertEqual(summary['current_streak'], 1)
+        self.assertEqual(get_player_summary('host30')['current_streak'], 0)
+        # room31 and room32 tie on time, room30 was played last
+        self.execute_on_shards('''
+            UPDATE player_scores SET timestamp = CASE room_code WHEN 'room30' THEN 300.5 ELSE 200.25 END
+            WHERE player_name = 'player30'
+        ''')
+        page, cursor = get_player_history('player30', limit=2)
+        self.assertEqual([entry['room_code'] for entry in page], ['room30', 'room32'])
+        page, cursor = get_player_history('player30', cursor=cursor, limit=2)
+        self.assertEqual([entry['room_code'] for entry in page], ['room31'])
+        self.assertIsNone(cursor)
+        with self.assertRaises(ValueError):
+            get_player_history('player30', cursor='room31')
+
+    def test_sharded_storage(self):
+        database = DATABASE
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                configure_pool(database=os.path.join(tmp, 'trivia.db'), shards=4)
+                init_db()
+                codes = [f'SHARD{n}' for n in range(12)]
+                for code in codes:
+                    add_room(code, 'host', 10, 4, 'easy')
+                    add_player_to_room(code, 'walker')
+                self.assertTrue(all(os.path.exists(os.path.join(tmp, f'trivia-{shard}.db')) for shard in range(4)))
+                self.assertEqual({shard_for(code) for code in codes}, {0, 1, 2, 3})
+                # Each room lives only in its own shard
+                for shard, pool in enumerate(get_pools()):
+                    with pool.connection() as conn:
+                        stored = {row[0] for row in conn.execute('SELECT room_code FROM rooms')}
+                    self.assertEqual(stored, {code for code in codes if shard_for(code) == shard})
+                self.assertEqual(count_rooms(), 12)
+                self.assertEqual(sorted(room['room_code'] for room in get_all_rooms()), sorted(codes))
+                self.assertEqual(sorted(stat['room_code'] for stat in get_player_statistics('walker')), sorted(codes))
+                save_room_states([{
+                    'room_code': code, 'joined': [], 'left': ['walker'], 'last_active': 50.0, 'scores': [],
+                } for code in codes[:6]])
+                self.assertEqual(get_room(codes[0])['players'], ['host'])
+                self.assertEqual(sorted(delete_expired_rooms(100.0)), sorted(codes[:6]))
+                self.assertEqual(count_rooms(), 6)
+            finally:
+                close_pool()
+                configure_pool(database=database, shards=1)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
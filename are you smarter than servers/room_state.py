@@ -0,0 +1,742 @@
+import asyncio
+import json
+import logging
+import time
+import unittest
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from room_db import (
+    add_room,
+    delete_room,
+    delete_rooms,
+    end_game,
+    get_player_scores,
+    get_player_summary,
+    get_pool,
+    get_room,
+    load_leaderboard,
+    load_room_state,
+    record_answers,
+    save_room_states,
+    shard_for,
+    start_game,
+    temporary_database,
+    update_player_score,
+)
+import json_codec
+from db_executor import db
+from event_log import GameEventLog, replay
+from leaderboard import Leaderboard
+from metrics import waited
+from write_coalescer import SCORE_WRITE_WINDOW, WriteCoalescer
+
+logger = logging.getLogger(__name__)
+
+# Write-behind settings
+FLUSH_INTERVAL = 1.0     # seconds between background flushes
+FLUSH_BATCH_SIZE = 200   # rooms written per transaction
+
+# Deltas kept per room for sync_room; older clients get a full snapshot instead
+CHANGE_LOG_SIZE = 64
+
+# Distinguishes this process's ETags from those of a previous run, whose
+# versions started from the same numbers
+SNAPSHOT_EPOCH = format(time.time_ns(), 'x')
+
+class PlayerScore:
+    """A player's row in player_scores, kept in memory."""
+    __slots__ = ('score', 'wins', 'timestamp')
+
+    def __init__(self, score: int = 0, wins: int = 0, timestamp: Optional[float] = None):
+        self.score = score
+        self.wins = wins
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+class RoomState:
+    """In-memory copy of a rooms row plus its player_scores rows."""
+    __slots__ = (
+        'room_code', 'host', 'players', 'game_started', 'question_goal', 'max_players',
+        'winners', 'difficulty', 'categories', 'last_active', 'creation_time', 'scores',
+        'joined', 'left', 'version', 'changes', 'encoded',
+    )
+
+    def __init__(self, room_code: str, host: str, players: List[str], game_started: bool,
+                 question_goal: int, max_players: int, winners: List[str], difficulty: str,
+                 categories: List[int], last_active: float, creation_time: float):
+        self.room_code = room_code
+        self.host = host
+        self.players = players
+        self.game_started = game_started
+        self.question_goal = question_goal
+        self.max_players = max_players
+        self.winners = winners
+        self.difficulty = difficulty
+        self.categories = categories
+        self.last_active = last_active
+        self.creation_time = creation_time
+        self.scores: Dict[str, PlayerScore] = {}
+        # Membership changes not yet written: who joined (and when), in order, and who left
+        self.joined: Dict[str, float] = {}
+        self.left = set()
+        self.version = 1
+        self.changes = deque(maxlen=CHANGE_LOG_SIZE)
+        self.encoded: Dict[str, Tuple[int, str, bytes]] = {}
+
+    @classmethod
+    def from_db(cls, row: dict) -> 'RoomState':
+        room = cls(
+            row['room_code'], row['host'], row['players'], row['game_started'],
+            row['question_goal'], row['max_players'], row['winners'], row['difficulty'],
+            row['categories'], row['last_active'], row['creation_time'],
+        )
+        for entry in row.get('scores', []):
+            room.scores[entry['player_name']] = PlayerScore(entry['score'], entry['wins'], entry['timestamp'])
+        return room
+
+    def to_dict(self) -> dict:
+        """Same shape as room_db.get_room()."""
+        return {
+            'room_code': self.room_code,
+            'host': self.host,
+            'players': list(self.players),
+            'game_started': self.game_started,
+            'question_goal': self.question_goal,
+            'max_players': self.max_players,
+            'winners': list(self.winners),
+            'difficulty': self.difficulty,
+            'categories': list(self.categories),
+            'last_active': self.last_active,
+            'creation_time': self.creation_time,
+        }
+
+    def score_list(self) -> List[dict]:
+        """Same shape as room_db.get_player_scores()."""
+        return [{'player_name': name, 'score': entry.score, 'wins': entry.wins}
+                for name, entry in self.scores.items()]
+
+    def player_wins(self) -> Dict[str, int]:
+        return {name: entry.wins for name, entry in self.scores.items()}
+
+    def full_state(self) -> dict:
+        """Everything a client needs to rebuild the room, tagged with its version."""
+        state = self.to_dict()
+        state['player_scores'] = self.score_list()
+        state['version'] = self.version
+        return state
+
+    def changes_since(self, version: int) -> Optional[List[dict]]:
+        """Deltas newer than version, or None if the log no longer reaches back that far."""
+        if version >= self.version:
+            return [] if version == self.version else None
+        if not self.changes or self.changes[0]['version'] > version + 1:
+            return None
+        return [delta for delta in self.changes if delta['version'] > version]
+
+    def etag(self) -> str:
+        return f'"{SNAPSHOT_EPOCH}.{int(self.creation_time * 1000):x}.{self.version}"'
+
+    def encoded_view(self, view: str, build: Callable[['RoomState'], dict]) -> Tuple[str, bytes]:
+        """ETag and JSON body of build(room), encoded once per room version.
+
+        Every visible change goes through RoomStateStore._changed(), which bumps
+        the version, so a cached body is reused until the room changes. Fields
+        that change without a new version (last_active on a touch) are as of
+        the last version.
+        """
+        cached = self.encoded.get(view)
+        if cached is None or cached[0] != self.version:
+            body = json_codec.dumps(build(self))
+            cached = (self.version, self.etag(), body)
+            self.encoded[view] = cached
+        return cached[1], cached[2]
+
+    def snapshot(self) -> dict:
+        """The write-behind state for save_room_states, taking the joins and leaves since the last snapshot."""
+        joined, self.joined = self.joined, {}
+        left, self.left = self.left, set()
+        return {
+            'room_code': self.room_code,
+            'joined': list(joined.items()),
+            'left': sorted(left),
+            'last_active': self.last_active,
+            'scores': [(name, entry.score, entry.wins, entry.timestamp) for name, entry in self.scores.items()],
+        }
+
+    def restore(self, snapshot: dict):
+        """Put back the joins and leaves of a snapshot that could not be written."""
+        joined = {name: at for name, at in snapshot['joined'] if name not in self.left}
+        joined.update(self.joined)
+        self.joined = joined
+        self.left.update(snapshot['left'])
+
+class RoomStateStore:
+    """Authoritative in-memory state for live rooms with write-behind to SQLite.
+
+    All methods must be called from the event loop. Membership changes and
+    activity apply to memory immediately and mark the room dirty; flush() writes
+    dirty rooms in batches. Room creation and deletion, scores, wins and the
+    game phase are written through and mirrored into memory afterwards.
+
+    Every visible change bumps the room's version and is passed to on_change as
+    a delta of the fields that changed, so callers can push it to clients.
+    If owner_check is set, get() calls it first so it can refuse rooms owned
+    by another worker. If leaderboard is set, the leaderboard rows written
+    with each score change are applied to it. on_game_over is called with the
+    room whenever a game ends. If event_log is set, every membership change,
+    game phase, answer and score change is appended to it (see event_log.py);
+    appending only queues the event, so it adds no database work here.
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, batch_size: int = FLUSH_BATCH_SIZE,
+                 answer_window: float = SCORE_WRITE_WINDOW):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # Answers arriving within answer_window of each other share one transaction
+        self._answers = WriteCoalescer(record_answers, answer_window)
+        self._rooms: Dict[str, RoomState] = {}
+        self._dirty = set()
+        self._deletions = 0
+        self._flush_lock = asyncio.Lock()
+        self.on_change: Optional[Callable[[RoomState, dict], None]] = None
+        self.owner_check: Optional[Callable[[str], None]] = None
+        self.leaderboard = None
+        self.on_game_over: Optional[Callable[[RoomState], None]] = None
+        self.event_log = None
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def __contains__(self, room_code):
+        return room_code in self._rooms
+
+    async def get(self, room_code: str) -> Optional[RoomState]:
+        """Return the room from memory, loading it from the database on a miss."""
+        if self.owner_check is not None:
+            self.owner_check(room_code)
+        room = self._rooms.get(room_code)
+        if room is not None:
+            return room
+        deletions = self._deletions
+        row = await db.run(load_room_state, room_code)
+        if row is None:
+            return None
+        room = self._rooms.get(room_code)
+        if room is not None:
+            return room
+        room = RoomState.from_db(row)
+        # Don't cache a row that may have been deleted while we were loading it
+        if deletions == self._deletions:
+            self._rooms[room_code] = room
+        return room
+
+    async def create(self, room_code: str, host: str, question_goal: int, max_players: int,
+                     difficulty: str, categories: Optional[List[int]] = None) -> RoomState:
+        """Insert the room into the database and keep it resident."""
+        await db.run(add_room, room_code, host, question_goal, max_players, difficulty, categories)
+        now = time.time()
+        room = RoomState(room_code, host, [host], False, question_goal, max_players, [],
+                         difficulty, list(categories or []), now, now)
+        room.scores[host] = PlayerScore(timestamp=now)
+        self._rooms[room_code] = room
+        self._event(room_code, 'create', host=host, question_goal=question_goal, max_players=max_players,
+                    difficulty=difficulty, categories=list(categories or []))
+        return room
+
+    def discard(self, room_code: str):
+        """Drop a room that is already gone from the database."""
+        room = self._rooms.pop(room_code, None)
+        self._dirty.discard(room_code)
+        self._deletions += 1
+        if room is not None:
+            self._changed(room, deleted=True)
+        self._event(room_code, 'delete')
+
+    async def delete(self, room_code: str) -> bool:
+        """Delete a room. Returns False if it did not exist in the database."""
+        self.discard(room_code)
+        return await db.run(delete_room, room_code)
+
+    async def delete_many(self, room_codes: List[str]) -> List[str]:
+        """Delete several rooms in one database call. Returns the codes that existed."""
+        for room_code in room_codes:
+            self.discard(room_code)
+        return await db.run(delete_rooms, room_codes)
+
+    def _event(self, room_code: str, kind: str, **data):
+        if self.event_log is not None:
+            self.event_log.append(room_code, kind, **data)
+
+    def _changed(self, room: RoomState, **changes):
+        room.version += 1
+        delta = {'room_code': room.room_code, 'version': room.version, 'changes': changes}
+        room.changes.append(delta)
+        if self.on_change is not None:
+            self.on_change(room, delta)
+
+    def _score_changes(self, room: RoomState, player_names) -> dict:
+        return {name: {'score': room.scores[name].score, 'wins': room.scores[name].wins}
+                for name in player_names if name in room.scores}
+
+    def touch(self, room: RoomState):
+        room.last_active = time.time()
+        self._dirty.add(room.room_code)
+
+    def add_or_update_player(self, room: RoomState, player_name: str):
+        entry = room.scores.get(player_name)
+        if entry is None:
+            room.scores[player_name] = PlayerScore()
+        else:
+            entry.timestamp = time.time()
+        self._dirty.add(room.room_code)
+
+    def add_player(self, room: RoomState, player_name: str) -> bool:
+        """Same rules as room_db.add_player_to_room()."""
+        if player_name in room.players:
+            self.touch(room)
+            if player_name not in room.scores:
+                self.add_or_update_player(room, player_name)
+                self._changed(room, scores=self._score_changes(room, [player_name]))
+            else:
+                self.add_or_update_player(room, player_name)
+            return True
+        if len(room.players) < room.max_players and (not room.game_started or room.winners):
+            room.players.append(player_name)
+            room.joined[player_name] = time.time()
+            self.touch(room)
+            self.add_or_update_player(room, player_name)
+            self._event(room.room_code, 'join', player=player_name)
+            self._changed(room, players=list(room.players),
+                          scores=self._score_changes(room, [player_name]))
+            return True
+        return False
+
+    def remove_player(self, room: RoomState, player_name: str) -> bool:
+        if player_name in room.players:
+            room.players.remove(player_name)
+            room.joined.pop(player_name, None)
+            room.left.add(player_name)
+            self.touch(room)
+            self._event(room.room_code, 'leave', player=player_name)
+            self._changed(room, players=list(room.players))
+            return True
+        return False
+
+    def _add_points(self, room: RoomState, player_name: str, points_to_add: int, wins_to_add: int):
+        entry = room.scores.get(player_name)
+        if entry is None:
+            # Mirrors the UPDATE in room_db, which is a no-op for unknown players
+            return None
+        entry.score += points_to_add
+        entry.wins += wins_to_add
+        entry.timestamp = time.time()
+        return entry
+
+    async def _write_through(self, room: RoomState, fn, *args):
+        """Flush the room's pending changes and run fn(*args) in one database hop."""
+        async with waited(self._flush_lock, 'room_flush'):
+            calls = []
+            if room.room_code in self._dirty:
+                self._dirty.discard(room.room_code)
+                snapshot = room.snapshot()
+                calls.append((save_room_states, [snapshot]))
+            try:
+                results = await db.pipeline(*calls, (fn, *args))
+            except Exception:
+                if calls and room.room_code in self._rooms:
+                    room.restore(snapshot)
+                    self._dirty.add(room.room_code)
+                raise
+        return results[-1]
+
+    def _rank(self, rows: List[tuple]):
+        if self.leaderboard is not None and rows:
+            self.leaderboard.apply(rows)
+
+    async def update_player_score(self, room: RoomState, player_name: str, points_to_add: int, wins_to_add: int = 0,
+                                  ranked: bool = True):
+        self._rank(await self._write_through(
+            room, update_player_score, room.room_code, player_name, points_to_add, wins_to_add, ranked))
+        entry = self._add_points(room, player_name, points_to_add, wins_to_add)
+        if entry is not None:
+            self._changed(room, scores=self._score_changes(room, [player_name]))
+            self._event(room.room_code, 'score', player=player_name, points=points_to_add, wins=wins_to_add)
+        return entry
+
+    async def start_game(self, room: RoomState):
+        # Flush first so players who joined since the last flush get their score rows
+        await self._write_through(room, start_game, room.room_code)
+        now = time.time()
+        for player_name in room.players:
+            entry = room.scores.get(player_name)
+            if entry is None:
+                room.scores[player_name] = PlayerScore(timestamp=now)
+            else:
+                entry.timestamp = now
+        room.game_started = True
+        room.last_active = now
+        self._event(room.room_code, 'start')
+        self._changed(room, game_started=True, scores=self._score_changes(room, room.players))
+
+    async def end_game(self, room: RoomState, winners: List[str]):
+        self._rank(await self._write_through(room, end_game, room.room_code, winners, list(room.players)))
+        room.game_started = False
+        room.winners = list(winners)
+        for winner in winners:
+            self._add_points(room, winner, 0, 1)
+        self._event(room.room_code, 'end', winners=list(winners))
+        room.last_active = time.time()
+        self._changed(room, game_started=False, winners=list(room.winners),
+                      scores=self._score_changes(room, winners))
+        if self.on_game_over is not None:
+            self.on_game_over(room)
+
+    async def record_answer(self, room_code: str, player_name: str, is_correct: bool) -> Optional[dict]:
+        """Score an answer through the batched room_db.record_answers and mirror the result."""
+        if self.owner_check is not None:
+            self.owner_check(room_code)
+        # The roster goes along so a game this answer ends is counted for the players in memory,
+        # who may not have been flushed to room_players yet
+        room = self._rooms.get(room_code)
+        players = list(room.players) if room is not None else None
+        result = await self._answers.submit((room_code, player_name, is_correct, players))
+        if result is None:
+            return None
+        self._rank(result['leaderboard'])
+        self._event(room_code, 'answer', player=player_name, correct=bool(is_correct))
+        if result['game_ended']:
+            self._event(room_code, 'end', winners=[player_name])
+        room = self._rooms.get(room_code)
+        if room is not None:
+            changed = []
+            for entry in result['scores']:
+                name = entry['player_name']
+                score = room.scores.get(name)
+                if score is None:
+                    room.scores[name] = PlayerScore(entry['score'], entry['wins'], entry['timestamp'])
+                    changed.append(name)
+                else:
+                    if score.score != entry['score'] or score.wins != entry['wins']:
+                        changed.append(name)
+                    score.score = entry['score']
+                    score.wins = entry['wins']
+                    score.timestamp = entry['timestamp']
+            room.last_active = result['last_active']
+            changes = {}
+            if changed:
+                changes['scores'] = self._score_changes(room, changed)
+            if result['game_ended']:
+                room.game_started = False
+                room.winners = [player_name]
+                changes['game_started'] = False
+                changes['winners'] = [player_name]
+            if changes:
+                self._changed(room, **changes)
+            if result['game_ended'] and self.on_game_over is not None:
+                self.on_game_over(room)
+        return result
+
+    def _take_batch(self) -> List[dict]:
+        batch = []
+        while self._dirty and len(batch) < self.batch_size:
+            room = self._rooms.get(self._dirty.pop())
+            if room is not None:
+                batch.append(room.snapshot())
+        return batch
+
+    async def flush(self) -> int:
+        """Write every dirty room to the database. Returns the number of rooms written."""
+        await self._answers.drain()
+        written = 0
+        async with waited(self._flush_lock, 'room_flush'):
+            while self._dirty:
+                batch = self._take_batch()
+                if not batch:
+                    continue
+                try:
+                    await db.run(save_room_states, batch)
+                except Exception as e:
+                    logger.error("Failed to flush %s rooms, will retry: %s", len(batch), e)
+                    # Put the rooms back unless they were deleted in the meantime
+                    for snapshot in batch:
+                        room = self._rooms.get(snapshot['room_code'])
+                        if room is not None:
+                            room.restore(snapshot)
+                            self._dirty.add(room.room_code)
+                    break
+                written += len(batch)
+        return written
+
+    async def run(self):
+        """Background task that flushes dirty rooms every flush_interval seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+# Unit tests
+class TestRoomStateStore(unittest.TestCase):
+    def setUp(self):
+        database = temporary_database()
+        database.__enter__()
+        self.addCleanup(database.__exit__, None, None, None)
+
+    def test_mutations_are_written_behind(self):
+        async def scenario():
+            store = RoomStateStore()
+            await store.create('room1', 'host1', 3, 4, 'easy', [9])
+            room = await store.get('room1')
+            self.assertTrue(store.add_player(room, 'player1'))
+            self.assertTrue(store.add_player(room, 'player2'))
+            store.remove_player(room, 'player2')
+            # Nothing reaches the database until a flush
+            self.assertEqual(get_room('room1')['players'], ['host1'])
+            self.assertEqual(await store.flush(), 1)
+            self.assertEqual(await store.flush(), 0)
+
+        asyncio.run(scenario())
+        room = get_room('room1')
+        self.assertEqual(room['players'], ['host1', 'player1'])
+        scores = {score['player_name']: score['score'] for score in get_player_scores('room1')}
+        self.assertEqual(scores, {'host1': 0, 'player1': 0, 'player2': 0})
+
+    def test_flush_writes_only_joins_and_leaves(self):
+        def joined_at():
+            with get_pool(shard_for('room12')).connection() as conn:
+                return dict(conn.execute('''
+                    SELECT player_name, joined_at FROM room_players WHERE room_code = 'room12'
+                ''').fetchall())
+
+        async def scenario():
+            store = RoomStateStore()
+            room = await store.create('room12', 'host12', 3, 4, 'easy')
+            store.add_player(room, 'player1')
+            await store.flush()
+            before = joined_at()
+            store.remove_player(room, 'player1')
+            store.add_player(room, 'player2')
+            store.add_player(room, 'player1')
+
+            # A snapshot that fails to save is put back, merged with what happened since
+            failed = room.snapshot()
+            store.remove_player(room, 'player2')
+            room.restore(failed)
+            self.assertEqual(list(room.joined), ['player1'])
+            self.assertEqual(room.left, {'player1', 'player2'})
+
+            await store.flush()
+            return before
+
+        before = asyncio.run(scenario())
+        self.assertEqual(get_room('room12')['players'], ['host12', 'player1'])
+        after = joined_at()
+        self.assertEqual(after['host12'], before['host12'])
+        self.assertGreater(after['player1'], before['player1'])
+
+    def test_answers_are_written_through(self):
+        async def scenario():
+            store = RoomStateStore()
+            room = await store.create('room5', 'host5', 2, 3, 'easy')
+            store.add_player(room, 'player4')
+            await store.start_game(room)
+            self.assertTrue(get_room('room5')['game_started'])
+            await store.record_answer('room5', 'player4', True)
+            self.assertEqual(room.scores['player4'].score, 1)
+            result = await store.record_answer('room5', 'player4', True)
+            self.assertTrue(result['game_ended'])
+            self.assertFalse(room.game_started)
+            self.assertEqual(room.winners, ['player4'])
+            self.assertEqual(room.scores['player4'].wins, 1)
+            self.assertIsNone(await store.record_answer('missing', 'player4', True))
+
+        asyncio.run(scenario())
+        wins = {score['player_name']: score['wins'] for score in get_player_scores('room5')}
+        self.assertEqual(wins, {'host5': 0, 'player4': 1})
+
+    def test_finished_games_count_the_players_in_memory(self):
+        async def scenario():
+            store = RoomStateStore()
+            answered = await store.create('room13', 'host13', 1, 3, 'easy')
+            store.add_player(answered, 'player13')
+            ended = await store.create('room14', 'host14', 5, 3, 'easy')
+            store.add_player(ended, 'player14')
+            await store.start_game(answered)
+            await store.start_game(ended)
+            # The hosts leave mid-game; room_players still lists them until the next flush
+            store.remove_player(answered, 'host13')
+            store.remove_player(ended, 'host14')
+            result = await store.record_answer('room13', 'player13', True)
+            self.assertEqual(result['players'], ['player13'])
+            await store.end_game(ended, ['player14'])
+
+        asyncio.run(scenario())
+        for host, player in (('host13', 'player13'), ('host14', 'player14')):
+            self.assertEqual(get_player_summary(host)['games_played'], 0)
+            self.assertEqual(get_player_summary(player)['games_won'], 1)
+
+    def test_score_changes_reach_the_leaderboard(self):
+        async def scenario():
+            store = RoomStateStore()
+            store.leaderboard = Leaderboard()
+            room = await store.create('room10', 'host10', 1, 4, 'hard', [9])
+            store.add_player(room, 'player10')
+            await store.start_game(room)
+            await store.record_answer('room10', 'player10', True)
+            await store.update_player_score(room, 'host10', 3)
+            self.assertEqual(store.leaderboard.rank('player10')['wins'], 1)
+            self.assertEqual(store.leaderboard.rank('host10', 'category:9')['points'], 3)
+            entries, _ = store.leaderboard.top('difficulty:hard')
+            self.assertEqual([entry['player_name'] for entry in entries], ['player10', 'host10'])
+            return store.leaderboard.top('all')
+
+        entries, total = asyncio.run(scenario())
+        reloaded = Leaderboard()
+        reloaded.load(load_leaderboard())
+        self.assertEqual(reloaded.top('all'), (entries, total))
+
+    def test_events_replay_to_the_live_room(self):
+        async def scenario():
+            store = RoomStateStore()
+            store.event_log = GameEventLog()
+            room = await store.create('room12', 'host12', 1, 4, 'easy', [9])
+            store.add_player(room, 'player12')
+            store.add_player(room, 'player13')
+            store.remove_player(room, 'player13')
+            await store.start_game(room)
+            await store.record_answer('room12', 'host12', False)
+            await store.record_answer('room12', 'player12', True)
+            await store.update_player_score(room, 'host12', 2)
+            return room, await store.event_log.read('room12')
+
+        room, events = asyncio.run(scenario())
+        rebuilt = replay(events)
+        self.assertEqual(rebuilt['players'], room.players)
+        self.assertEqual(rebuilt['winners'], room.winners)
+        self.assertEqual(rebuilt['game_started'], room.game_started)
+        self.assertEqual(rebuilt['scores']['player12'], {'score': 1, 'wins': 1})
+        self.assertEqual(rebuilt['scores']['host12'], {'score': 2, 'wins': 0})
+        self.assertEqual(rebuilt['games'][0]['winners'], ['player12'])
+
+    def test_simultaneous_answers_share_a_batch(self):
+        async def scenario():
+            store = RoomStateStore(answer_window=0.01)
+            room = await store.create('room9', 'host9', 1, 4, 'easy')
+            store.add_player(room, 'player9')
+            await store.start_game(room)
+            results = await asyncio.gather(
+                store.record_answer('room9', 'host9', True),
+                store.record_answer('room9', 'player9', True),
+            )
+            self.assertEqual([result['game_ended'] for result in results], [True, False])
+            self.assertEqual(room.winners, ['host9'])
+            self.assertEqual(room.scores['player9'].score, 1)
+
+        asyncio.run(scenario())
+
+    def test_loads_room_on_miss(self):
+        add_room('room2', 'host2', 5, 2, 'hard')
+
+        async def scenario():
+            store = RoomStateStore()
+            room = await store.get('room2')
+            self.assertIn('room2', store)
+            self.assertIs(await store.get('room2'), room)
+            self.assertIsNone(await store.get('missing'))
+            return room
+
+        room = asyncio.run(scenario())
+        self.assertEqual(room.players, ['host2'])
+        self.assertEqual(room.score_list(), [{'player_name': 'host2', 'score': 0, 'wins': 0}])
+
+    def test_answers_check_the_owner(self):
+        add_room('room11', 'host11', 5, 2, 'easy')
+
+        def refuse(room_code):
+            raise LookupError(room_code)
+
+        async def scenario():
+            store = RoomStateStore()
+            store.owner_check = refuse
+            with self.assertRaises(LookupError):
+                await store.record_answer('room11', 'host11', True)
+
+        asyncio.run(scenario())
+        self.assertEqual(get_player_scores('room11')[0]['score'], 0)
+
+    def test_deleted_room_is_not_recreated(self):
+        async def scenario():
+            store = RoomStateStore()
+            room = await store.create('room3', 'host3', 5, 2, 'medium')
+            store.add_player(room, 'player2')
+            await store.delete('room3')
+            await store.flush()
+
+        asyncio.run(scenario())
+        self.assertIsNone(get_room('room3'))
+        self.assertEqual(get_player_scores('room3'), [])
+
+    def test_end_game_increments_wins(self):
+        async def scenario():
+            store = RoomStateStore()
+            room = await store.create('room4', 'host4', 5, 3, 'easy')
+            store.add_player(room, 'player3')
+            await store.start_game(room)
+            await store.end_game(room, ['player3'])
+            self.assertEqual(room.player_wins(), {'host4': 0, 'player3': 1})
+
+        asyncio.run(scenario())
+        room = get_room('room4')
+        self.assertFalse(room['game_started'])
+        self.assertEqual(room['winners'], ['player3'])
+        wins = {score['player_name']: score['wins'] for score in get_player_scores('room4')}
+        self.assertEqual(wins, {'host4': 0, 'player3': 1})
+
+    def test_encoded_views_follow_the_version(self):
+        async def scenario():
+            store = RoomStateStore()
+            room = await store.create('room13', 'host13', 3, 4, 'easy')
+            builds = []
+
+            def build(room):
+                builds.append(room.version)
+                return {'players': room.players}
+
+            etag, body = room.encoded_view('players', build)
+            self.assertEqual(json.loads(body), {'players': ['host13']})
+            self.assertEqual(room.encoded_view('players', build), (etag, body))
+            store.touch(room)
+            self.assertEqual(room.encoded_view('players', build)[0], etag)
+            store.add_player(room, 'player14')
+            new_etag, body = room.encoded_view('players', build)
+            self.assertNotEqual(new_etag, etag)
+            self.assertEqual(json.loads(body), {'players': ['host13', 'player14']})
+            self.assertEqual(len(builds), 2)
+
+        asyncio.run(scenario())
+
+    def test_changes_are_versioned(self):
+        deltas = []
+
+        async def scenario():
+            store = RoomStateStore()
+            store.on_change = lambda room, delta: deltas.append(delta)
+            room = await store.create('room6', 'host6', 1, 3, 'easy')
+            store.add_player(room, 'player5')
+            store.add_player(room, 'player5')  # rejoin is not a visible change
+            await store.start_game(room)
+            await store.record_answer('room6', 'player5', True)
+            return room
+
+        room = asyncio.run(scenario())
+        self.assertEqual([delta['version'] for delta in deltas], [2, 3, 4])
+        self.assertEqual(deltas[0]['changes']['players'], ['host6', 'player5'])
+        self.assertTrue(deltas[1]['changes']['game_started'])
+        self.assertEqual(deltas[2]['changes']['winners'], ['player5'])
+        self.assertEqual(deltas[2]['changes']['scores'], {'player5': {'score': 1, 'wins': 1}})
+        self.assertEqual(room.changes_since(2), deltas[1:])
+        self.assertEqual(room.changes_since(4), [])
+        self.assertIsNone(room.changes_since(7))
+        room.changes.popleft()
+        self.assertIsNone(room.changes_since(1))
+
+if __name__ == '__main__':
+    unittest.main()
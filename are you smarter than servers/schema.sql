@@ -3,7 +3,6 @@
 CREATE TABLE IF NOT EXISTS rooms (
     room_code TEXT PRIMARY KEY,
     host TEXT NOT NULL,  -- Make host field required
-    players TEXT,
     game_started BOOLEAN,
     question_goal INTEGER,
     max_players INTEGER,
@@ -14,6 +13,21 @@ CREATE TABLE IF NOT EXISTS rooms (
     creation_time REAL
 );
 
+-- Lets the expiry sweep find idle rooms without scanning the table
+CREATE INDEX IF NOT EXISTS idx_rooms_last_active ON rooms(last_active);
+
+-- One row per player currently in a room; position keeps join order
+CREATE TABLE IF NOT EXISTS room_players (
+    room_code TEXT NOT NULL,
+    player_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    joined_at REAL NOT NULL,
+    PRIMARY KEY (room_code, player_name),
+    FOREIGN KEY(room_code) REFERENCES rooms(room_code) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_room_players_position ON room_players(room_code, position);
+
 CREATE TABLE IF NOT EXISTS player_scores (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     room_code TEXT NOT NULL,
@@ -23,3 +37,40 @@ CREATE TABLE IF NOT EXISTS player_scores (
     timestamp REAL NOT NULL,
     FOREIGN KEY(room_code) REFERENCES rooms(room_code) ON DELETE CASCADE
 );
+
+-- One score row per player per room; also serves lookups by room_code
+CREATE UNIQUE INDEX IF NOT EXISTS idx_player_scores_room_player ON player_scores(room_code, player_name);
+-- Covering index for get_player_history, most recent rooms first
+CREATE INDEX IF NOT EXISTS idx_player_scores_recent ON player_scores(player_name, timestamp, room_code, score, wins);
+
+-- Running wins and points per player per ranking ('all', 'daily:<day>',
+-- 'difficulty:<level>', 'category:<id>'), updated with every score change
+CREATE TABLE IF NOT EXISTS leaderboard (
+    board TEXT NOT NULL,
+    player_name TEXT NOT NULL,
+    wins INTEGER NOT NULL DEFAULT 0,
+    points INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    PRIMARY KEY (board, player_name)
+) WITHOUT ROWID;
+
+-- Per-player totals over finished games, stored in the shard of player_name
+CREATE TABLE IF NOT EXISTS player_stats (
+    player_name TEXT PRIMARY KEY,
+    games_played INTEGER NOT NULL DEFAULT 0,
+    games_won INTEGER NOT NULL DEFAULT 0,
+    current_streak INTEGER NOT NULL DEFAULT 0,  -- games won in a row, up to the last one
+    best_streak INTEGER NOT NULL DEFAULT 0,
+    last_played REAL
+) WITHOUT ROWID;
+
+-- Append-only log of what happened in each room (see event_log.py). seq is a
+-- microsecond timestamp, unique per room, so range reads by room and time
+-- are primary key scans
+CREATE TABLE IF NOT EXISTS game_events (
+    room_code TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL,  -- JSON object
+    PRIMARY KEY (room_code, seq)
+) WITHOUT ROWID;
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+import unittest
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Room locks are shared by rooms whose codes hash alike; more stripes, fewer unrelated rooms waiting on each other
+SESSION_LOCK_STRIPES = int(os.environ.get('SESSION_LOCK_STRIPES', 64))
+
+class SessionRegistry:
+    """Which player each Socket.IO session on this worker belongs to.
+
+    Kept as two indexes, sid -> (room_code, player_name) and
+    room_code -> {player_name: sid}, so lookups either way and listing a
+    room's sessions are O(1) and never wait. The indexes are only changed by
+    synchronous methods, so they are consistent at every await.
+
+    lock(room_code) serializes membership decisions for one room (join_game
+    and disconnect) without blocking other rooms. Hold it only while reading
+    and changing in-memory state; database and cluster backend calls belong
+    outside it. A player has at most one session: binding a new sid replaces
+    the old one, and unbinding a replaced sid leaves the player in place.
+    """
+
+    def __init__(self, stripes: int = SESSION_LOCK_STRIPES):
+        self._by_sid: Dict[str, Tuple[str, str]] = {}
+        self._by_room: Dict[str, Dict[str, str]] = {}
+        self._locks = [asyncio.Lock() for _ in range(max(stripes, 1))]
+
+    def __len__(self):
+        return len(self._by_sid)
+
+    def lock(self, room_code: str) -> asyncio.Lock:
+        return self._locks[zlib.crc32(room_code.encode('utf-8')) % len(self._locks)]
+
+    def bind(self, sid: str, room_code: str, player_name: str) -> Optional[str]:
+        """Attach sid to a player. Returns the player's previous sid, if it had another."""
+        self.unbind(sid)
+        players = self._by_room.setdefault(room_code, {})
+        previous = players.get(player_name)
+        if previous is not None and previous != sid:
+            self._by_sid.pop(previous, None)
+        players[player_name] = sid
+        self._by_sid[sid] = (room_code, player_name)
+        return previous if previous != sid else None
+
+    def unbind(self, sid: str) -> Optional[Tuple[str, str]]:
+        """Detach sid. Returns its (room_code, player_name), or None if it wasn't bound."""
+        session = self._by_sid.pop(sid, None)
+        if session is None:
+            return None
+        room_code, player_name = session
+        players = self._by_room.get(room_code)
+        if players is not None and players.get(player_name) == sid:
+            del players[player_name]
+            if not players:
+                del self._by_room[room_code]
+        return session
+
+    def lookup(self, sid: str) -> Optional[Tuple[str, str]]:
+        return self._by_sid.get(sid)
+
+    def sid_for(self, room_code: str, player_name: str) -> Optional[str]:
+        return self._by_room.get(room_code, {}).get(player_name)
+
+    def sids(self, room_code: str) -> List[str]:
+        return list(self._by_room.get(room_code, {}).values())
+
+    def forget_room(self, room_code: str) -> List[str]:
+        """Drop every session in a deleted room and return their sids."""
+        sids = list(self._by_room.pop(room_code, {}).values())
+        for sid in sids:
+            self._by_sid.pop(sid, None)
+        return sids
+
+# Unit tests
+
+class TestSessionRegistry(unittest.TestCase):
+
+    def test_indexes(self):
+        sessions = SessionRegistry(stripes=4)
+        self.assertIsNone(sessions.bind('s1', 'ROOM01', 'alice'))
+        sessions.bind('s2', 'ROOM01', 'bob')
+        sessions.bind('s3', 'ROOM02', 'alice')
+        self.assertEqual(sessions.lookup('s2'), ('ROOM01', 'bob'))
+        self.assertEqual(sessions.sid_for('ROOM02', 'alice'), 's3')
+        self.assertEqual(sorted(sessions.sids('ROOM01')), ['s1', 's2'])
+        self.assertIs(sessions.lock('ROOM01'), sessions.lock('ROOM01'))
+
+        # alice reconnects to ROOM01 before the old session's disconnect arrives
+        self.assertEqual(sessions.bind('s4', 'ROOM01', 'alice'), 's1')
+        self.assertIsNone(sessions.unbind('s1'))
+        self.assertEqual(sessions.sid_for('ROOM01', 'alice'), 's4')
+
+        self.assertEqual(sessions.unbind('s2'), ('ROOM01', 'bob'))
+        self.assertIsNone(sessions.sid_for('ROOM01', 'bob'))
+        self.assertEqual(sorted(sessions.forget_room('ROOM01')), ['s4'])
+        self.assertEqual(sessions.sids('ROOM01'), [])
+        self.assertEqual(len(sessions), 1)
+
+    def test_rooms_do_not_wait_on_each_other(self):
+        sessions = SessionRegistry(stripes=64)
+        codes = [f'ROOM{i:02d}' for i in range(20)]
+        rooms = [code for code in codes if sessions.lock(code) is not sessions.lock(codes[0])][:1]
+        order = []
+
+        async def hold(code, delay):
+            async with sessions.lock(code):
+                await asyncio.sleep(delay)
+                order.append(code)
+
+        async def scenario():
+            await asyncio.gather(hold(codes[0], 0.05), hold(rooms[0], 0))
+
+        asyncio.run(scenario())
+        self.assertEqual(order, [rooms[0], codes[0]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import unittest
+from typing import Any, Callable, List, Tuple
+
+from db_executor import db
+from metrics import waited
+
+logger = logging.getLogger(__name__)
+
+# How long the first write of a batch waits for others to join it
+SCORE_WRITE_WINDOW = float(os.environ.get('SCORE_WRITE_WINDOW_MS', 5)) / 1000.0
+SCORE_WRITE_MAX_BATCH = 500  # a full batch is written right away
+
+class WriteCoalescer:
+    """Groups writes submitted within a short window into one batch call.
+
+    apply_batch(items) runs on the database executor and must return one
+    result per item, in order. Each submit() resolves with its own item's
+    result, or raises the batch's exception. Batches are applied one at a time
+    in submission order; writes that arrive while a batch is being written
+    join the next one.
+    """
+
+    def __init__(self, apply_batch: Callable[[List[Any]], List[Any]],
+                 window: float = SCORE_WRITE_WINDOW, max_batch: int = SCORE_WRITE_MAX_BATCH):
+        self.apply_batch = apply_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer = None
+        self._tasks = set()
+        self._lock = asyncio.Lock()
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._start_batch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_batch)
+        return await future
+
+    def _start_batch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._apply(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _apply(self, batch: List[Tuple[Any, asyncio.Future]]):
+        async with waited(self._lock, 'answer_batch'):
+            try:
+                results = await db.run(self.apply_batch, [item for item, _ in batch])
+            except Exception as e:
+                logger.error("Failed to write a batch of %s: %s", len(batch), e)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            logger.debug("Wrote a batch of %s", len(batch))
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def drain(self):
+        """Write everything submitted so far and wait for it."""
+        self._start_batch()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+# Unit tests
+
+class TestWriteCoalescer(unittest.TestCase):
+
+    def test_concurrent_writes_share_a_batch(self):
+        batches = []
+
+        def apply_batch(items):
+            batches.append(list(items))
+            return [item * 10 for item in items]
+
+        async def scenario():
+            coalescer = WriteCoalescer(apply_batch, window=0.01)
+            results = await asyncio.gather(*(coalescer.submit(n) for n in range(5)))
+            self.assertEqual(results, [0, 10, 20, 30, 40])
+            self.assertEqual(await coalescer.submit(7), 70)
+
+        asyncio.run(scenario())
+        self.assertEqual(batches, [[0, 1, 2, 3, 4], [7]])
+
+    def test_full_batch_is_written_immediately(self):
+        batches = []
+
+        def apply_batch(items):
+            batches.append(len(items))
+            return items
+
+        async def scenario():
+            coalescer = WriteCoalescer(apply_batch, window=60.0, max_batch=3)
+            self.assertEqual(await asyncio.gather(*(coalescer.submit(n) for n in range(3))), [0, 1, 2])
+
+        asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+        self.assertEqual(batches, [3])
+
+    def test_errors_reach_every_caller(self):
+        def apply_batch(items):
+            raise RuntimeError('disk full')
+
+        async def scenario():
+            coalescer = WriteCoalescer(apply_batch, window=0.001)
+            results = await asyncio.gather(coalescer.submit(1), coalescer.submit(2), return_exceptions=True)
+            self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+        asyncio.run(scenario())
+
+if __name__ == '__main__':
+    unittest.main()